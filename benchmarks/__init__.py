@@ -0,0 +1 @@
+"""Benchmarks for the exercise selector, saved data storage and workout timer."""
@@ -0,0 +1,316 @@
+"""Load test for the Streamlit app, driving many simulated sessions through Streamlit's app testing
+API in one process, to size deployments and catch regressions in the rerun path.
+
+Run it for a few session counts and write the results as JSON:
+
+    python -m benchmarks.load_test run --sessions 1 10 50 --output load.json
+
+Compare two result files like the benchmark suite's, failing if reruns got slower than the
+thresholds allow:
+
+    python -m benchmarks.suite compare load_baseline.json load.json
+
+Every session loads a saved workout and timer config, previews the workout and runs the timer on
+the server, pausing once along the way. The timers follow a simulated clock, and every simulated
+second each running timer reruns the app once, like the timer fragment does every second in a
+browser, so a minute of timers takes as long as the reruns do. Each session count is run in a
+process of its own, so memory from one count isn't carried over to the next.
+
+The app testing API runs the script without a browser or websocket, so the sessions one process
+can keep up with is an upper bound for a real server.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+APP = os.path.join(os.path.dirname(os.path.dirname(__file__)), "workout_generator.py")
+DEFAULT_SESSIONS = [1, 5, 20]
+# Simulated seconds of timer each session runs before ending its workout.
+DEFAULT_SECONDS = 60
+# Seconds a session stays paused, and the simulated second it pauses at, spread out by session.
+PAUSE_SECONDS = 5
+PAUSE_AFTER = 10
+# The saved workout and timer config every session loads.
+WORKOUT_NAME = "load_test"
+WORKOUT_EXERCISES = 6
+TIMER_CONFIG = {"rounds": 2, "work_duration": 20, "rest_duration": 10}
+APP_TIMEOUT = 60
+
+
+def latency_stats(times):
+    """Return statistics of rerun times in seconds, with the same keys as benchmark results."""
+    times = np.asarray(times)
+    return {
+        "min": float(times.min()),
+        "median": float(np.median(times)),
+        "mean": float(times.mean()),
+        "p90": float(np.percentile(times, 90)),
+        "p99": float(np.percentile(times, 99)),
+        "max": float(times.max()),
+        "repeat": len(times),
+        "number": 1,
+    }
+
+
+def current_rss():
+    """Return the resident memory of this process in bytes."""
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+class Session:
+    """A simulated user of the app, with the time each of its reruns took."""
+
+    def __init__(self, index, clock, flow_times):
+        from streamlit.testing.v1 import AppTest
+
+        self.index = index
+        self.clock = clock
+        self.flow_times = flow_times
+        self.pause_at = PAUSE_AFTER + index % PAUSE_AFTER
+        self.resume_at = None
+        self.done = False
+        self.app = AppTest.from_file(APP, default_timeout=APP_TIMEOUT)
+        self._timed(self.app.run)
+
+    def _timed(self, run):
+        start = time.perf_counter()
+        run()
+        elapsed = time.perf_counter() - start
+        if self.app.exception:
+            raise RuntimeError(f"Session {self.index}: {self.app.exception[0].value}")
+        return elapsed
+
+    def press(self, label):
+        """Click a button and rerun the app, returning how long the rerun took."""
+        for button in self.app.button:
+            if button.label == label:
+                return self._timed(button.click().run)
+        raise RuntimeError(f"Session {self.index} has no {label} button.")
+
+    def start_workout(self):
+        """Load the saved workout and timer config, preview it and start the timer."""
+        self.app.selectbox[0].set_value(WORKOUT_NAME)
+        self.app.selectbox[1].set_value(WORKOUT_NAME)
+        self.flow_times.append(self.press("Create Workout"))
+        self.flow_times.append(self.press("Preview Workout"))
+        # Run the timer on the server, which is what reruns the app every second.
+        self.flow_times.append(self._timed(self.app.toggle[0].set_value(False).run))
+        self.flow_times.append(self.press("Start Timer"))
+        # Put the timer on the simulated clock.
+        timer = self.app.session_state["timer"]
+        timer.clock = self.clock
+        timer.started = self.clock()
+        timer.seek(0)
+
+    def tick(self, second):
+        """Do what the session does in a simulated second, returning the time its rerun took, or
+        None if it didn't rerun."""
+        if self.done:
+            return None
+        if second == self.pause_at:
+            self.resume_at = second + PAUSE_SECONDS
+            return self.press("⏸️ Pause")
+        if self.resume_at is not None:
+            if second < self.resume_at:
+                # A paused timer doesn't rerun.
+                return None
+            self.resume_at = None
+            return self.press("▶️ Resume")
+        elapsed = self._timed(self.app.run)
+        if self.app.session_state["timer"].state().done:
+            self.done = True
+        return elapsed
+
+    def end(self):
+        """End the workout if it is still running."""
+        if not self.done:
+            self.flow_times.append(self.press("End Workout"))
+            self.done = True
+
+
+def run_sessions(num_sessions, seconds):
+    """Run a number of sessions side by side for some simulated seconds and return what they
+    cost. Saved data and history go to a temporary directory."""
+    import utils.file_operations as file_ops
+    import utils.history as history
+    import utils.metrics as metrics
+    from utils.exercise_bank import load_exercise_bank
+    from utils.storage import TIMERS, WORKOUTS, JsonFileStorage
+    from utils.workout_builder import EXERCISE_BANK
+
+    directory = tempfile.mkdtemp(prefix="load_test_")
+    file_ops.set_storage(
+        JsonFileStorage(
+            {
+                WORKOUTS: os.path.join(directory, "workouts"),
+                TIMERS: os.path.join(directory, "timers"),
+            }
+        )
+    )
+    history.log = history.HistoryLog(os.path.join(directory, "history"))
+    bank = load_exercise_bank(EXERCISE_BANK)
+    file_ops.save_workout(
+        WORKOUT_NAME,
+        [
+            {"name": bank.names[i], "link": bank.links[i]}
+            for i in range(WORKOUT_EXERCISES)
+        ],
+    )
+    file_ops.save_timer_config(WORKOUT_NAME, TIMER_CONFIG)
+
+    now = 0.0
+
+    def clock():
+        return now
+
+    # Warm up imports and caches shared by every session before measuring memory.
+    warm_up = Session(-1, clock, [])
+    warm_up.start_workout()
+    warm_up.end()
+    rss_before = current_rss()
+
+    flow_times = []
+    sessions = []
+    for index in range(num_sessions):
+        session = Session(index, clock, flow_times)
+        session.start_workout()
+        sessions.append(session)
+
+    rerun_times = []
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    for second in range(1, seconds + 1):
+        now = float(second)
+        for session in sessions:
+            elapsed = session.tick(second)
+            if elapsed is not None:
+                rerun_times.append(elapsed)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+    rss_after = current_rss()
+    state_sizes = [
+        sum(metrics.session_memory(dict(session.app.session_state.items())).values())
+        for session in sessions
+    ]
+    for session in sessions:
+        session.end()
+
+    cpu_per_second = cpu / seconds
+    return {
+        "sessions": num_sessions,
+        "seconds": seconds,
+        "rerun": latency_stats(rerun_times),
+        "flow": latency_stats(flow_times),
+        # CPU and wall time the server spends per second of running timers. Above 1, one
+        # process can't keep up with this many sessions.
+        "cpu_seconds_per_second": cpu_per_second,
+        "wall_seconds_per_second": wall / seconds,
+        "estimated_max_sessions": num_sessions / cpu_per_second,
+        "peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        "rss_per_session": (rss_after - rss_before) / num_sessions,
+        "session_state_bytes": statistics.fmean(state_sizes),
+    }
+
+
+def run(session_counts, seconds):
+    """Run the load test for each number of sessions in a process of its own."""
+    results = []
+    for num_sessions in session_counts:
+        print(f"load: {num_sessions} sessions", file=sys.stderr)
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.load_test",
+                "one",
+                str(num_sessions),
+                "--seconds",
+                str(seconds),
+            ],
+            check=True,
+            stdout=subprocess.PIPE,
+            text=True,
+        ).stdout
+        results.append(json.loads(output))
+    benchmarks = {}
+    for result in results:
+        benchmarks[f"load.rerun[{result['sessions']}]"] = result["rerun"]
+        benchmarks[f"load.flow[{result['sessions']}]"] = result["flow"]
+    return {
+        "meta": {
+            "created": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "sessions": session_counts,
+            "seconds": seconds,
+        },
+        "benchmarks": benchmarks,
+        "load": results,
+    }
+
+
+def print_report(results):
+    print(
+        f"{'sessions':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'cpu/s':>7}"
+        f" {'max sessions':>12} {'peak RSS MB':>11} {'KB/session':>10} {'state KB':>8}"
+    )
+    for result in results["load"]:
+        rerun = result["rerun"]
+        print(
+            f"{result['sessions']:>8} {rerun['median'] * 1000:>8.1f}"
+            f" {rerun['p90'] * 1000:>8.1f} {rerun['p99'] * 1000:>8.1f}"
+            f" {result['cpu_seconds_per_second']:>7.2f}"
+            f" {result['estimated_max_sessions']:>12.0f}"
+            f" {result['peak_rss'] / 2**20:>11.1f}"
+            f" {result['rss_per_session'] / 1024:>10.0f}"
+            f" {result['session_state_bytes'] / 1024:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Load test the app with simulated concurrent sessions."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="Run the load test.")
+    run_parser.add_argument(
+        "--sessions",
+        type=int,
+        nargs="+",
+        default=DEFAULT_SESSIONS,
+        help="Numbers of concurrent sessions.",
+    )
+    run_parser.add_argument("--output", help="File to write the results to.")
+    one_parser = commands.add_parser(
+        "one", help="Run one number of sessions and print the result as JSON."
+    )
+    one_parser.add_argument("sessions", type=int)
+    for command in (run_parser, one_parser):
+        command.add_argument(
+            "--seconds",
+            type=int,
+            default=DEFAULT_SECONDS,
+            help="Simulated seconds of timer per session.",
+        )
+    args = parser.parse_args()
+
+    if args.command == "one":
+        json.dump(run_sessions(args.sessions, args.seconds), sys.stdout)
+        sys.exit(0)
+    results = run(args.sessions, args.seconds)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=4)
+    print_report(results)
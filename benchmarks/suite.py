@@ -0,0 +1,422 @@
+"""Benchmark suite for the exercise selector, saved data storage and workout timer.
+
+Run the benchmarks and write the results as JSON:
+
+    python -m benchmarks.suite run --output results.json
+
+Compare two result files, failing if anything got slower than its threshold allows:
+
+    python -m benchmarks.suite compare baseline.json results.json --thresholds thresholds.json
+
+A thresholds file maps benchmark name prefixes to the allowed slowdown, as a fraction of the
+baseline time, e.g. {"default": 0.25, "selector.init": 0.5}. The longest matching prefix wins.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+import utils.file_operations as file_ops
+from benchmarks.synthetic_bank import write_synthetic_bank
+from utils import exercise_bank
+from utils.bank_format import write_binary_bank
+from utils.exercise_selector import ExerciseSelector
+from utils.storage import TIMERS, WORKOUTS, JsonFileStorage, SqliteStorage
+from utils.timer_engine import CircuitTimer, WorkoutTimer
+
+DEFAULT_SIZES = [10**3, 10**4, 10**5, 10**6]
+DEFAULT_NUM_FILES = 2000
+DEFAULT_REPEAT = 5
+# Cold loads of the largest banks take seconds, so they are repeated fewer times.
+COLD_REPEAT = 3
+DEFAULT_THRESHOLD = 0.25
+GROUPS = ["selector", "file_ops", "timer"]
+
+# Calls per repeat for the benchmarks of single fast operations.
+SELECTIONS = 1000
+REMOVALS = 1000
+CATEGORY_LOOKUPS = 10000
+CIRCUIT_STATIONS = [1, 8, 20]
+SLOTS = 20
+EXERCISES_PER_WORKOUT = 8
+
+
+def measure(function, repeat, number=1, setup=None):
+    """Time a function, returning statistics of the seconds per call over the repeats."""
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        for _ in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "mean": statistics.fmean(times),
+        "repeat": repeat,
+        "number": number,
+    }
+
+
+def forget_banks():
+    """Drop every cached exercise bank, so the next selector parses its bank again."""
+    with exercise_bank._banks_lock:
+        exercise_bank._banks.clear()
+
+
+def bench_selector(size, directory, repeat):
+    """Benchmark the exercise selector on a synthetic bank with size entries."""
+    results = {}
+    json_path = os.path.join(directory, f"bank_{size}.json")
+    binary_path = os.path.join(
+        directory, f"bank_{size}{exercise_bank.BINARY_BANK_EXTENSION}"
+    )
+    write_synthetic_bank(size, json_path)
+    write_binary_bank(exercise_bank.ExerciseBank.from_file(json_path), binary_path)
+
+    cold_repeat = min(repeat, COLD_REPEAT)
+    results[f"selector.init.cold_json[{size}]"] = measure(
+        lambda: ExerciseSelector(json_path), cold_repeat, setup=forget_banks
+    )
+    results[f"selector.init.cold_binary[{size}]"] = measure(
+        lambda: ExerciseSelector(binary_path), cold_repeat, setup=forget_banks
+    )
+    selector = ExerciseSelector(json_path)
+    results[f"selector.init.warm[{size}]"] = measure(
+        lambda: ExerciseSelector(json_path), repeat, number=100
+    )
+
+    rng = random.Random(0)
+    categories = [""] + selector.exercise_categories()
+    body_parts = [""] + selector.exercise_body_parts()
+    entries = [
+        (rng.choice(categories), rng.choice(body_parts)) for _ in range(SELECTIONS)
+    ]
+    entries_iter = iter(())
+
+    def reset():
+        nonlocal entries_iter
+        selector.excluded.clear()
+        entries_iter = iter(entries)
+
+    results[f"selector.select_exercise[{size}]"] = measure(
+        lambda: selector.select_exercise(*next(entries_iter)),
+        repeat,
+        number=SELECTIONS,
+        setup=reset,
+    )
+    results[f"selector.select_many[{size}]"] = measure(
+        lambda: selector.select_many(entries[:SLOTS]),
+        repeat,
+        number=10,
+        setup=reset,
+    )
+
+    names = [
+        selector.bank.names[i]
+        for i in rng.sample(
+            range(len(selector.bank.names)), min(REMOVALS, len(selector.bank.names))
+        )
+    ]
+    names_iter = iter(())
+
+    def reset_names():
+        nonlocal names_iter
+        selector.excluded.clear()
+        names_iter = iter(names)
+
+    results[f"selector.remove_exercise[{size}]"] = measure(
+        lambda: selector.remove_exercise(next(names_iter)),
+        repeat,
+        number=len(names),
+        setup=reset_names,
+    )
+    results[f"selector.exercise_categories[{size}]"] = measure(
+        selector.exercise_categories, repeat, number=CATEGORY_LOOKUPS
+    )
+    # Intersecting the bitmaps of a combination of filters, without the pool cache.
+    filters = {"equipment": False, "category": categories[1], "difficulty": "beginner"}
+    results[f"bank.filter_bitmaps[{size}]"] = measure(
+        lambda: selector.bank.facets.bitmap(filters),
+        repeat,
+        number=CATEGORY_LOOKUPS,
+    )
+
+    # Large banks would otherwise stay cached for the rest of the run.
+    forget_banks()
+    return results
+
+
+def bench_file_ops(num_files, directory, repeat):
+    """Benchmark saving, loading and searching workouts with each storage backend."""
+    results = {}
+    workout = [
+        {
+            "name": f"Exercise {i}",
+            "link": f"exercises/exercise_{i}.jpg",
+            "type": "strength",
+            "body_part": "legs",
+        }
+        for i in range(EXERCISES_PER_WORKOUT)
+    ]
+    filenames = [f"workout_{i}" for i in range(num_files)]
+    backends = {
+        "json": JsonFileStorage(
+            {
+                WORKOUTS: os.path.join(directory, "workouts"),
+                TIMERS: os.path.join(directory, "timers"),
+            }
+        ),
+        "sqlite": SqliteStorage(os.path.join(directory, "saved_data.db")),
+    }
+
+    previous_storage = file_ops.storage
+    try:
+        for backend, storage in backends.items():
+            file_ops.set_storage(storage)
+
+            def save_all():
+                for filename in filenames:
+                    file_ops.save_workout(filename, workout)
+
+            def load_all():
+                for filename in filenames:
+                    file_ops.load_workouts(filename)
+
+            def forget_index():
+                if isinstance(storage, JsonFileStorage):
+                    storage._indexes.clear()
+
+            key = f"{backend},{num_files}"
+            results[f"file_ops.save_workout[{key}]"] = _per_item(
+                measure(save_all, repeat), num_files
+            )
+            results[f"file_ops.load_workouts[{key}]"] = _per_item(
+                measure(load_all, repeat), num_files
+            )
+            results[f"file_ops.search_workouts.cold[{key}]"] = measure(
+                lambda: file_ops.search_workouts("workout_1"),
+                repeat,
+                setup=forget_index,
+            )
+            if isinstance(storage, JsonFileStorage):
+                # The index is only reused once the directory hasn't changed for a while, so
+                # make the workouts look like they were saved a minute ago.
+                saved = time.time() - 60
+                os.utime(storage.paths[WORKOUTS], (saved, saved))
+            results[f"file_ops.search_workouts.warm[{key}]"] = measure(
+                lambda: file_ops.search_workouts("workout_1"), repeat, number=10
+            )
+    finally:
+        file_ops.set_storage(previous_storage)
+    return results
+
+
+def _per_item(stats, count):
+    """Turn the statistics of a benchmark over count items into seconds per item."""
+    for statistic in ("min", "median", "mean"):
+        stats[statistic] /= count
+    stats["number"] = count
+    return stats
+
+
+def bench_timer(repeat):
+    """Benchmark building a workout timer and advancing it through a whole workout."""
+    results = {}
+    num_exercises, rounds, work, rest = 50, 10, 30, 15
+    results["timer.compile"] = measure(
+        lambda: WorkoutTimer(num_exercises, rounds, work, rest), repeat, number=100
+    )
+
+    # Read the timer four times a second, like the Tk timer, from a clock that is moved by hand.
+    now = 0.0
+    timer = WorkoutTimer(num_exercises, rounds, work, rest, clock=lambda: now)
+    steps = np.arange(0, timer.total_duration, 0.25).tolist()
+
+    def advance():
+        nonlocal now
+        timer.seek(0)
+        timer.start()
+        for now in steps:
+            timer.state()
+        timer.pause()
+        now = 0.0
+
+    results["timer.advance"] = _per_item(measure(advance, repeat), len(steps))
+
+    # Read every station of a circuit once a second, like the Tk circuit mode, with the stations
+    # starting 10 seconds apart.
+    for stations in CIRCUIT_STATIONS:
+        circuit = CircuitTimer(
+            stations,
+            num_exercises,
+            rounds,
+            work,
+            rest,
+            offsets=[10 * station for station in range(stations)],
+            clock=lambda: now,
+        )
+        seconds = list(range(round(circuit.total_duration)))
+
+        def advance_circuit():
+            nonlocal now
+            circuit.timer.seek(0)
+            circuit.start()
+            for now in seconds:
+                circuit.states()
+                circuit.next_change()
+            circuit.pause()
+            now = 0.0
+
+        results[f"timer.circuit[{stations}]"] = _per_item(
+            measure(advance_circuit, repeat), len(seconds)
+        )
+    return results
+
+
+def run(sizes, num_files, repeat, groups):
+    """Run the benchmarks and return the results."""
+    benchmarks = {}
+    with tempfile.TemporaryDirectory() as directory:
+        if "selector" in groups:
+            for size in sizes:
+                print(f"selector: {size} entries", file=sys.stderr)
+                benchmarks.update(bench_selector(size, directory, repeat))
+        if "file_ops" in groups:
+            print(f"file_ops: {num_files} files", file=sys.stderr)
+            benchmarks.update(bench_file_ops(num_files, directory, repeat))
+        if "timer" in groups:
+            print("timer", file=sys.stderr)
+            benchmarks.update(bench_timer(repeat))
+    return {
+        "meta": {
+            "created": time.time(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "numpy": np.__version__,
+            "sizes": sizes,
+            "num_files": num_files,
+            "repeat": repeat,
+        },
+        "benchmarks": benchmarks,
+    }
+
+
+def threshold_for(name, thresholds):
+    """Return the allowed slowdown for a benchmark, from the longest matching name prefix."""
+    matches = [prefix for prefix in thresholds if name.startswith(prefix)]
+    if not matches:
+        return thresholds.get("default", DEFAULT_THRESHOLD)
+    return thresholds[max(matches, key=len)]
+
+
+def compare(baseline, current, thresholds):
+    """Compare the median times of two result sets. Returns a row for every benchmark in both,
+    with its status: "regression", "improvement" or "ok"."""
+    rows = []
+    for name, stats in current["benchmarks"].items():
+        baseline_stats = baseline["benchmarks"].get(name)
+        if baseline_stats is None:
+            continue
+        ratio = stats["median"] / baseline_stats["median"]
+        threshold = threshold_for(name, thresholds)
+        if ratio > 1 + threshold:
+            status = "regression"
+        elif ratio < 1 / (1 + threshold):
+            status = "improvement"
+        else:
+            status = "ok"
+        rows.append(
+            {
+                "name": name,
+                "baseline": baseline_stats["median"],
+                "current": stats["median"],
+                "ratio": ratio,
+                "threshold": threshold,
+                "status": status,
+            }
+        )
+    return rows
+
+
+def print_comparison(rows):
+    """Print a comparison as a table."""
+    width = max((len(row["name"]) for row in rows), default=0)
+    for row in rows:
+        print(
+            f"{row['name']:<{width}}  {row['baseline'] * 1e6:12.2f}us"
+            f"  {row['current'] * 1e6:12.2f}us  {row['ratio']:6.2f}x  {row['status']}"
+        )
+
+
+def load_results(file_path):
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
+def load_thresholds(file_path):
+    if not file_path:
+        return {}
+    with open(file_path, "r") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Benchmark the exercise selector, saved data storage and workout timer."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks.")
+    run_parser.add_argument(
+        "--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="Bank sizes."
+    )
+    run_parser.add_argument("--num-files", type=int, default=DEFAULT_NUM_FILES)
+    run_parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT)
+    run_parser.add_argument(
+        "--groups", nargs="+", choices=GROUPS, default=GROUPS, help="Benchmarks to run."
+    )
+    run_parser.add_argument("--output", help="File to write the results to.")
+    run_parser.add_argument("--baseline", help="Results to compare against.")
+    run_parser.add_argument("--thresholds", help="JSON file of allowed slowdowns.")
+
+    compare_parser = commands.add_parser("compare", help="Compare two result files.")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--thresholds", help="JSON file of allowed slowdowns.")
+    compare_parser.add_argument("--output", help="File to write the comparison to.")
+
+    args = parser.parse_args()
+    thresholds = load_thresholds(args.thresholds)
+    if args.command == "run":
+        results = run(args.sizes, args.num_files, args.repeat, args.groups)
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(results, f, indent=4)
+        else:
+            json.dump(results, sys.stdout, indent=4)
+            print()
+        if not args.baseline:
+            sys.exit(0)
+        rows = compare(load_results(args.baseline), results, thresholds)
+    else:
+        rows = compare(
+            load_results(args.baseline), load_results(args.current), thresholds
+        )
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump(rows, f, indent=4)
+
+    print_comparison(rows)
+    # Fail when anything got slower than allowed, so the suite can gate a change.
+    sys.exit(1 if any(row["status"] == "regression" for row in rows) else 0)
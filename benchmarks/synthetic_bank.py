@@ -0,0 +1,65 @@
+"""Synthetic exercise banks of any size, in the same schema as exercise_bank.json."""
+
+import argparse
+import json
+import random
+
+CATEGORIES = ["strength", "cardio", "plyometrics", "stretches", "mobility", "core"]
+BODY_PARTS = ["legs", "upper_body", "abs", "cardio"]
+DIFFICULTIES = ["beginner", "intermediate", "advanced"]
+IMPACTS = ["low", "high"]
+
+# Fraction of exercises that are also in a second category and body part, like exercises that
+# are both a strength and a mobility exercise in the real bank.
+SHARED_FRACTION = 0.1
+
+
+def synthetic_bank(num_entries, seed=0):
+    """Return an exercise bank with num_entries exercises spread over every facet value."""
+    rng = random.Random(seed)
+    exercises = []
+    for i in range(num_entries):
+        if i % 2:
+            link = f"exercises/synthetic_{i}.jpg"
+        else:
+            link = f"https://www.youtube.com/watch?v=synthetic{i}"
+        exercise = {
+            "name": f"Synthetic Exercise {i}",
+            "link": link,
+            "equipment": rng.random() < 0.5,
+            "category": rng.choice(CATEGORIES),
+            "body_part": rng.choice(BODY_PARTS),
+            "difficulty": rng.choice(DIFFICULTIES),
+            "impact": rng.choice(IMPACTS),
+        }
+        if rng.random() < SHARED_FRACTION:
+            placements = [f"{exercise['category']}/{exercise['body_part']}"]
+            for facet, values in (("category", CATEGORIES), ("body_part", BODY_PARTS)):
+                other = rng.choice(values)
+                if other != exercise[facet]:
+                    exercise[facet] = [exercise[facet], other]
+            if isinstance(exercise["category"], list) and isinstance(
+                exercise["body_part"], list
+            ):
+                # Filed under two pairs, not every pairing of its categories and body parts.
+                placements.append(
+                    f"{exercise['category'][1]}/{exercise['body_part'][1]}"
+                )
+                exercise["placement"] = placements
+        exercises.append(exercise)
+    return {"exercises": exercises}
+
+
+def write_synthetic_bank(num_entries, file_path, seed=0):
+    """Write a synthetic exercise bank to a JSON file."""
+    with open(file_path, "w") as f:
+        json.dump(synthetic_bank(num_entries, seed), f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic exercise bank.")
+    parser.add_argument("num_entries", type=int)
+    parser.add_argument("file_path")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    write_synthetic_bank(args.num_entries, args.file_path, args.seed)
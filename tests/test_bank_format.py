@@ -0,0 +1,23 @@
+from utils.bank_format import BinaryExerciseBank, write_binary_bank
+from utils.exercise_bank import ExerciseBank
+
+EXERCISES = [
+    {"name": "Push Ups", "link": None, "category": "strength", "body_part": "chest"},
+    {"name": "Plank", "link": None, "category": "core", "body_part": "core"},
+]
+
+
+def test_version_is_read_from_the_header(tmp_path):
+    write_binary_bank(ExerciseBank({"exercises": EXERCISES}), tmp_path / "a.bank")
+    write_binary_bank(ExerciseBank({"exercises": EXERCISES}), tmp_path / "b.bank")
+    changed = [dict(EXERCISES[0], weight=2), EXERCISES[1]]
+    write_binary_bank(ExerciseBank({"exercises": changed}), tmp_path / "c.bank")
+
+    a, b, c = (
+        BinaryExerciseBank.from_file(tmp_path / name)
+        for name in ("a.bank", "b.bank", "c.bank")
+    )
+    assert len(a.version) == 16
+    assert a.version == b.version
+    assert a.version != c.version
+    assert c.find_exercise("Push Ups")["weight"] == 2
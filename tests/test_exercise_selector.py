@@ -0,0 +1,34 @@
+import json
+
+from utils.exercise_selector import ExerciseSelector
+
+# Each pair of slots shares one exercise, so a first draw can leave the last slot with nothing
+# free until another slot is moved.
+EXERCISES = [
+    {
+        "name": "X",
+        "link": None,
+        "category": ["a", "b"],
+        "body_part": ["p", "r"],
+        "placement": ["a/p", "b/r"],
+    },
+    {"name": "Y", "link": None, "category": "a", "body_part": ["p", "q"]},
+    {
+        "name": "Z",
+        "link": None,
+        "category": ["a", "b"],
+        "body_part": ["q", "r"],
+        "placement": ["a/q", "b/r"],
+    },
+]
+
+
+def test_every_slot_is_filled_when_the_slots_can_share_out_the_exercises(tmp_path):
+    bank_file = tmp_path / "bank.json"
+    bank_file.write_text(json.dumps({"exercises": EXERCISES}))
+    for seed in range(20):
+        selector = ExerciseSelector(str(bank_file))
+        selector.seed(seed)
+        selections = selector.select_many([("a", "p"), ("a", "q"), ("b", "r")])
+        assert sorted(name for name, _ in selections) == ["X", "Y", "Z"]
+        assert selector.select_many([("a", "p")]) == [(None, None)]
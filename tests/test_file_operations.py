@@ -0,0 +1,28 @@
+import os
+
+from streamlit.testing.v1 import AppTest
+
+import utils.file_operations as file_ops
+from utils.storage import TIMERS, WORKOUTS, JsonFileStorage
+
+APP = os.path.join(os.path.dirname(os.path.dirname(__file__)), "workout_generator.py")
+
+
+def test_bad_saved_workouts_are_skipped(tmp_path, monkeypatch):
+    storage = JsonFileStorage(
+        {WORKOUTS: str(tmp_path / "workouts"), TIMERS: str(tmp_path / "timers")}
+    )
+    monkeypatch.setattr(file_ops, "storage", storage)
+    file_ops.save_workout("good", [{"name": "Burpee", "link": None}, 1])
+    file_ops.save_workout("bad", [1, 2])
+    file_ops.save_workout("object", {"name": "Burpee"})
+    (tmp_path / "workouts" / "broken").write_text("[{")
+
+    assert sorted(file_ops.recent_workouts(10)) == [[], [], [], ["Burpee"]]
+    assert file_ops.load_workouts("bad") == {}
+    assert list(file_ops.load_workouts("good")) == ["Burpee"]
+
+    app = AppTest.from_file(APP, default_timeout=60)
+    app.run()
+    assert not app.exception
+    assert [button.label for button in app.button] == ["Create Workout"]
@@ -0,0 +1,35 @@
+import os
+
+import utils.history as history
+
+
+def test_records_skips_old_segments_with_saved_rollups(tmp_path, monkeypatch):
+    log = history.HistoryLog(str(tmp_path), segment_bytes=200)
+    for day in range(10):
+        log.append(
+            {
+                "time": 86400.0 * day,
+                "status": history.COMPLETED,
+                "exercises": [],
+                "padding": "x" * 100,
+            }
+        )
+    assert len(log.segments()) > 3
+    log.rollups()
+    log._save_rollups()
+
+    opened = []
+    real_open = open
+
+    def recording_open(path, *args, **kwargs):
+        opened.append(os.path.basename(path))
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(history, "open", recording_open, raising=False)
+    fresh = history.HistoryLog(str(tmp_path), segment_bytes=200)
+    records = list(fresh.records(since=86400.0 * 8))
+
+    assert [record["time"] for record in records] == [86400.0 * 8, 86400.0 * 9]
+    segments = [name for name in opened if name.startswith("segment-")]
+    assert os.path.basename(log.segment_path(1)) not in segments
+    assert len(segments) <= 2
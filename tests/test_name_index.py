@@ -0,0 +1,18 @@
+from utils.name_index import NameIndex
+
+NAMES = ["Push Ups", "Push Press", "Diamond Push Ups", "Burpees", "Plank", "Side Plank"]
+
+
+def test_ambiguous_prefix_is_not_resolved():
+    index = NameIndex(NAMES)
+    assert index.resolve("push") is None
+    # The user picks from the suggestions instead.
+    assert index.complete("push")[:2] == ["Push Press", "Push Ups"]
+
+
+def test_exact_and_clear_matches_are_resolved():
+    index = NameIndex(NAMES)
+    assert index.resolve("push-ups") == "Push Ups"
+    assert index.resolve("pushups") == "Push Ups"
+    assert index.resolve("burpe") == "Burpees"
+    assert index.resolve("plank") == "Plank"
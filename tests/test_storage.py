@@ -0,0 +1,18 @@
+import os
+
+from utils.storage import TIMERS, WORKOUTS, JsonFileStorage
+
+
+def test_save_in_the_same_mtime_tick_is_listed(tmp_path):
+    storage = JsonFileStorage(
+        {WORKOUTS: str(tmp_path / "workouts"), TIMERS: str(tmp_path / "timers")}
+    )
+    storage.save(WORKOUTS, "first", [])
+    assert storage.list(WORKOUTS) == ["first"]
+
+    # A filesystem with coarse mtimes leaves the directory mtime as it was.
+    directory = tmp_path / "workouts"
+    mtime = os.stat(directory).st_mtime_ns
+    storage.save(WORKOUTS, "second", [])
+    os.utime(directory, ns=(mtime, mtime))
+    assert storage.list(WORKOUTS) == ["first", "second"]
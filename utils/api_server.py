@@ -0,0 +1,454 @@
+"""HTTP/JSON API for generating workouts, saved data and running timers, on asyncio.
+
+Run it with `python -m utils.api_server --port 8000`. Connections are kept alive between
+requests, and file I/O and exercise selection run on a thread pool so they never block the event
+loop. Endpoints:
+
+    POST   /generate                  {"equipment": true, "filters": {"impact": "low"},
+                                       "slots": [...], "seed": 1} -> workout
+    GET    /workouts?query=&page=     page of saved workouts
+    GET    /workouts/<name>           saved workout
+    PUT    /workouts/<name>           save a workout (a list of exercises)
+    GET    /timers?query=&page=       page of saved timer configs
+    GET    /timers/<name>             saved timer config
+    PUT    /timers/<name>             save a timer config
+    POST   /sessions                  {"exercises": [...], "timer_config": {...}} -> timer session
+    GET    /sessions/<id>             where the session's timer is
+    POST   /sessions/<id>/pause       pause the timer
+    POST   /sessions/<id>/resume      resume the timer
+    DELETE /sessions/<id>             end the session, recording it in the history log
+    GET    /assets/<thumbnail>.jpg    exercise thumbnail
+
+Slots are given like in bulk generation specs (see utils.bulk_generation).
+"""
+
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import json
+import os
+import re
+import time
+import traceback
+import urllib.parse
+import uuid
+
+import utils.file_operations as file_ops
+import utils.history as history
+import utils.image_assets as image_assets
+from utils.exercise_bank import load_exercise_bank
+from utils.exercise_selector import ExerciseSelector
+from utils.timer_engine import WorkoutTimer
+from utils.workout_builder import (
+    EXERCISE_BANK,
+    generate_workout,
+    slot_entries,
+    workout_filters,
+)
+
+# Seconds an idle keep-alive connection stays open.
+KEEP_ALIVE_TIMEOUT = 15
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 1024 * 1024
+# Timer sessions that haven't been polled for this many seconds are ended.
+SESSION_TTL = 3600
+# Largest workouts a timer session can be started for, so no request can tie up the server
+# working out a huge schedule.
+MAX_SESSION_EXERCISES = 100
+MAX_ROUNDS = 100
+MAX_PHASE_SECONDS = 3600
+
+REASONS = {
+    200: "OK",
+    201: "Created",
+    204: "No Content",
+    400: "Bad Request",
+    404: "Not Found",
+    405: "Method Not Allowed",
+    413: "Payload Too Large",
+    500: "Internal Server Error",
+}
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class Response:
+    """A response other than JSON, like an image."""
+
+    def __init__(self, body, content_type, headers=None):
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+
+class TimerSession:
+    """A running workout timer and the exercises it is timing."""
+
+    def __init__(self, exercises, timer_config):
+        self.exercises = exercises
+        self.timer = WorkoutTimer.from_config(len(exercises), timer_config)
+        self.last_used = time.monotonic()
+
+    def state(self):
+        self.last_used = time.monotonic()
+        state = self.timer.state()._asdict()
+        state["exercise"] = self.exercises[state["exercise_index"]]["name"]
+        state["paused"] = self.timer.paused
+        return state
+
+
+class ApiServer:
+    def __init__(self, executor=None):
+        self.executor = executor or concurrent.futures.ThreadPoolExecutor(max_workers=8)
+        self.sessions = {}
+        self.routes = [
+            ("POST", r"/generate", self.generate),
+            ("GET", r"/workouts", self.search_workouts),
+            ("GET", r"/workouts/(?P<name>[^/]+)", self.load_workout),
+            ("PUT", r"/workouts/(?P<name>[^/]+)", self.save_workout),
+            ("GET", r"/timers", self.search_timer_configs),
+            ("GET", r"/timers/(?P<name>[^/]+)", self.load_timer_config),
+            ("PUT", r"/timers/(?P<name>[^/]+)", self.save_timer_config),
+            ("POST", r"/sessions", self.create_session),
+            ("GET", r"/sessions/(?P<session_id>\w+)", self.poll_session),
+            ("POST", r"/sessions/(?P<session_id>\w+)/pause", self.pause_session),
+            ("POST", r"/sessions/(?P<session_id>\w+)/resume", self.resume_session),
+            ("DELETE", r"/sessions/(?P<session_id>\w+)", self.end_session),
+            ("GET", r"/assets/(?P<file_name>\w+\.jpg)", self.asset),
+        ]
+        self.routes = [
+            (method, re.compile(pattern + "$"), handler)
+            for method, pattern, handler in self.routes
+        ]
+
+    async def run_blocking(self, function, *args, **kwargs):
+        """Run a blocking function, like file I/O, on the thread pool."""
+        return await asyncio.get_running_loop().run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs)
+        )
+
+    # Connections.
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on a connection until the client closes it or it goes idle."""
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(
+                        reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT
+                    )
+                except (
+                    asyncio.TimeoutError,
+                    asyncio.IncompleteReadError,
+                    asyncio.LimitOverrunError,
+                    ConnectionError,
+                ):
+                    break
+                try:
+                    keep_alive = await self.handle_request(head, reader, writer)
+                    await writer.drain()
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    break
+                if not keep_alive:
+                    break
+        finally:
+            writer.close()
+
+    async def handle_request(self, head, reader, writer):
+        """Read the rest of a request, respond to it, and return whether to keep the connection
+        open."""
+        try:
+            request_line, *header_lines = head.decode("latin-1").split("\r\n")
+            method, target, version = request_line.split(" ")
+            headers = {}
+            for line in header_lines:
+                if line:
+                    name, _, value = line.partition(":")
+                    headers[name.strip().lower()] = value.strip()
+            length = int(headers.get("content-length") or 0)
+            if length < 0:
+                raise ValueError(length)
+        except ValueError:
+            self.write_response(writer, 400, {"error": "Malformed request."}, False)
+            return False
+
+        connection = headers.get("connection", "").lower()
+        keep_alive = connection != "close" and (
+            version == "HTTP/1.1" or connection == "keep-alive"
+        )
+        if length > MAX_BODY_BYTES:
+            self.write_response(writer, 413, {"error": "Request too large."}, False)
+            return False
+        body = await reader.readexactly(length) if length else b""
+
+        try:
+            status, payload = await self.dispatch(method, target, body)
+        except HTTPError as error:
+            status, payload = error.status, {"error": error.message}
+        except Exception:
+            # Don't show clients the internals of an error in the server.
+            traceback.print_exc()
+            status, payload = 500, {"error": "Something went wrong in the server."}
+        self.write_response(writer, status, payload, keep_alive)
+        return keep_alive
+
+    def write_response(self, writer, status, payload, keep_alive):
+        headers = {}
+        if isinstance(payload, Response):
+            body, content_type = payload.body, payload.content_type
+            headers.update(payload.headers)
+        elif payload is None:
+            body, content_type = b"", None
+        else:
+            body, content_type = json.dumps(payload).encode(), "application/json"
+        lines = [f"HTTP/1.1 {status} {REASONS.get(status, '')}"]
+        if content_type:
+            lines.append(f"Content-Type: {content_type}")
+        lines.append(f"Content-Length: {len(body)}")
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        lines += [f"{name}: {value}" for name, value in headers.items()]
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+
+    async def dispatch(self, method, target, body):
+        """Route a request to its handler, returning (status, payload)."""
+        url = urllib.parse.urlsplit(target)
+        path = urllib.parse.unquote(url.path).rstrip("/") or "/"
+        query = dict(urllib.parse.parse_qsl(url.query))
+        allowed = False
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match is None:
+                continue
+            if route_method != method:
+                allowed = True
+                continue
+            data = None
+            if body:
+                try:
+                    data = json.loads(body)
+                except ValueError:
+                    raise HTTPError(400, "Request body is not valid JSON.")
+            return await handler(data=data, query=query, **match.groupdict())
+        if allowed:
+            raise HTTPError(405, f"{method} is not allowed on {path}.")
+        raise HTTPError(404, f"Nothing at {path}.")
+
+    # Generation.
+
+    async def generate(self, data, query):
+        if not isinstance(data, dict) or not isinstance(data.get("slots"), list):
+            raise HTTPError(400, "Give the slots to fill.")
+        if not all(
+            isinstance(slot, dict)
+            and all(isinstance(value, str) for value in slot.values())
+            for slot in data["slots"]
+        ):
+            raise HTTPError(400, "Give each slot as an object of strings.")
+        seed = data.get("seed")
+        if seed is not None and (
+            not isinstance(seed, int) or isinstance(seed, bool) or seed < 0
+        ):
+            raise HTTPError(400, "seed must be a whole number of 0 or more.")
+        facets = data.get("filters", {})
+        if not isinstance(facets, dict) or not all(
+            isinstance(value, (str, bool, int)) for value in facets.values()
+        ):
+            raise HTTPError(400, "Give filters as facet -> value.")
+        equipment = data.get("equipment", True)
+        if not isinstance(equipment, bool):
+            raise HTTPError(400, "equipment must be true or false.")
+        filters = workout_filters(equipment, **facets)
+
+        def generate():
+            selector = ExerciseSelector(EXERCISE_BANK, filters)
+            return generate_workout(selector, slot_entries(data["slots"]), seed)
+
+        exercises = await self.run_blocking(generate)
+        return 200, {
+            "exercises": [
+                await self.with_thumbnail(exercise) if exercise else None
+                for exercise in exercises
+            ],
+            "unfilled": [i for i, exercise in enumerate(exercises) if exercise is None],
+        }
+
+    async def with_thumbnail(self, exercise):
+        """Add the URL of an exercise's thumbnail, if it has an image."""
+        if image_assets.is_image(exercise["link"]) and os.path.exists(exercise["link"]):
+            path = await self.run_blocking(
+                image_assets.thumbnail_path, exercise["link"]
+            )
+            exercise = dict(exercise, thumbnail=f"/assets/{os.path.basename(path)}")
+        return exercise
+
+    async def asset(self, data, query, file_name):
+        path = os.path.join(image_assets.THUMBNAILS_PATH, file_name)
+        if not os.path.exists(path):
+            raise HTTPError(404, f"There is no thumbnail {file_name}.")
+        # Thumbnails are named by content, so a URL always has the same image.
+        return 200, Response(
+            await self.run_blocking(image_assets.read_thumbnail, path),
+            "image/jpeg",
+            {"Cache-Control": "public, max-age=31536000, immutable"},
+        )
+
+    # Saved workouts and timer configs.
+
+    async def search_workouts(self, data, query):
+        return 200, await self.search(file_ops.search_workouts, query)
+
+    async def search_timer_configs(self, data, query):
+        return 200, await self.search(file_ops.search_timer_configs, query)
+
+    async def search(self, search, query):
+        try:
+            page = int(query.get("page", 0))
+        except ValueError:
+            raise HTTPError(400, "page must be a number.")
+        entries, total = await self.run_blocking(search, query.get("query", ""), page)
+        return {"items": entries, "total": total, "page": page}
+
+    async def load_workout(self, data, query, name):
+        workout = await self.run_blocking(file_ops.load_workouts, name)
+        if not workout:
+            raise HTTPError(404, f"There is no saved workout {name!r}.")
+        return 200, list(workout.values())
+
+    async def save_workout(self, data, query, name):
+        if not isinstance(data, list) or not data:
+            raise HTTPError(400, "A workout is a list of exercises.")
+        if not all(map(file_ops.is_exercise, data)):
+            raise HTTPError(
+                400, "Give each exercise as an object with a name and link."
+            )
+        await self.run_blocking(file_ops.save_workout, name, data)
+        return 204, None
+
+    async def load_timer_config(self, data, query, name):
+        timer_config = await self.run_blocking(file_ops.load_timer_config, name)
+        if not timer_config:
+            raise HTTPError(404, f"There is no saved timer config {name!r}.")
+        return 200, timer_config
+
+    async def save_timer_config(self, data, query, name):
+        if not isinstance(data, dict):
+            raise HTTPError(400, "A timer config is an object.")
+        await self.run_blocking(file_ops.save_timer_config, name, data)
+        return 204, None
+
+    # Timer sessions.
+
+    async def create_session(self, data, query):
+        if not isinstance(data, dict):
+            raise HTTPError(400, "Give the exercises and timer config to time.")
+        exercises = data.get("exercises")
+        timer_config = data.get("timer_config")
+        # Saved workouts and timer configs can be given by name instead.
+        if exercises is None and "workout" in data:
+            exercises = list(
+                (
+                    await self.run_blocking(file_ops.load_workouts, data["workout"])
+                ).values()
+            )
+        if timer_config is None and "timer" in data:
+            timer_config = await self.run_blocking(
+                file_ops.load_timer_config, data["timer"]
+            )
+        if not exercises or not timer_config:
+            raise HTTPError(400, "Give the exercises and timer config to time.")
+        if not isinstance(exercises, list) or not all(
+            map(file_ops.is_exercise, exercises)
+        ):
+            raise HTTPError(
+                400, "Give each exercise as an object with a name and link."
+            )
+        if len(exercises) > MAX_SESSION_EXERCISES:
+            raise HTTPError(
+                400, f"A session can time up to {MAX_SESSION_EXERCISES} exercises."
+            )
+        if not isinstance(timer_config, dict):
+            raise HTTPError(400, "A timer config is an object.")
+        for field, low, high in (
+            ("rounds", 1, MAX_ROUNDS),
+            ("work_duration", 1, MAX_PHASE_SECONDS),
+            ("rest_duration", 0, MAX_PHASE_SECONDS),
+        ):
+            value = timer_config.get(field)
+            if (
+                not isinstance(value, int)
+                or isinstance(value, bool)
+                or not low <= value <= high
+            ):
+                raise HTTPError(
+                    400, f"{field} must be a whole number from {low} to {high}."
+                )
+
+        session = TimerSession(exercises, timer_config)
+        session.timer.start()
+        # Only keep the session once its state can be shown.
+        state = session.state()
+        self.end_idle_sessions()
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = session
+        return 201, {"id": session_id, **state}
+
+    def session(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise HTTPError(404, f"There is no timer session {session_id}.")
+        return session
+
+    async def poll_session(self, data, query, session_id):
+        return 200, self.session(session_id).state()
+
+    async def pause_session(self, data, query, session_id):
+        session = self.session(session_id)
+        session.timer.pause()
+        return 200, session.state()
+
+    async def resume_session(self, data, query, session_id):
+        session = self.session(session_id)
+        session.timer.resume()
+        return 200, session.state()
+
+    async def end_session(self, data, query, session_id):
+        session = self.session(session_id)
+        del self.sessions[session_id]
+        await self.run_blocking(self.record_session, session)
+        return 204, None
+
+    def end_idle_sessions(self):
+        now = time.monotonic()
+        for session_id, session in list(self.sessions.items()):
+            if now - session.last_used > SESSION_TTL:
+                del self.sessions[session_id]
+                self.executor.submit(self.record_session, session)
+
+    def record_session(self, session):
+        """Add an ended session to the history log, with body parts from the exercise bank."""
+        history.record(
+            session.exercises, session.timer, bank=load_exercise_bank(EXERCISE_BANK)
+        )
+
+
+async def serve(host, port):
+    server = ApiServer()
+    listener = await asyncio.start_server(
+        server.handle_connection, host, port, limit=MAX_HEADER_BYTES
+    )
+    async with listener:
+        await listener.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the workout API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    asyncio.run(serve(args.host, args.port))
@@ -0,0 +1,292 @@
+"""Compact binary exercise bank format.
+
+A binary bank holds the same exercises as a JSON bank, laid out as arrays so it can be
+memory-mapped and read lazily instead of parsed:
+
+- A string table. Every distinct name, link, facet and facet value is stored once, as UTF-8, and
+  referred to everywhere else by its index. Facet values are stored as JSON, so values that
+  aren't strings, like "equipment": false, keep their type.
+- Per-exercise columns (name, link and weight), with exercises numbered like ExerciseBank.ids,
+  and the exercise ids sorted by name so a name can be looked up by bisection.
+- The bitmap of each value of each facet, as built by BitmapIndex, so they are used straight
+  from the file.
+
+The file starts with MAGIC, a hash of the sections and a table of (offset, length) for each
+section. The hash is the bank's version, so loading the bank doesn't have to read the whole file.
+Every number is a little-endian uint32, except the weights, which are little-endian float64, and
+the bitmaps.
+"""
+
+import argparse
+import bisect
+import hashlib
+import json
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from utils.bitmap_index import BitmapIndex, to_bitmap
+
+MAGIC = b"WGBANK\x00\x05"
+# Bytes of the SHA-256 of the sections kept in the header.
+HASH_SIZE = 8
+# String index used for a missing link.
+NONE = 0xFFFFFFFF
+
+(
+    STRING_OFFSETS,
+    STRING_DATA,
+    EXERCISE_NAMES,
+    EXERCISE_LINKS,
+    NAME_ORDER,
+    EXERCISE_WEIGHTS,
+    FACET_VALUES,
+    BITMAPS,
+) = range(8)
+NUM_SECTIONS = 8
+
+UINT32 = np.dtype("<u4")
+FLOAT64 = np.dtype("<f8")
+
+
+def write_binary_bank(bank, file_path):
+    """Write an exercise bank to a binary bank file."""
+    strings = {}
+
+    def intern(string):
+        """Return the index of a string in the string table, adding it if needed."""
+        if string is None:
+            return NONE
+        return strings.setdefault(string, len(strings))
+
+    exercise_names = [intern(name) for name in bank.names]
+    exercise_links = [intern(link) for link in bank.links]
+    name_order = sorted(
+        range(len(bank.names)), key=lambda i: bank.names[i].encode("utf-8")
+    )
+
+    # (facet, value, offset and length in BITMAPS) for every facet value.
+    facet_values, bitmaps = [], []
+    offset = 0
+    for facet, values in bank.facets.bitmaps.items():
+        for value, bitmap in values.items():
+            facet_values += [
+                intern(facet),
+                intern(json.dumps(value)),
+                offset,
+                len(bitmap),
+            ]
+            bitmaps.append(bytes(bitmap))
+            offset += len(bitmap)
+
+    encoded = [string.encode("utf-8") for string in strings]
+    string_offsets = [0]
+    for string in encoded:
+        string_offsets.append(string_offsets[-1] + len(string))
+
+    sections = [None] * NUM_SECTIONS
+    sections[STRING_OFFSETS] = np.array(string_offsets, dtype=UINT32).tobytes()
+    sections[STRING_DATA] = b"".join(encoded)
+    for section, values in (
+        (EXERCISE_NAMES, exercise_names),
+        (EXERCISE_LINKS, exercise_links),
+        (NAME_ORDER, name_order),
+        (FACET_VALUES, facet_values),
+    ):
+        sections[section] = np.array(values, dtype=UINT32).tobytes()
+    sections[EXERCISE_WEIGHTS] = np.asarray(bank.weights, dtype=FLOAT64).tobytes()
+    sections[BITMAPS] = b"".join(bitmaps)
+
+    # Sections start on 8-byte boundaries so the arrays can be used straight from the mapping.
+    header_size = len(MAGIC) + HASH_SIZE + 8 * NUM_SECTIONS
+    table, body = [], b""
+    for section in sections:
+        offset = header_size + len(body)
+        offset += -offset % 8
+        body += b"\0" * (offset - header_size - len(body)) + section
+        table += [offset, len(section)]
+
+    # Replace the file in one step, so banks mapped from the old file stay readable.
+    temp_path = f"{file_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(
+            MAGIC
+            + hashlib.sha256(body).digest()[:HASH_SIZE]
+            + struct.pack(f"<{2 * NUM_SECTIONS}I", *table)
+            + body
+        )
+    os.replace(temp_path, file_path)
+
+
+class _Strings:
+    """Strings from the string table, decoded when they are read."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    def bytes(self, index):
+        return self.data[self.offsets[index] : self.offsets[index + 1]]
+
+    def __getitem__(self, index):
+        if index == NONE:
+            return None
+        return bytes(self.bytes(index)).decode("utf-8")
+
+
+class _Column:
+    """A sequence of the strings referred to by a column of string indexes."""
+
+    def __init__(self, strings, column):
+        self.strings = strings
+        self.column = column
+
+    def __len__(self):
+        return len(self.column)
+
+    def __getitem__(self, index):
+        return self.strings[int(self.column[index])]
+
+
+class _SortedNames:
+    """Exercise names as UTF-8 bytes in sorted order, for looking names up by bisection."""
+
+    def __init__(self, bank):
+        self.bank = bank
+
+    def __len__(self):
+        return len(self.bank.name_order)
+
+    def __getitem__(self, index):
+        exercise_id = self.bank.name_order[index]
+        return bytes(self.bank.strings.bytes(self.bank.exercise_names[exercise_id]))
+
+
+class _Ids:
+    """Read-only mapping of exercise name -> exercise id, looked up in the sorted names."""
+
+    def __init__(self, bank):
+        self.bank = bank
+        self.sorted_names = _SortedNames(bank)
+
+    def get(self, name, default=None):
+        key = name.encode("utf-8")
+        position = bisect.bisect_left(self.sorted_names, key)
+        if position < len(self.sorted_names) and self.sorted_names[position] == key:
+            return int(self.bank.name_order[position])
+        return default
+
+    def __getitem__(self, name):
+        exercise_id = self.get(name)
+        if exercise_id is None:
+            raise KeyError(name)
+        return exercise_id
+
+    def __contains__(self, name):
+        return self.get(name) is not None
+
+    def __len__(self):
+        return len(self.sorted_names)
+
+
+class BinaryExerciseBank:
+    """An exercise bank read from a memory-mapped binary bank file. It has the same attributes
+    as ExerciseBank, but exercises are only decoded when they are used."""
+
+    def __init__(self, buffer):
+        if bytes(buffer[: len(MAGIC)]) != MAGIC:
+            raise ValueError(
+                "Not a binary exercise bank, or one from an older version."
+            )
+        table = struct.unpack_from(
+            f"<{2 * NUM_SECTIONS}I", buffer, len(MAGIC) + HASH_SIZE
+        )
+        self._buffer = buffer
+        # Identifies the bank's contents, like ExerciseBank.version.
+        self.version = bytes(buffer[len(MAGIC) : len(MAGIC) + HASH_SIZE]).hex()
+        # A binary bank is always loaded whole, so it starts a lineage of its own and has no
+        # retired ids.
+        self.lineage = object()
+        self.retired = {}
+
+        def section(number, dtype=UINT32):
+            offset, size = table[2 * number], table[2 * number + 1]
+            return np.frombuffer(
+                buffer, dtype=dtype, count=size // dtype.itemsize, offset=offset
+            )
+
+        self.strings = _Strings(
+            section(STRING_OFFSETS), section(STRING_DATA, np.dtype("u1"))
+        )
+        self.exercise_names = section(EXERCISE_NAMES)
+        self.name_order = section(NAME_ORDER)
+
+        self.names = _Column(self.strings, self.exercise_names)
+        self.links = _Column(self.strings, section(EXERCISE_LINKS))
+        self.weights = section(EXERCISE_WEIGHTS, FLOAT64)
+        self.weighted = bool(np.any(self.weights[self.weights > 0] != 1))
+        self.ids = _Ids(self)
+
+        # Facet values are few, so their table is read up front. The bitmaps stay in the file.
+        bitmaps = section(BITMAPS, np.dtype("u1"))
+        facets = {}
+        for facet, value, start, length in (
+            section(FACET_VALUES).reshape(-1, 4).tolist()
+        ):
+            facets.setdefault(self.strings[facet], {})[
+                json.loads(self.strings[value])
+            ] = bitmaps[start : start + length]
+        self.facets = BitmapIndex(
+            len(self.exercise_names), facets, to_bitmap(self.weights > 0)
+        )
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Memory-map a binary bank file."""
+        with open(file_path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @property
+    def exercise_bank(self):
+        """The bank as {"exercises": [...]}, like a parsed JSON bank."""
+        return {"exercises": [self.exercise(i) for i in range(len(self.names))]}
+
+    def exercise(self, exercise_id):
+        """Return an exercise, as it would be in a JSON bank."""
+        exercise = {"name": self.names[exercise_id], "link": self.links[exercise_id]}
+        if self.weights[exercise_id] != 1:
+            exercise["weight"] = float(self.weights[exercise_id])
+        exercise.update(self.facets.exercise_facets(exercise_id))
+        return exercise
+
+    def find_exercise(self, exercise_name):
+        """Return the exercise with the given name, or None if it isn't in the bank."""
+        exercise_id = self.ids.get(exercise_name)
+        if exercise_id is None:
+            return None
+        return self.exercise(exercise_id)
+
+
+if __name__ == "__main__":
+    from utils.exercise_bank import ExerciseBank
+
+    parser = argparse.ArgumentParser(
+        description="Convert exercise banks between JSON and the binary bank format."
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    to_binary = commands.add_parser("to-binary", help="Convert a JSON bank to binary.")
+    to_json = commands.add_parser("to-json", help="Convert a binary bank to JSON.")
+    for command in (to_binary, to_json):
+        command.add_argument("source")
+        command.add_argument("destination")
+    args = parser.parse_args()
+
+    if args.command == "to-binary":
+        write_binary_bank(ExerciseBank.from_file(args.source), args.destination)
+    else:
+        with open(args.destination, "w") as f:
+            json.dump(
+                BinaryExerciseBank.from_file(args.source).exercise_bank, f, indent=4
+            )
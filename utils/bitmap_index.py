@@ -0,0 +1,249 @@
+"""Bitmap indexes over the facets of the exercises in a bank, like equipment, category, body part,
+difficulty and impact.
+
+Every value of every facet has a bitmap with a bit set for each exercise id that has that value,
+so the exercises matching any combination of filters are found by intersecting bitmaps.
+Bitmaps are numpy uint8 arrays with exercise id i in bit i % 8 of byte i // 8.
+
+An exercise with more than one category or body part isn't in every pairing of them, so the
+(category, body part) pairs it is filed under are indexed as a facet of their own, "placement",
+with values like "strength/legs". An exercise can list its placements; otherwise it has every
+pair of its categories and body parts.
+"""
+
+import threading
+
+import numpy as np
+
+# Keys of an exercise that are not facets.
+NOT_FACETS = ("name", "link", "weight")
+PLACEMENT = "placement"
+
+
+def facet_values(value):
+    """Return the values of a facet of an exercise. A facet can have one value or a list."""
+    return value if isinstance(value, list) else [value]
+
+
+def placement(category, body_part):
+    """Return the placement facet value of a category and body part."""
+    return f"{category}/{body_part}"
+
+
+def split_placement(value):
+    """Return the (category, body part) of a placement facet value."""
+    category, _, body_part = value.partition("/")
+    return category, body_part
+
+
+def default_placements(exercise):
+    """Return the placements of an exercise that doesn't list them: every pair of its
+    categories and body parts."""
+    return [
+        placement(category, body_part)
+        for category in facet_values(exercise["category"])
+        for body_part in facet_values(exercise["body_part"])
+    ]
+
+
+def exercise_facets(exercise):
+    """Return (facet, values) for each facet of an exercise, including its placements."""
+    facets = [
+        (facet, facet_values(value))
+        for facet, value in exercise.items()
+        if facet not in NOT_FACETS
+    ]
+    if PLACEMENT not in exercise and "category" in exercise and "body_part" in exercise:
+        facets.append((PLACEMENT, default_placements(exercise)))
+    return facets
+
+
+def facet_pairs(exercise):
+    """Return the (facet, value) pairs of an exercise, or none for a removed exercise."""
+    if exercise is None:
+        return set()
+    return {
+        (facet, value)
+        for facet, values in exercise_facets(exercise)
+        for value in values
+    }
+
+
+def filter_key(filters):
+    """Return filters, given as a dict or (facet, value) pairs, as a sorted tuple of pairs that
+    can key a cache. Filters with an empty value match any exercise, so they are left out.
+    """
+    if isinstance(filters, dict):
+        filters = filters.items()
+    return tuple(
+        sorted((facet, value) for facet, value in filters if value not in ("", None))
+    )
+
+
+def to_bitmap(mask):
+    """Pack a boolean array into a bitmap."""
+    return np.packbits(mask, bitorder="little")
+
+
+class BitmapIndex:
+    """Bitmaps of the exercises with each value of each facet, and the candidate pools and
+    facet values found from them, cached by filters. Shared between sessions, so the bitmaps and
+    pools are never modified."""
+
+    def __init__(self, size, bitmaps, drawable):
+        # Number of exercises.
+        self.size = size
+        # Facet -> value -> bitmap, with facets and values in the order they first appear.
+        self.bitmaps = bitmaps
+        # Bitmap of the exercises that can be drawn, those with a weight above 0.
+        self.drawable = drawable
+        # filter_key -> ids of the drawable exercises matching the filters.
+        self._pools = {}
+        # (facet, filter_key) -> values of the facet among exercises matching the filters.
+        self._values = {}
+        self._lock = threading.Lock()
+        for facet in bitmaps.values():
+            for bitmap in facet.values():
+                bitmap.flags.writeable = False
+
+    @classmethod
+    def from_exercises(cls, exercises, weights):
+        """Index the facets of a list of exercises, where exercise i has id i."""
+        masks = {}
+        for exercise_id, exercise in enumerate(exercises):
+            for facet, exercise_values in exercise_facets(exercise):
+                values = masks.setdefault(facet, {})
+                for value in exercise_values:
+                    mask = values.get(value)
+                    if mask is None:
+                        mask = values[value] = np.zeros(len(exercises), dtype=bool)
+                    mask[exercise_id] = True
+        bitmaps = {
+            facet: {value: to_bitmap(mask) for value, mask in values.items()}
+            for facet, values in masks.items()
+        }
+        return cls(len(exercises), bitmaps, to_bitmap(np.asarray(weights) > 0))
+
+    def updated(self, size, changes, drawable):
+        """Return the index of a newer snapshot of the bank, with size exercise ids, where the
+        facets of some exercises changed. changes are (exercise id, old exercise, new exercise),
+        with None for an exercise that didn't exist or was removed.
+
+        Only the bitmaps of facet values that changed are copied. The rest, and the cached pools
+        the changes made no difference to, are shared with this index.
+        """
+        length = -(-size // 8)
+        bitmaps = {facet: dict(values) for facet, values in self.bitmaps.items()}
+        copied = set()
+
+        def writable(facet, value):
+            values = bitmaps.setdefault(facet, {})
+            if (facet, value) not in copied:
+                bitmap = np.zeros(length, dtype=np.uint8)
+                old = values.get(value)
+                if old is not None:
+                    bitmap[: len(old)] = old
+                values[value] = bitmap
+                copied.add((facet, value))
+            return values[value]
+
+        for exercise_id, old, new in changes:
+            byte, bit = divmod(exercise_id, 8)
+            old_pairs, new_pairs = facet_pairs(old), facet_pairs(new)
+            for facet, value in old_pairs - new_pairs:
+                writable(facet, value)[byte] &= ~np.uint8(1 << bit)
+            for facet, value in new_pairs - old_pairs:
+                writable(facet, value)[byte] |= np.uint8(1 << bit)
+
+        for facet, values in bitmaps.items():
+            for value, bitmap in list(values.items()):
+                if (facet, value) in copied and not bitmap.any():
+                    # No exercise has this value any more.
+                    del values[value]
+                elif len(bitmap) < length:
+                    values[value] = np.concatenate(
+                        [bitmap, np.zeros(length - len(bitmap), dtype=np.uint8)]
+                    )
+        index = BitmapIndex(
+            size,
+            {facet: values for facet, values in bitmaps.items() if values},
+            drawable,
+        )
+
+        # A cached pool still holds if none of the changed exercises joined or left it.
+        changed = np.array(sorted({change[0] for change in changes}), dtype=np.int64)
+        with self._lock:
+            pools = list(self._pools.items())
+        for key, ids in pools:
+            bits = index.bitmap(key)
+            after = (bits[changed // 8] >> (changed % 8).astype(np.uint8)) & 1
+            before = np.isin(changed, ids)
+            if np.array_equal(after.astype(bool), before):
+                index._pools[key] = ids
+        return index
+
+    def facets(self):
+        """Return the facets exercises are indexed by."""
+        return tuple(self.bitmaps)
+
+    def bitmap(self, filters, drawable=True):
+        """Return the bitmap of the exercises matching every filter, only counting drawable
+        exercises unless drawable is False. Filters on a value no exercise has match nothing.
+        """
+        bitmap = self.drawable if drawable else None
+        for facet, value in filter_key(filters):
+            facet_bitmap = self.bitmaps.get(facet, {}).get(value)
+            if facet_bitmap is None:
+                return np.zeros_like(self.drawable)
+            bitmap = facet_bitmap if bitmap is None else bitmap & facet_bitmap
+        if bitmap is None:
+            return np.full_like(self.drawable, 0xFF)
+        return bitmap
+
+    def pool(self, filters):
+        """Return the ids of the drawable exercises matching every filter, in order."""
+        key = filter_key(filters)
+        ids = self._pools.get(key)
+        if ids is None:
+            bits = np.unpackbits(self.bitmap(key), count=self.size, bitorder="little")
+            ids = np.flatnonzero(bits)
+            ids.flags.writeable = False
+            with self._lock:
+                ids = self._pools.setdefault(key, ids)
+        return ids
+
+    def values(self, facet, filters=()):
+        """Return the values of a facet that exercises matching every filter have, in the order
+        they first appear in the bank."""
+        key = (facet, filter_key(filters))
+        values = self._values.get(key)
+        if values is None:
+            bitmap = self.bitmap(key[1], drawable=False)
+            values = tuple(
+                value
+                for value, facet_bitmap in self.bitmaps.get(facet, {}).items()
+                if np.any(facet_bitmap & bitmap)
+            )
+            with self._lock:
+                values = self._values.setdefault(key, values)
+        return values
+
+    def exercise_facets(self, exercise_id):
+        """Return facet -> value, or list of values, of one exercise. Placements are left out if
+        they are every pair of the exercise's categories and body parts."""
+        byte, bit = divmod(exercise_id, 8)
+        facets = {}
+        for facet, values in self.bitmaps.items():
+            matching = [
+                value for value, bitmap in values.items() if bitmap[byte] & (1 << bit)
+            ]
+            if matching:
+                facets[facet] = matching[0] if len(matching) == 1 else matching
+        if (
+            PLACEMENT in facets
+            and "category" in facets
+            and "body_part" in facets
+            and set(facet_values(facets[PLACEMENT])) == set(default_placements(facets))
+        ):
+            del facets[PLACEMENT]
+        return facets
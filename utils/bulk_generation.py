@@ -0,0 +1,164 @@
+"""Generate workouts in bulk, without the app, on a pool of worker processes.
+
+A spec file is a JSON list of workout specs, each generated count times:
+
+    [
+        {
+            "name": "legs",
+            "equipment": true,
+            "slots": [
+                {"type": "strength", "body_part": "legs"},
+                {"body_part": "legs"},
+                {"exercise": "Burpee"}
+            ],
+            "rounds": 3,
+            "work_duration": 30,
+            "rest_duration": 15,
+            "count": 1000
+        }
+    ]
+
+A slot asks for a type and/or body part, or names an exercise to use as given. "filters" can
+limit the exercises to other facet values, like {"difficulty": "beginner"}, and "exercise_bank"
+can name a bank file other than exercise_bank.json. With a "seed", workout number n is generated
+from the seed [seed, n], so running the same spec again makes the same workouts. Workouts are
+written as JSON lines, or saved through file_operations as "<name>_<number>" with a timer config
+of the same name.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import json
+import os
+import sys
+
+import utils.file_operations as file_ops
+from utils.exercise_selector import ExerciseSelector
+from utils.workout_builder import (
+    EXERCISE_BANK,
+    generate_workout,
+    slot_entries,
+    workout_filters,
+)
+
+# Workouts generated by each task sent to a worker.
+BATCH_SIZE = 200
+# Tasks waiting or running per worker. Only this many batches are ever held in memory.
+TASKS_PER_WORKER = 2
+
+# Set in each worker process by _init_worker.
+_specs = None
+_selectors = {}
+
+
+def load_specs(file_path):
+    """Read and check a spec file."""
+    with open(file_path, "r") as f:
+        specs = json.load(f)
+    for number, spec in enumerate(specs, 1):
+        spec.setdefault("name", f"workout_{number}")
+        spec.setdefault("count", 1)
+        spec.setdefault("exercise_bank", EXERCISE_BANK)
+        spec["filters"] = workout_filters(
+            spec.get("equipment", True), **spec.get("filters", {})
+        )
+        for key in ("slots", "rounds", "work_duration", "rest_duration"):
+            if key not in spec:
+                raise ValueError(f"Workout spec {spec['name']!r} has no {key!r}.")
+    return specs
+
+
+def generate(spec, number, selector):
+    """Generate one workout for a spec, as a record to write out."""
+    selector.excluded.clear()
+    seed = [spec["seed"], number] if "seed" in spec else None
+    # Bulk workouts are rarely asked for again, so they aren't cached.
+    exercises = generate_workout(
+        selector, slot_entries(spec["slots"]), seed, cache=None
+    )
+    return {
+        "name": f"{spec['name']}_{number}",
+        "spec": spec["name"],
+        "exercises": [exercise for exercise in exercises if exercise is not None],
+        "unfilled": [i for i, exercise in enumerate(exercises) if exercise is None],
+        "timer_config": {
+            "rounds": spec["rounds"],
+            "work_duration": spec["work_duration"],
+            "rest_duration": spec["rest_duration"],
+        },
+    }
+
+
+def _init_worker(specs):
+    global _specs
+    _specs = specs
+
+
+def _generate_batch(spec_index, start, stop):
+    """Generate workouts start to stop - 1 of a spec in a worker process."""
+    spec = _specs[spec_index]
+    # Each worker keeps one selector per bank and filters, and clears its exclusions for every
+    # workout.
+    key = (spec["exercise_bank"], json.dumps(spec["filters"], sort_keys=True))
+    selector = _selectors.get(key)
+    if selector is None:
+        selector = _selectors[key] = ExerciseSelector(
+            spec["exercise_bank"], spec["filters"]
+        )
+    return [generate(spec, number, selector) for number in range(start, stop)]
+
+
+def _batches(specs, batch_size):
+    for spec_index, spec in enumerate(specs):
+        for start in range(0, spec["count"], batch_size):
+            yield spec_index, start, min(start + batch_size, spec["count"])
+
+
+def generate_all(specs, workers=None, batch_size=BATCH_SIZE):
+    """Generate every workout in the specs, yielding them in order as they are ready."""
+    workers = workers or os.cpu_count()
+    with concurrent.futures.ProcessPoolExecutor(
+        workers, initializer=_init_worker, initargs=(specs,)
+    ) as executor:
+        pending = collections.deque()
+        for batch in _batches(specs, batch_size):
+            pending.append(executor.submit(_generate_batch, *batch))
+            if len(pending) >= workers * TASKS_PER_WORKER:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def save(record):
+    """Save a generated workout and its timer config through file_operations."""
+    file_ops.save_workout(record["name"], record["exercises"])
+    file_ops.save_timer_config(record["name"], record["timer_config"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Generate workouts in bulk from a spec file."
+    )
+    parser.add_argument("spec_file")
+    parser.add_argument(
+        "--output", help="JSON lines file to write to. Defaults to standard output."
+    )
+    parser.add_argument(
+        "--save",
+        action="store_true",
+        help="Save the workouts and timer configs instead of writing JSON lines.",
+    )
+    parser.add_argument("--workers", type=int, help="Defaults to the number of CPUs.")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    records = generate_all(load_specs(args.spec_file), args.workers, args.batch_size)
+    if args.save:
+        for record in records:
+            save(record)
+    else:
+        output = open(args.output, "w") if args.output else sys.stdout
+        with output:
+            for record in records:
+                output.write(json.dumps(record) + "\n")
@@ -0,0 +1,62 @@
+"""Workout countdown that runs in the browser."""
+
+import base64
+import functools
+import os
+
+import streamlit.components.v1 as components
+
+from utils import image_assets
+
+_countdown = components.declare_component(
+    "workout_countdown",
+    path=os.path.join(os.path.dirname(__file__), "countdown_frontend"),
+)
+
+
+@functools.lru_cache(maxsize=256)
+def _data_url(thumbnail_path):
+    """Return a thumbnail as a data URL."""
+    with open(thumbnail_path, "rb") as f:
+        return f"data:image/jpeg;base64,{base64.b64encode(f.read()).decode()}"
+
+
+def image_data_url(link):
+    """Return the thumbnail of an exercise image as a data URL, so the browser gets it with the
+    schedule."""
+    return _data_url(image_assets.thumbnail_path(link))
+
+
+def countdown_args(exercises, timer, seq=0):
+    """Return everything the browser needs to run the whole workout on its own."""
+    schedule = []
+    for exercise in exercises:
+        link = exercise["link"]
+        if image_assets.is_image(link):
+            schedule.append({"name": exercise["name"], "image": image_data_url(link)})
+        else:
+            schedule.append({"name": exercise["name"], "link": link})
+    return {
+        "exercises": schedule,
+        "phases": [list(phase) for phase in timer.phases],
+        "total": timer.total_duration,
+        "elapsed": timer.elapsed(),
+        "paused": timer.paused,
+        "seq": seq,
+    }
+
+
+def countdown(args, key):
+    """Show the countdown and return the last event the browser sent, if any."""
+    return _countdown(**args, key=key, default=None)
+
+
+def handle_event(timer, event):
+    """Bring the server-side timer in line with a pause, resume or completion in the browser."""
+    timer.seek(event["elapsed"])
+    if event["event"] == "pause":
+        timer.pause()
+    elif event["event"] == "resume":
+        timer.resume()
+    elif event["event"] == "complete":
+        timer.seek(timer.total_duration)
@@ -0,0 +1,396 @@
+"""Shared, read-only exercise banks.
+
+A bank file is loaded once per process, as a snapshot that is never modified. When the file
+changes, the next snapshot is made from the previous one by applying only what changed, and
+swapped in whole, so readers always see one snapshot or the other. With WORKOUT_BANK_RELOAD set to
+a number of seconds, a background thread checks the files that often and reloads them, so no
+request waits for a reload.
+"""
+
+import collections
+import copy
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+
+from utils.bank_format import BinaryExerciseBank
+from utils.bitmap_index import (
+    PLACEMENT,
+    BitmapIndex,
+    default_placements,
+    placement,
+    to_bitmap,
+)
+
+logger = logging.getLogger(__name__)
+
+# Bank files with this extension are in the binary bank format instead of JSON.
+BINARY_BANK_EXTENSION = ".bank"
+# Seconds between checks for changed bank files, or 0 to check when a bank is loaded instead.
+RELOAD_INTERVAL = float(os.environ.get("WORKOUT_BANK_RELOAD", 0))
+
+# Absolute path -> LiveBank for every bank loaded by this process.
+_banks = {}
+_banks_lock = threading.Lock()
+_watcher = None
+
+# Functions called with (old snapshot, new snapshot, BankDiff or None) when a bank is reloaded,
+# before the new snapshot is swapped in, to carry over or prebuild anything cached per snapshot.
+reload_hooks = []
+
+# Errors loading a bank file that isn't a valid bank, like invalid JSON or an exercise missing
+# its name.
+BANK_ERRORS = (ValueError, KeyError, TypeError)
+
+# Names of the exercises added, removed and changed between two snapshots of a bank.
+BankDiff = collections.namedtuple("BankDiff", ["added", "removed", "changed"])
+
+
+def bank_version(data):
+    """Return a version for an exercise bank that changes whenever its contents do."""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def exercise_weight(exercise):
+    """Return the weight of an exercise in a bank."""
+    weight = float(exercise.get("weight", 1))
+    if weight < 0:
+        raise ValueError(f"{exercise['name']} has a negative weight.")
+    return weight
+
+
+def exercise_list(exercise_bank):
+    """Return a parsed bank as {"exercises": [...]}, converting it from the older layout."""
+    if not isinstance(exercise_bank, dict):
+        raise ValueError("An exercise bank is a JSON object.")
+    if isinstance(exercise_bank.get("exercises"), list):
+        return exercise_bank
+    return {"exercises": nested_exercises(exercise_bank)}
+
+
+def nested_exercises(exercise_bank):
+    """Return the exercises of a bank in the older layout, category -> body part -> exercises,
+    as a list of exercises with their categories and body parts as facets. An exercise in more
+    than one pool is listed once, with every category and body part it was under, and with the
+    pools it was in as its placements unless it was in every pairing of them."""
+    exercises = {}
+    for category, body_parts in exercise_bank.items():
+        for body_part, pool in body_parts.items():
+            for exercise in pool:
+                merged = exercises.get(exercise["name"])
+                if merged is None:
+                    merged = exercises[exercise["name"]] = dict(
+                        exercise, category=[], body_part=[], placement=[]
+                    )
+                for facet, value in (
+                    ("category", category),
+                    ("body_part", body_part),
+                    (PLACEMENT, placement(category, body_part)),
+                ):
+                    if value not in merged[facet]:
+                        merged[facet].append(value)
+    for exercise in exercises.values():
+        if set(exercise[PLACEMENT]) == set(default_placements(exercise)):
+            del exercise[PLACEMENT]
+        for facet in ("category", "body_part", PLACEMENT):
+            if len(exercise.get(facet, ())) == 1:
+                exercise[facet] = exercise[facet][0]
+    return list(exercises.values())
+
+
+class ExerciseBank:
+    """A parsed exercise bank and its indexes. Shared between sessions, so it is never modified.
+
+    A bank is {"exercises": [...]}. Each exercise has a name, a link, an optional weight and its
+    facets, like "equipment": false, "category": "strength", "body_part": "legs",
+    "difficulty": "beginner" or "impact": "low". A facet can have a list of values. An exercise
+    with several categories and body parts that isn't in every pairing of them lists the pairs
+    it is in, like "placement": ["strength/cardio", "mobility/legs"]. Banks in the older layout,
+    category -> body part -> exercises, can be read too.
+    """
+
+    def __init__(self, exercise_bank, version=None):
+        self.exercise_bank = exercise_bank = exercise_list(exercise_bank)
+        # Identifies the bank's contents, e.g. in the keys of cached workouts.
+        self.version = version or bank_version(
+            json.dumps(exercise_bank, sort_keys=True).encode()
+        )
+        # Shared by the snapshots updated from this one, which keep its exercise ids.
+        self.lineage = object()
+        # Name -> id of exercises removed since the first snapshot of the lineage. Their ids are
+        # kept, without facets and with a weight of 0, so other ids don't change.
+        self.retired = {}
+        self.build_index()
+
+    @classmethod
+    def from_file(cls, file_path):
+        """Parse an exercise bank from a JSON file."""
+        with open(file_path, "rb") as f:
+            data = f.read()
+        return cls(json.loads(data), bank_version(data))
+
+    def build_index(self):
+        """Number the exercises and index them by name and by the value of each facet."""
+        # Exercise id -> exercise.
+        self.exercises = tuple(self.exercise_bank["exercises"])
+        self.names = [exercise["name"] for exercise in self.exercises]
+        self.links = [exercise["link"] for exercise in self.exercises]
+        self.ids = {}
+        for exercise_id, name in enumerate(self.names):
+            if self.ids.setdefault(name, exercise_id) != exercise_id:
+                raise ValueError(f"{name} is in the exercise bank more than once.")
+        # Exercise id -> how likely the exercise is to be drawn, relative to the others that
+        # could fill a slot. Exercises without a weight have a weight of 1, and exercises with a
+        # weight of 0 are never drawn.
+        self.weights = np.array(
+            [exercise_weight(exercise) for exercise in self.exercises],
+            dtype=np.float64,
+        )
+        self.weighted = bool(np.any(self.weights[self.weights > 0] != 1))
+        # Selectors in every session share the weights, so make sure none of them writes to it.
+        self.weights.flags.writeable = False
+        self.facets = BitmapIndex.from_exercises(self.exercises, self.weights)
+
+    def updated(self, exercise_bank, version=None):
+        """Return a snapshot of the bank with the contents of a newer version of its file, and a
+        BankDiff from this snapshot. Only the added, removed and changed exercises are indexed
+        again, and the new snapshot shares everything else with this one.
+
+        Exercises keep their ids. A removed exercise's id is retired, and given back to it if it
+        is added again. New exercises get new ids.
+        """
+        exercise_bank = exercise_list(exercise_bank)
+        version = version or bank_version(
+            json.dumps(exercise_bank, sort_keys=True).encode()
+        )
+        if version == self.version:
+            return self, BankDiff([], [], [])
+        incoming = {}
+        for exercise in exercise_bank["exercises"]:
+            if incoming.setdefault(exercise["name"], exercise) is not exercise:
+                raise ValueError(
+                    f"{exercise['name']} is in the exercise bank more than once."
+                )
+        if len(self.retired) + len(self.ids) > 2 * len(incoming):
+            # Most ids would be retired, so start a new lineage without them.
+            bank = ExerciseBank(exercise_bank, version)
+            return bank, BankDiff(
+                [name for name in incoming if name not in self.ids],
+                [name for name in self.ids if name not in incoming],
+                [
+                    name
+                    for name, exercise in incoming.items()
+                    if name in self.ids and exercise != self.find_exercise(name)
+                ],
+            )
+
+        exercises = list(self.exercises)
+        names = list(self.names)
+        links = list(self.links)
+        weights = self.weights.tolist()
+        ids = dict(self.ids)
+        retired = dict(self.retired)
+        diff = BankDiff([], [], [])
+        # (exercise id, old exercise, new exercise) of every exercise that changed.
+        changes = []
+        for name, exercise_id in self.ids.items():
+            if name not in incoming:
+                diff.removed.append(name)
+                changes.append((exercise_id, exercises[exercise_id], None))
+                exercises[exercise_id] = None
+                links[exercise_id] = None
+                weights[exercise_id] = 0.0
+                retired[name] = ids.pop(name)
+        for name, exercise in incoming.items():
+            exercise_id = ids.get(name)
+            if exercise_id is None:
+                diff.added.append(name)
+                exercise_id = retired.pop(name, None)
+                if exercise_id is None:
+                    exercise_id = len(names)
+                    names.append(name)
+                    exercises.append(None)
+                    links.append(None)
+                    weights.append(0.0)
+                ids[name] = exercise_id
+            elif exercise != exercises[exercise_id]:
+                diff.changed.append(name)
+            else:
+                continue
+            changes.append((exercise_id, exercises[exercise_id], exercise))
+            exercises[exercise_id] = exercise
+            links[exercise_id] = exercise["link"]
+            weights[exercise_id] = exercise_weight(exercise)
+
+        bank = copy.copy(self)
+        bank.exercise_bank = exercise_bank
+        bank.version = version
+        if retired or names != list(incoming):
+            # Seeded workouts depend on the order of the exercise ids, which now differs from a
+            # bank loaded from the same file, so this snapshot needs a version of its own.
+            bank.version = bank_version(f"{version} {json.dumps(names)}".encode())
+        bank.exercises = tuple(exercises)
+        bank.names = names
+        bank.links = links
+        bank.ids = ids
+        bank.retired = retired
+        bank.weights = np.array(weights, dtype=np.float64)
+        bank.weighted = bool(np.any(bank.weights[bank.weights > 0] != 1))
+        bank.weights.flags.writeable = False
+        bank.facets = self.facets.updated(
+            len(names), changes, to_bitmap(bank.weights > 0)
+        )
+        return bank, diff
+
+    def find_exercise(self, exercise_name):
+        """Return the exercise with the given name, or None if it isn't in the bank."""
+        exercise_id = self.ids.get(exercise_name)
+        if exercise_id is None:
+            return None
+        return self.exercises[exercise_id]
+
+
+class LiveBank:
+    """The latest snapshot of a bank file, reloaded when the file changes."""
+
+    def __init__(self, path):
+        self.path = path
+        # The snapshot readers should use. It is replaced, never modified, so reading it needs no
+        # lock.
+        self.current = None
+        # (mtime, size) of the file when it was last loaded.
+        self.file_version = None
+        # BankDiff of the last reload, or None if the bank was loaded from scratch.
+        self.last_diff = None
+        # Taken only to swap in a new snapshot.
+        self._lock = threading.Lock()
+        # Held by the thread loading the file, so only one thread loads it at a time.
+        self._load_lock = threading.Lock()
+        self.reload()
+
+    def reload(self):
+        """Load the file if it has changed since it was last loaded, updating the current snapshot
+        in place of parsing and indexing the whole bank again where possible. Return whether it
+        had changed.
+
+        The file is loaded and indexed without holding the lock, which is only taken to swap in
+        the new snapshot. While one thread is loading the file, others keep using the current
+        snapshot instead of waiting to load it too. If the changed file can't be loaded, the current
+        snapshot is kept until the file changes again.
+        """
+        stat = os.stat(self.path)
+        file_version = (stat.st_mtime_ns, stat.st_size)
+        if file_version == self.file_version:
+            return False
+        # Only wait for another thread's load if there is no snapshot to use meanwhile.
+        if not self._load_lock.acquire(blocking=self.current is None):
+            return False
+        try:
+            if file_version == self.file_version:
+                return False
+            old = self.current
+            try:
+                new, diff = self._load(old)
+            except BANK_ERRORS:
+                if old is not None:
+                    self.file_version = file_version
+                raise
+            if old is not None and new is not old:
+                for hook in reload_hooks:
+                    hook(old, new, diff)
+            with self._lock:
+                self.last_diff = diff
+                self.file_version = file_version
+                self.current = new
+            return True
+        finally:
+            self._load_lock.release()
+
+    def _load(self, old):
+        """Return a snapshot of the file and its BankDiff from an old snapshot, if there is one
+        to update."""
+        if self.path.endswith(BINARY_BANK_EXTENSION):
+            # A binary bank is mapped rather than parsed, so loading it is already cheap.
+            return BinaryExerciseBank.from_file(self.path), None
+        with open(self.path, "rb") as f:
+            data = f.read()
+        if old is None:
+            return ExerciseBank(json.loads(data), bank_version(data)), None
+        return old.updated(json.loads(data), bank_version(data))
+
+    def latest(self):
+        """Return the current snapshot. Unless a watcher reloads the file, check the file first
+        and reload it if it changed."""
+        if _watcher is None or self.current is None:
+            try:
+                self.reload()
+            except BANK_ERRORS:
+                if self.current is None:
+                    raise
+        return self.current
+
+
+def describe_reload(diff):
+    """Return a summary of a reload for the log."""
+    if diff is None:
+        return "loaded from scratch"
+    return (
+        ", ".join(
+            f"{len(names)} {kind}" for kind, names in zip(diff._fields, diff) if names
+        )
+        or "no changes"
+    )
+
+
+def watch_exercise_banks(interval=None):
+    """Start a background thread that reloads every loaded bank file within interval seconds of
+    it changing (RELOAD_INTERVAL by default), unless one is already running."""
+    global _watcher
+
+    def watch():
+        while True:
+            time.sleep(interval or RELOAD_INTERVAL)
+            with _banks_lock:
+                sources = list(_banks.values())
+            for source in sources:
+                try:
+                    if source.reload():
+                        logger.info(
+                            "Reloaded %s: %s",
+                            source.path,
+                            describe_reload(source.last_diff),
+                        )
+                except (OSError, *BANK_ERRORS) as e:
+                    logger.warning("Could not reload %s: %s", source.path, e)
+
+    with _banks_lock:
+        if _watcher is None:
+            _watcher = threading.Thread(
+                target=watch, name="exercise-bank-watcher", daemon=True
+            )
+            _watcher.start()
+        return _watcher
+
+
+def bank_source(file_path):
+    """Return the LiveBank of a file, shared by everything in the process that uses the file."""
+    path = os.path.abspath(file_path)
+    with _banks_lock:
+        source = _banks.get(path)
+    if source is None:
+        source = LiveBank(path)
+        with _banks_lock:
+            source = _banks.setdefault(path, source)
+        if RELOAD_INTERVAL:
+            watch_exercise_banks()
+    return source
+
+
+def load_exercise_bank(file_path):
+    """Return the latest snapshot of the shared exercise bank for a file."""
+    return bank_source(file_path).latest()
@@ -1,54 +1,413 @@
 """Exercise selector class."""
 
-import json
+import array
+import bisect
 import random
+import sys
+import threading
+import weakref
+
+import numpy as np
+
+from utils.bitmap_index import PLACEMENT, filter_key, placement, split_placement
+from utils.exercise_bank import bank_source, reload_hooks
+from utils.name_index import name_index
+
+# Number of random draws to try before falling back to filtering a pool for exercises that have
+# not been used yet.
+MAX_REJECTED_DRAWS = 8
+
+# How much less likely an exercise from the most recent saved workout is to be drawn, and the
+# number of workouts after which that penalty has halved.
+RECENCY_PENALTY = 0.8
+RECENCY_HALF_LIFE = 3
+# Number of recent saved workouts that make exercises less likely.
+RECENT_WORKOUTS = 20
+
+# Bank -> filter_key -> AliasTable over the bank's candidate pool for those filters.
+_alias_tables = weakref.WeakKeyDictionary()
+_alias_tables_lock = threading.Lock()
+
+
+class AliasTable:
+    """Draws positions in a list of weights, in proportion to the weights, in O(1) per draw
+    (Vose's alias method)."""
+
+    def __init__(self, weights):
+        count = len(weights)
+        scaled = (
+            np.asarray(weights, dtype=np.float64) * count / np.sum(weights)
+        ).tolist()
+        self.probability = array.array("d", [1.0]) * count
+        self.alias = array.array("I", range(count))
+        small = [i for i, weight in enumerate(scaled) if weight < 1]
+        large = [i for i, weight in enumerate(scaled) if weight >= 1]
+        while small and large:
+            less, more = small.pop(), large.pop()
+            self.probability[less] = scaled[less]
+            self.alias[less] = more
+            scaled[more] += scaled[less] - 1
+            (small if scaled[more] < 1 else large).append(more)
+
+    def draw(self, random):
+        """Return a position, drawn with the given random.Random."""
+        position = random.randrange(len(self.alias))
+        if random.random() < self.probability[position]:
+            return position
+        return self.alias[position]
+
+
+def alias_table(bank, key):
+    """Return the alias table over the weights of a bank's candidate pool, building it the first
+    time it is needed. Tables are shared by every selector for the bank."""
+    with _alias_tables_lock:
+        tables = _alias_tables.setdefault(bank, {})
+        table = tables.get(key)
+        if table is None:
+            table = tables[key] = AliasTable(bank.weights[bank.facets.pool(key)])
+        return table
+
+
+def _carry_alias_tables(old, new, diff):
+    """Reload hook giving a new snapshot of a bank the old snapshot's alias tables over pools and
+    weights that didn't change, and building the rest before the snapshot is swapped in.
+    """
+    with _alias_tables_lock:
+        tables = dict(_alias_tables.get(old, {}))
+    if not tables or not new.weighted:
+        return
+    carried = {}
+    for key, table in tables.items():
+        pool = new.facets.pool(key)
+        if not len(pool):
+            continue
+        if (
+            new.lineage is old.lineage
+            and pool is old.facets.pool(key)
+            and np.array_equal(new.weights[pool], old.weights[pool])
+        ):
+            carried[key] = table
+        else:
+            carried[key] = AliasTable(new.weights[pool])
+    with _alias_tables_lock:
+        tables = _alias_tables.setdefault(new, {})
+        for key, table in carried.items():
+            tables.setdefault(key, table)
+
+
+reload_hooks.append(_carry_alias_tables)
+
+
+class ExerciseIdSet:
+    """A set of exercise ids, kept as a sorted array of 32-bit ids. A session only ever uses a few
+    dozen exercises, so this stays a few hundred bytes however big the bank is."""
+
+    __slots__ = ("ids",)
+
+    def __init__(self):
+        self.ids = array.array("I")
+
+    def __sizeof__(self):
+        return object.__sizeof__(self) + sys.getsizeof(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, exercise_id):
+        position = bisect.bisect_left(self.ids, exercise_id)
+        return position < len(self.ids) and self.ids[position] == exercise_id
+
+    def add(self, exercise_ids):
+        """Add one or more exercise ids."""
+        if isinstance(exercise_ids, int):
+            exercise_ids = [exercise_ids]
+        for exercise_id in exercise_ids:
+            position = bisect.bisect_left(self.ids, exercise_id)
+            if position == len(self.ids) or self.ids[position] != exercise_id:
+                self.ids.insert(position, exercise_id)
+
+    def clear(self):
+        del self.ids[:]
+
+    def isin(self, exercise_ids):
+        """Return a boolean array of which of the given exercise ids are in the set."""
+        return np.isin(exercise_ids, np.frombuffer(self.ids, dtype=np.uint32))
+
+    def mask(self, size):
+        """Return a boolean array over every exercise id below size, true for ids in the set."""
+        mask = np.zeros(size, dtype=bool)
+        mask[np.frombuffer(self.ids, dtype=np.uint32)] = True
+        return mask
 
 
 class ExerciseSelector:
-    def __init__(self, exercise_bank_file):
+    def __init__(self, exercise_bank_file, filters=None):
         self.exercise_bank_file = exercise_bank_file
-        self.exercise_bank = self.load_exercise_bank(exercise_bank_file)
+        # Facet values every exercise this selector picks must have, like {"equipment": False},
+        # as a filter_key.
+        self.filters = filter_key(filters or {})
+        # The bank is shared by every selector for the same file, so this selector never modifies
+        # it. Ids of exercises already used are kept here and skipped instead.
+        self.source = bank_source(exercise_bank_file)
+        self.bank = self.source.latest()
+        self.excluded = ExerciseIdSet()
+        # Exercise id -> factor between 0 and 1 its weight is multiplied by, for exercises used in
+        # recent workouts.
+        self.recency = {}
+        self.seed(None)
+
+    def __sizeof__(self):
+        # Only the exclusions and recency belong to this selector. The bank is shared with other
+        # selectors.
+        return (
+            object.__sizeof__(self)
+            + sys.getsizeof(self.excluded)
+            + sys.getsizeof(self.recency)
+        )
+
+    def refresh(self):
+        """Switch to the latest snapshot of the bank if the file has changed, keeping the
+        exercises this selector has used and their recency. Return whether it switched.
+        """
+        bank = self.source.latest()
+        if bank is self.bank:
+            return False
+        if bank.lineage is not self.bank.lineage:
+            # The new snapshot numbers exercises differently, so carry them over by name.
+            names = self.bank.names
+            excluded = ExerciseIdSet()
+            excluded.add(
+                [bank.ids[names[i]] for i in self.excluded.ids if names[i] in bank.ids]
+            )
+            self.excluded = excluded
+            self.recency = {
+                bank.ids[names[i]]: factor
+                for i, factor in self.recency.items()
+                if names[i] in bank.ids
+            }
+        self.bank = bank
+        return True
+
+    def seed(self, seed):
+        """Seed the selector's random draws, so the same seed makes the same selections from the
+        same bank. A seed is an int or a list of ints. None seeds from the OS."""
+        sequence = np.random.SeedSequence(seed)
+        self.rng = np.random.default_rng(sequence)
+        self.random = random.Random(int(sequence.generate_state(1)[0]))
+
+    def set_recent_workouts(self, workouts):
+        """Make exercises from recent workouts less likely to be drawn. workouts are lists of
+        exercise names, most recent first."""
+        recency = {}
+        for age, names in enumerate(workouts):
+            factor = 1 - RECENCY_PENALTY * 0.5 ** (age / RECENCY_HALF_LIFE)
+            for name in names:
+                exercise_id = self.bank.ids.get(name)
+                if exercise_id is not None:
+                    recency[exercise_id] = min(recency.get(exercise_id, 1), factor)
+        self.recency = recency
 
-    def load_exercise_bank(self, file_path):
-        """Load the exercise bank from a JSON file."""
-        with open(file_path, "r") as f:
-            return json.load(f)
+    def _weights(self, exercise_ids):
+        """Return the probabilities of drawing each of the given exercises, or None if they are
+        all equally likely."""
+        if not self.bank.weighted and not self.recency:
+            return None
+        weights = (
+            self.bank.weights[exercise_ids]
+            if self.bank.weighted
+            else np.ones(len(exercise_ids))
+        )
+        if self.recency:
+            weights = weights * [self.recency.get(i, 1) for i in exercise_ids.tolist()]
+        return weights / weights.sum()
+
+    @property
+    def exercise_bank(self):
+        """The parsed exercise bank: {"exercises": [...]}. Read-only."""
+        return self.bank.exercise_bank
+
+    def _key(self, category, body_part):
+        """Return the filters for a slot asking for a category and body part. An empty category
+        or body part matches any."""
+        if category and body_part:
+            # Only exercises filed under this pair, not ones with the category under another
+            # body part and the body part under another category.
+            return filter_key(
+                self.filters + ((PLACEMENT, placement(category, body_part)),)
+            )
+        return filter_key(
+            self.filters + (("category", category), ("body_part", body_part))
+        )
+
+    def _placements(self, category, body_part):
+        """Return the (category, body part) pairs exercises this selector can pick are filed
+        under, only those with the category or body part if one is given."""
+        return [
+            (pair_category, pair_body_part)
+            for pair_category, pair_body_part in map(
+                split_placement,
+                self.bank.facets.values(PLACEMENT, self._key(category, body_part)),
+            )
+            if category in ("", pair_category) and body_part in ("", pair_body_part)
+        ]
+
+    def facet_values(self, facet, category=""):
+        """Return the values of a facet, like "difficulty", among the exercises this selector can
+        pick, optionally only those in a category."""
+        return self.bank.facets.values(facet, self._key(category, ""))
 
     def select_exercise(self, category, body_part):
         """Randomly select an exercise based on category and body part."""
-        # If neither a category nor body part is given, randomly choose a category and body part.
-        if not category and not body_part:
-            category = random.choice(list(self.exercise_bank.keys()))
-            body_part = random.choice(list(self.exercise_bank[category].keys()))
-        # If a category isn't given, randomly choose a category that also contains the given body part.
-        elif not category:
-            valid_categories = []
-            for k in self.exercise_bank.keys():
-                if body_part in self.exercise_bank[k].keys():
-                    valid_categories.append(k)
-            if valid_categories:
-                category = random.choice(valid_categories)
-        # If a category is given, but a body part is not, randomly choose an exercise based solely
-        # on category.
-        elif not body_part:
-            body_part = random.choice(list(self.exercise_bank[category].keys()))
-
-        try:
-            exercises = self.exercise_bank[category][body_part]
-            exercise = random.choice(exercises)
-            return exercise["name"], exercise["link"]
-        except (KeyError, IndexError):
+        # Fill in a missing category or body part from the pairs exercises are filed under: a
+        # random category that has the body part, or a random category and then one of its body
+        # parts, or a random body part of the category.
+        if not category or not body_part:
+            pairs = self._placements(category, body_part)
+            if not category:
+                category = self._choose(list(dict.fromkeys(pair[0] for pair in pairs)))
+            if not body_part:
+                body_part = self._choose(
+                    [pair[1] for pair in pairs if pair[0] == category]
+                )
+        if category is None or body_part is None:
+            return None, None
+
+        exercise_id = self._draw(self._key(category, body_part))
+        if exercise_id is None:
             return None, None
+        return self.bank.names[exercise_id], self.bank.links[exercise_id]
+
+    def _choose(self, options):
+        """Randomly choose one of the options, or None if there are none."""
+        return self.random.choice(options) if options else None
+
+    def _draw(self, key):
+        """Randomly draw an exercise id from the candidates matching a filter_key, in proportion
+        to their weights and recency, skipping excluded exercises."""
+        candidates = self.bank.facets.pool(key)
+        if not len(candidates):
+            return None
+        table = alias_table(self.bank, key) if self.bank.weighted else None
+        # Most of a pool is normally still available and not used recently, so a few draws from
+        # the bank's weights, rejecting excluded exercises and recently used ones in proportion
+        # to their recency, avoid scanning it.
+        for _ in range(MAX_REJECTED_DRAWS):
+            if table is None:
+                position = self.random.randrange(len(candidates))
+            else:
+                position = table.draw(self.random)
+            exercise_id = int(candidates[position])
+            if exercise_id in self.excluded:
+                continue
+            factor = self.recency.get(exercise_id)
+            if factor is None or self.random.random() < factor:
+                return exercise_id
+        available = candidates[~self.excluded.isin(candidates)]
+        if not len(available):
+            return None
+        return int(self.rng.choice(available, p=self._weights(available)))
+
+    def select_many(self, entries):
+        """Select a different exercise for every (category, body part) entry in one pass.
+
+        Returns a (name, link) pair for each entry, or (None, None) for an entry that could not be
+        filled. Selected exercises are excluded from later selection.
+        """
+        bank = self.bank
+        rng = self.rng
+        # Which exercise ids are taken, either before this call or by an entry, and which entry
+        # each exercise was assigned to.
+        used = self.excluded.mask(len(bank.names))
+        owner = {}
+        assignment = [None] * len(entries)
+
+        # Entries asking for the same thing draw from the same candidate pool, so fill each group
+        # with a single sample, starting with the scarcest pools.
+        groups = {}
+        for i, (category, body_part) in enumerate(entries):
+            groups.setdefault((category or "", body_part or ""), []).append(i)
+        slot_keys = {i: key for key, slots in groups.items() for i in slots}
+        candidates = {key: bank.facets.pool(self._key(*key)) for key in groups}
+        for key in sorted(groups, key=lambda key: len(candidates[key])):
+            pool = candidates[key]
+            available = pool[~used[pool]]
+            slots = groups[key][: len(available)]
+            picks = rng.choice(
+                available,
+                size=len(slots),
+                replace=False,
+                p=self._weights(available) if len(available) else None,
+            )
+            used[picks] = True
+            for slot, exercise_id in zip(slots, picks.tolist()):
+                assignment[slot] = exercise_id
+                owner[exercise_id] = slot
+
+        # An unlucky draw can take the only candidate another entry could use, so try to make room
+        # for each unfilled entry by moving other entries to exercises that are still free. The
+        # exercise an entry moves to is drawn by weight and recency, like the first draws.
+        def augment(slot, visited):
+            pool = candidates[slot_keys[slot]]
+            taken = pool[np.isin(pool, list(owner.keys()))]
+            for exercise_id in rng.permutation(taken).tolist():
+                if exercise_id in visited:
+                    continue
+                visited.add(exercise_id)
+                other = owner[exercise_id]
+                other_pool = candidates[slot_keys[other]]
+                free = other_pool[~used[other_pool]]
+                if len(free):
+                    replacement = int(rng.choice(free, p=self._weights(free)))
+                    used[replacement] = True
+                    assignment[other] = replacement
+                    owner[replacement] = other
+                elif not augment(other, visited):
+                    continue
+                assignment[slot] = exercise_id
+                owner[exercise_id] = slot
+                return True
+            return False
+
+        for slot, exercise_id in enumerate(assignment):
+            if exercise_id is None:
+                augment(slot, set())
+
+        selections = []
+        for exercise_id in assignment:
+            if exercise_id is None:
+                selections.append((None, None))
+            else:
+                selections.append((bank.names[exercise_id], bank.links[exercise_id]))
+        self.excluded.add([i for i in assignment if i is not None])
+        return selections
 
     def exercise_categories(self):
-        """Return categories present in the exercise bank."""
-        return list(self.exercise_bank.keys())
+        """Return categories of the exercises this selector can pick."""
+        return list(self.facet_values("category"))
+
+    def exercise_body_parts(self):
+        """Return body parts of the exercises this selector can pick."""
+        return list(self.facet_values("body_part"))
+
+    def find_exercise(self, exercise_name):
+        """Return the exercise with the given name, or None if it isn't in the exercise bank."""
+        return self.bank.find_exercise(exercise_name)
+
+    def suggest_exercises(self, text, limit=10):
+        """Return up to limit names of exercises in the bank matching partly typed or misspelled
+        text, best first."""
+        return name_index(self.bank).complete(text, limit)
+
+    def resolve_exercise(self, text):
+        """Return the exercise in the bank that a manual entry most likely means, or None if no
+        exercise is close enough."""
+        exercise_name = name_index(self.bank).resolve(text)
+        if exercise_name is None:
+            return None
+        return self.find_exercise(exercise_name)
 
     def remove_exercise(self, exercise_name):
-        """Remove exercise from the exercise bank if it exists to avoid duplicate exercise selection."""
-        for category in self.exercise_bank.keys():
-            for body_part in self.exercise_bank[category].keys():
-                exercises = self.exercise_bank[category][body_part]
-                for exercise in exercises:
-                    if exercise["name"] == exercise_name:
-                        exercises.remove(exercise)
+        """Exclude exercise from selection if it exists to avoid duplicate exercise selection."""
+        exercise_id = self.bank.ids.get(exercise_name)
+        if exercise_id is not None:
+            self.excluded.add(exercise_id)
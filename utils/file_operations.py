@@ -1,8 +1,34 @@
-import json
 import os
 
+from utils.storage import (
+    PAGE_SIZE,
+    TIMERS,
+    WORKOUTS,
+    JsonFileStorage,
+    SqliteStorage,
+)
+
 SAVED_WORKOUTS_PATH = "saved_data/workouts/"
 SAVED_TIMERS_PATH = "saved_data/timers/"
+SAVED_DATABASE_PATH = "saved_data/saved_data.db"
+
+JSON_STORAGE = JsonFileStorage(
+    {WORKOUTS: SAVED_WORKOUTS_PATH, TIMERS: SAVED_TIMERS_PATH}
+)
+
+# Saved items are kept in JSON files unless WORKOUT_STORAGE is set to "sqlite".
+if os.environ.get("WORKOUT_STORAGE") == "sqlite":
+    storage = SqliteStorage(
+        os.environ.get("WORKOUT_STORAGE_DATABASE", SAVED_DATABASE_PATH)
+    )
+else:
+    storage = JSON_STORAGE
+
+
+def set_storage(new_storage):
+    """Use a different storage backend for saved workouts and timer configs."""
+    global storage
+    storage = new_storage
 
 
 def ensure_save_dir(dir):
@@ -12,39 +38,79 @@ def ensure_save_dir(dir):
 
 
 def save_workout(filename, exercises):
-    """Save workouts to a JSON file."""
-    ensure_save_dir(SAVED_WORKOUTS_PATH)
-    with open(os.path.join(SAVED_WORKOUTS_PATH, filename), "w") as f:
-        json.dump(exercises, f, indent=4)
+    """Save workouts."""
+    storage.save(WORKOUTS, filename, exercises)
+
+
+def is_exercise(exercise):
+    """Return whether an exercise in a saved workout has the name and link the app reads."""
+    return (
+        isinstance(exercise, dict)
+        and isinstance(exercise.get("name"), str)
+        and "link" in exercise
+        and (exercise["link"] is None or isinstance(exercise["link"], str))
+    )
+
+
+def workout_exercises(filename):
+    """Return the exercises of a saved workout that can be read, leaving out any that are
+    malformed. A workout that is missing or can't be read has none."""
+    try:
+        exercises = storage.load(WORKOUTS, filename)
+    except ValueError:
+        return []
+    if not isinstance(exercises, list):
+        return []
+    return [exercise for exercise in exercises if is_exercise(exercise)]
 
 
 def load_workouts(filename):
-    """Load workouts from a JSON file."""
+    """Load workouts."""
     workout = {}
-    full_path = os.path.join(SAVED_WORKOUTS_PATH, filename)
-    if os.path.exists(full_path):
-        with open(full_path, "r") as f:
-            exercises = json.load(f)
-        for exercise in exercises:
-            workout[exercise["name"]] = exercise
+    for exercise in workout_exercises(filename):
+        workout[exercise["name"]] = exercise
     return workout
 
 
+def list_workouts():
+    """Return the names of the saved workouts."""
+    return storage.list(WORKOUTS)
+
+
+def recent_workouts(limit):
+    """Return the exercise names of each of the most recently saved workouts, most recent
+    first. Workouts and exercises that can't be read are left out."""
+    workouts = []
+    for name in storage.recent(WORKOUTS, limit):
+        workouts.append([exercise["name"] for exercise in workout_exercises(name)])
+    return workouts
+
+
 def save_timer_config(filename, timer_config):
-    """Save timer configurations to a JSON file."""
-    ensure_save_dir(SAVED_TIMERS_PATH)
-    with open(os.path.join(SAVED_TIMERS_PATH, filename), "w") as f:
-        json.dump(
-            timer_config,
-            f,
-            indent=4,
-        )
+    """Save timer configurations."""
+    storage.save(TIMERS, filename, timer_config)
 
 
 def load_timer_config(filename):
-    """Load timer configurations from a JSON file."""
-    full_path = os.path.join(SAVED_TIMERS_PATH, filename)
-    if os.path.exists(full_path):
-        with open(full_path, "r") as f:
-            return json.load(f)
+    """Load timer configurations."""
+    timer_config = storage.load(TIMERS, filename)
+    if timer_config is not None:
+        return timer_config
     return []
+
+
+def list_timer_configs():
+    """Return the names of the saved timer configurations."""
+    return storage.list(TIMERS)
+
+
+def search_workouts(query="", page=0, page_size=PAGE_SIZE):
+    """Return a page of the saved workouts whose names contain the query, and the total number
+    of matches."""
+    return storage.search(WORKOUTS, query, page * page_size, page_size)
+
+
+def search_timer_configs(query="", page=0, page_size=PAGE_SIZE):
+    """Return a page of the saved timer configurations whose names contain the query, and the
+    total number of matches."""
+    return storage.search(TIMERS, query, page * page_size, page_size)
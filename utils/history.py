@@ -0,0 +1,330 @@
+"""Append-only history of workout sessions, with rollups kept up to date as sessions are added
+and queries that stream over the whole log.
+
+Every session that is completed or ended early is appended to the log as a line of JSON. The log
+is split into segments, segment-000001.jsonl and so on under WORKOUT_HISTORY_PATH, and a new
+segment is started once the last one reaches SEGMENT_BYTES. Segments are only ever appended to.
+
+The rollups (sessions by status, sessions per exercise and weekly minutes per body part) are saved
+in rollups.json with the position in the log they include everything up to. Bringing them up to
+date only reads the records added after that position, so it doesn't get slower as the history
+grows. Anything else is answered by aggregate(), which reads the log one record at a time:
+
+    python -m utils.history rollups
+    python -m utils.history query body_part_minutes --since 2026-10-01
+"""
+
+import argparse
+import copy
+import datetime
+import json
+import os
+import re
+import threading
+import time
+
+from utils.bitmap_index import facet_values
+
+HISTORY_PATH = os.environ.get("WORKOUT_HISTORY_PATH", "saved_data/history/")
+SEGMENT_BYTES = 16 * 1024 * 1024
+# The rollups are saved once this many records have been added to them since they last were.
+CHECKPOINT_RECORDS = 100
+ROLLUPS_FILE = "rollups.json"
+
+COMPLETED = "completed"
+ABANDONED = "abandoned"
+
+SEGMENT_NAME = re.compile(r"segment-(\d+)\.jsonl$")
+
+
+def exercise_body_parts(exercise, bank=None):
+    """Return the body parts of an exercise in a workout, from the exercise bank if it is there,
+    since a workout only has the body part its slot asked for."""
+    body_part = exercise.get("body_part")
+    if bank is not None:
+        found = bank.find_exercise(exercise["name"])
+        if found is not None:
+            body_part = found.get("body_part")
+    return facet_values(body_part) if body_part else []
+
+
+def session_record(exercises, timer, status=None, bank=None):
+    """Return the history record of a workout session: the exercises being timed, as in a workout,
+    the timer config, how much of the workout was done and how long it took with pauses. The
+    status is COMPLETED if the timer has finished and ABANDONED if not, unless it is given.
+    """
+    elapsed = timer.elapsed()
+    wall_time = max(timer.wall_time(), elapsed)
+    return {
+        "time": time.time(),
+        "status": status or (COMPLETED if timer.state().done else ABANDONED),
+        "exercises": [
+            {
+                "name": exercise["name"],
+                "body_part": exercise_body_parts(exercise, bank),
+                "work_seconds": round(work_seconds, 1),
+            }
+            for exercise, work_seconds in zip(exercises, timer.work_seconds())
+        ],
+        "rounds": timer.rounds,
+        "work_duration": timer.work_duration,
+        "rest_duration": timer.rest_duration,
+        "elapsed": round(elapsed, 1),
+        "wall_time": round(wall_time, 1),
+        "pauses": timer.pauses,
+        "paused_seconds": round(wall_time - elapsed, 1),
+    }
+
+
+def week(timestamp):
+    """Return the ISO week a timestamp is in, in local time, like "2026-W42"."""
+    year, week_number, _ = datetime.date.fromtimestamp(timestamp).isocalendar()
+    return f"{year}-W{week_number:02}"
+
+
+def add_to_rollups(rollups, record):
+    """Add a record to the rollups: sessions by status, the number of sessions each exercise was
+    worked on in, and minutes of work per body part for each week."""
+    rollups["sessions"][record["status"]] = (
+        rollups["sessions"].get(record["status"], 0) + 1
+    )
+    exercise_sessions = rollups["exercise_sessions"]
+    weekly = None
+    for exercise in record["exercises"]:
+        if exercise["work_seconds"] <= 0:
+            continue
+        exercise_sessions[exercise["name"]] = (
+            exercise_sessions.get(exercise["name"], 0) + 1
+        )
+        if weekly is None:
+            weekly = rollups["weekly_body_part_minutes"].setdefault(
+                week(record["time"]), {}
+            )
+        for body_part in exercise["body_part"]:
+            weekly[body_part] = weekly.get(body_part, 0) + exercise["work_seconds"] / 60
+
+
+class HistoryLog:
+    """A segmented, append-only log of session records in a directory."""
+
+    def __init__(self, path=HISTORY_PATH, segment_bytes=SEGMENT_BYTES):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        # The rollups, the (segment, offset) in the log they include every record before, and
+        # segment -> [first, last] record time for the segments they have read, loaded from
+        # ROLLUPS_FILE when first needed.
+        self._rollups = None
+        self._position = (1, 0)
+        self._segment_times = {}
+        self._unsaved = 0
+
+    def segment_path(self, number):
+        return os.path.join(self.path, f"segment-{number:06}.jsonl")
+
+    def segments(self):
+        """Return the numbers of the log's segments, in order."""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            return []
+        return sorted(
+            int(match.group(1)) for match in map(SEGMENT_NAME.match, names) if match
+        )
+
+    def append(self, record):
+        """Add a record to the end of the log, starting a new segment if the last one is full."""
+        line = (json.dumps(record, separators=(",", ":")) + "\n").encode("utf-8")
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            segments = self.segments()
+            number = segments[-1] if segments else 1
+            try:
+                size = os.path.getsize(self.segment_path(number))
+            except FileNotFoundError:
+                size = 0
+            if size and size + len(line) > self.segment_bytes:
+                number += 1
+            # A single write to a file opened for appending, so records are never interleaved.
+            fd = os.open(
+                self.segment_path(number), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def _read(self, position, segments=None):
+        """Yield (segment, offset after the record, record) for every whole record from a
+        (segment, offset) position on, or only in the given segments."""
+        first, offset = position
+        for number in self.segments() if segments is None else segments:
+            if number < first:
+                continue
+            start = offset if number == first else 0
+            try:
+                f = open(self.segment_path(number), "rb")
+            except FileNotFoundError:
+                continue
+            with f:
+                f.seek(start)
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A record still being written.
+                        return
+                    start += len(line)
+                    yield number, start, json.loads(line)
+
+    def _load_rollups(self):
+        try:
+            with open(os.path.join(self.path, ROLLUPS_FILE)) as f:
+                saved = json.load(f)
+        except FileNotFoundError:
+            saved = {
+                "position": [1, 0],
+                "segment_times": {},
+                "rollups": {
+                    "sessions": {},
+                    "exercise_sessions": {},
+                    "weekly_body_part_minutes": {},
+                },
+            }
+        self._rollups = saved["rollups"]
+        self._position = tuple(saved["position"])
+        self._segment_times = {
+            int(number): times for number, times in saved["segment_times"].items()
+        }
+
+    def _save_rollups(self):
+        """Save the rollups, replacing the file in one step so it is never half written."""
+        file_path = os.path.join(self.path, ROLLUPS_FILE)
+        temp_path = f"{file_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(
+                {
+                    "position": list(self._position),
+                    "segment_times": self._segment_times,
+                    "rollups": self._rollups,
+                },
+                f,
+            )
+        os.replace(temp_path, file_path)
+        self._unsaved = 0
+
+    def rollups(self):
+        """Return the rollups over every record in the log, after adding the records appended
+        since they were last brought up to date."""
+        with self._lock:
+            if self._rollups is None:
+                self._load_rollups()
+            for number, offset, record in self._read(self._position):
+                add_to_rollups(self._rollups, record)
+                times = self._segment_times.setdefault(
+                    number, [record["time"], record["time"]]
+                )
+                times[0] = min(times[0], record["time"])
+                times[1] = max(times[1], record["time"])
+                self._position = (number, offset)
+                self._unsaved += 1
+            if self._unsaved >= CHECKPOINT_RECORDS:
+                self._save_rollups()
+            return copy.deepcopy(self._rollups)
+
+    def records(self, since=None, until=None):
+        """Yield the records in the log in the order they were added, one at a time, only those
+        with a time from since up to until if they are given. Segments the rollups have read
+        are skipped if none of their records are in that time."""
+        with self._lock:
+            if self._rollups is None:
+                self._load_rollups()
+            segment_times = dict(self._segment_times)
+        segments = self.segments()
+        # The last segment can still be appended to, so it is always read.
+        segments = [
+            number
+            for number in segments
+            if number not in segment_times
+            or number == segments[-1]
+            or (
+                (since is None or segment_times[number][1] >= since)
+                and (until is None or segment_times[number][0] < until)
+            )
+        ]
+        for _, _, record in self._read((1, 0), segments):
+            if (since is None or record["time"] >= since) and (
+                until is None or record["time"] < until
+            ):
+                yield record
+
+
+def aggregate(records, pairs):
+    """Return key -> total over records, where pairs(record) gives the (key, amount) pairs a
+    record adds. Only the totals are kept, so records can be streamed from the log."""
+    totals = {}
+    for record in records:
+        for key, amount in pairs(record):
+            totals[key] = totals.get(key, 0) + amount
+    return totals
+
+
+def worked(record):
+    """Return the exercises of a record that were worked on."""
+    return [
+        exercise for exercise in record["exercises"] if exercise["work_seconds"] > 0
+    ]
+
+
+# Name -> pairs function of the queries the command line can run.
+QUERIES = {
+    "status": lambda record: [(record["status"], 1)],
+    "exercise_sessions": lambda record: [
+        (exercise["name"], 1) for exercise in worked(record)
+    ],
+    "exercise_minutes": lambda record: [
+        (exercise["name"], exercise["work_seconds"] / 60) for exercise in worked(record)
+    ],
+    "body_part_minutes": lambda record: [
+        (body_part, exercise["work_seconds"] / 60)
+        for exercise in worked(record)
+        for body_part in exercise["body_part"]
+    ],
+    "weekly_minutes": lambda record: [(week(record["time"]), record["elapsed"] / 60)],
+    "hour": lambda record: [(time.localtime(record["time"]).tm_hour, 1)],
+    "pauses": lambda record: [(record["pauses"], 1)],
+}
+
+# The log the app and the API server record sessions in.
+log = HistoryLog()
+
+
+def record(exercises, timer, status=None, bank=None):
+    """Append a session to the history log. See session_record."""
+    log.append(session_record(exercises, timer, status, bank))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the workout history log.")
+    parser.add_argument("--path", default=HISTORY_PATH)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rollups", help="Show the rollups, bringing them up to date.")
+    query_parser = commands.add_parser("query", help="Total a query over the log.")
+    query_parser.add_argument("query", choices=sorted(QUERIES))
+    query_parser.add_argument("--since", help="Earliest date, like 2026-10-01.")
+    query_parser.add_argument("--until", help="Date to stop before.")
+    args = parser.parse_args()
+
+    history = HistoryLog(args.path)
+    if args.command == "rollups":
+        print(json.dumps(history.rollups(), indent=4))
+    else:
+        since, until = (
+            (
+                datetime.datetime.fromisoformat(date).timestamp()
+                if date is not None
+                else None
+            )
+            for date in (args.since, args.until)
+        )
+        totals = aggregate(history.records(since, until), QUERIES[args.query])
+        for key, total in sorted(totals.items(), key=lambda item: -item[1]):
+            print(f"{key}\t{round(total, 1)}")
@@ -0,0 +1,108 @@
+"""Exercise image thumbnails, pre-sized for display and named by content hash."""
+
+import argparse
+import concurrent.futures
+import functools
+import hashlib
+import io
+import os
+import threading
+
+from PIL import Image
+
+from utils.exercise_bank import load_exercise_bank
+from utils.file_operations import ensure_save_dir
+
+THUMBNAIL_WIDTH = 300
+THUMBNAILS_PATH = "exercises/thumbnails/"
+
+# Thumbnails are rendered and read ahead of time on these threads.
+_prefetcher = concurrent.futures.ThreadPoolExecutor(max_workers=2)
+
+
+def is_image(link):
+    """Return whether an exercise link points to an image in the exercise images directory."""
+    return bool(link) and link.endswith(("jpg", "png"))
+
+
+def render_thumbnail(data, thumbnail_path):
+    """Resize an image to the display width and save it as a JPEG."""
+    image = Image.open(io.BytesIO(data))
+    # Flatten any transparency onto a white background, since JPEGs can't hold it.
+    if image.mode in ("RGBA", "LA", "P"):
+        image = image.convert("RGBA")
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image, mask=image.getchannel("A"))
+        image = background
+    image = image.convert("RGB")
+    if image.width > THUMBNAIL_WIDTH:
+        height = round(image.height * THUMBNAIL_WIDTH / image.width)
+        image = image.resize((THUMBNAIL_WIDTH, height), Image.LANCZOS)
+
+    # Write to a temporary file first so other sessions never read a half-written thumbnail.
+    ensure_save_dir(os.path.dirname(thumbnail_path))
+    temp_path = f"{thumbnail_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    image.save(temp_path, "JPEG", quality=85, optimize=True)
+    os.replace(temp_path, thumbnail_path)
+
+
+@functools.lru_cache(maxsize=1024)
+def _thumbnail_path(link, mtime, size):
+    """Return the thumbnail of a version of an image, rendering it if it doesn't exist yet."""
+    with open(link, "rb") as f:
+        data = f.read()
+    digest = hashlib.sha256(data + f"@{THUMBNAIL_WIDTH}".encode()).hexdigest()[:20]
+    thumbnail_path = os.path.join(THUMBNAILS_PATH, f"{digest}.jpg")
+    if not os.path.exists(thumbnail_path):
+        render_thumbnail(data, thumbnail_path)
+    return thumbnail_path
+
+
+def thumbnail_path(link):
+    """Return the path of the thumbnail for an exercise image."""
+    stat = os.stat(link)
+    return _thumbnail_path(link, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=256)
+def _read_thumbnail(thumbnail_path):
+    """Read a thumbnail. They are named by content, so a path always holds the same bytes."""
+    with open(thumbnail_path, "rb") as f:
+        return f.read()
+
+
+def read_thumbnail(thumbnail_path):
+    """Return the bytes of a thumbnail file, from memory if it was read recently."""
+    return _read_thumbnail(thumbnail_path)
+
+
+def thumbnail_bytes(link):
+    """Return the thumbnail for an exercise image, from memory if it was used recently."""
+    return _read_thumbnail(thumbnail_path(link))
+
+
+def prefetch(link):
+    """Start loading the thumbnail for an exercise image in the background."""
+    if is_image(link):
+        _prefetcher.submit(thumbnail_bytes, link)
+
+
+def prerender(exercise_bank_files):
+    """Render the thumbnails for every image in the given exercise banks."""
+    links = set()
+    for exercise_bank_file in exercise_bank_files:
+        links.update(filter(is_image, load_exercise_bank(exercise_bank_file).links))
+    for link in sorted(links):
+        print(f"{link} -> {thumbnail_path(link)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Pre-render the exercise image thumbnails."
+    )
+    parser.add_argument(
+        "exercise_bank_files",
+        nargs="*",
+        default=["exercise_bank.json"],
+    )
+    prerender(parser.parse_args().exercise_bank_files)
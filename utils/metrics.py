@@ -0,0 +1,323 @@
+"""Per-rerun timings and counters for the app, exported as Prometheus text or JSON lines.
+
+Metrics are off unless WORKOUT_METRICS is set:
+
+- "prometheus" serves totals over every session at http://localhost:WORKOUT_METRICS_PORT/metrics.
+- "jsonl" appends a line for every rerun to WORKOUT_METRICS_FILE, rotated once it reaches
+  WORKOUT_METRICS_MAX_BYTES.
+
+While metrics are off, the decorators return the functions unchanged and everything else returns
+straight away, so instrumented code runs as if it wasn't.
+"""
+
+import contextlib
+import functools
+import http.server
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+
+MODE = os.environ.get("WORKOUT_METRICS", "")
+PORT = int(os.environ.get("WORKOUT_METRICS_PORT", 9464))
+FILE_PATH = os.environ.get("WORKOUT_METRICS_FILE", "saved_data/metrics.jsonl")
+MAX_BYTES = int(os.environ.get("WORKOUT_METRICS_MAX_BYTES", 10 * 1024 * 1024))
+# Number of rotated metrics files kept, as FILE_PATH.1 (newest) to FILE_PATH.BACKUPS.
+BACKUPS = 3
+# Sessions that haven't rerun for this many seconds are dropped from the session state sizes.
+SESSION_TTL = 3600
+
+enabled = MODE in ("prometheus", "jsonl")
+
+_NO_SECTION = contextlib.nullcontext()
+
+
+class _Rerun:
+    """Timings and counters of a single rerun of the app or of one of its fragments."""
+
+    def __init__(self, screen, session_state, fragment):
+        self.screen = screen
+        self.session_state = session_state
+        self.fragment = fragment
+        self.start = time.perf_counter()
+        self.sections = {}
+        self.counters = {}
+
+
+class _Section:
+    """Adds the time spent in a with block to a section of the current rerun."""
+
+    __slots__ = ("name", "start")
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        elapsed = time.perf_counter() - self.start
+        rerun = getattr(_local, "rerun", None)
+        if rerun is not None:
+            rerun.sections[self.name] = rerun.sections.get(self.name, 0) + elapsed
+        _totals.add_section(self.name, elapsed)
+
+
+class _Totals:
+    """Totals over every session since the app started, for the Prometheus endpoint."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        # Section -> [seconds, count].
+        self.sections = {}
+        # (counter, screen) -> count.
+        self.counters = {}
+        # Screen -> [seconds, count] of whole reruns.
+        self.reruns = {}
+        # Session id -> (approximate session state size in bytes, time of its last rerun).
+        self.session_state_bytes = {}
+
+    def add_section(self, name, elapsed):
+        with self.lock:
+            total = self.sections.setdefault(name, [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+
+    def add_rerun(self, rerun, elapsed, session_id, session_state_bytes):
+        with self.lock:
+            total = self.reruns.setdefault(rerun.screen, [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+            for name, value in rerun.counters.items():
+                key = (name, rerun.screen)
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.session_state_bytes[session_id] = (session_state_bytes, time.time())
+
+    def prometheus_text(self):
+        """Return the totals in the Prometheus text exposition format."""
+        with self.lock:
+            now = time.time()
+            for session_id, (_, seen) in list(self.session_state_bytes.items()):
+                if now - seen > SESSION_TTL:
+                    del self.session_state_bytes[session_id]
+            lines = [
+                "# HELP workout_section_seconds Time spent in each section of the app.",
+                "# TYPE workout_section_seconds summary",
+            ]
+            for name, (seconds, count) in sorted(self.sections.items()):
+                lines.append(
+                    f'workout_section_seconds_sum{{section="{name}"}} {seconds}'
+                )
+                lines.append(
+                    f'workout_section_seconds_count{{section="{name}"}} {count}'
+                )
+            lines += [
+                "# HELP workout_rerun_seconds Time spent in reruns of each screen.",
+                "# TYPE workout_rerun_seconds summary",
+            ]
+            for screen, (seconds, count) in sorted(self.reruns.items()):
+                lines.append(
+                    f'workout_rerun_seconds_sum{{screen="{screen}"}} {seconds}'
+                )
+                lines.append(
+                    f'workout_rerun_seconds_count{{screen="{screen}"}} {count}'
+                )
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f"# TYPE workout_{name}_total counter")
+                for (counter, screen), value in sorted(self.counters.items()):
+                    if counter == name:
+                        lines.append(
+                            f'workout_{name}_total{{screen="{screen}"}} {value}'
+                        )
+            lines += [
+                "# HELP workout_session_state_bytes Approximate session state size.",
+                "# TYPE workout_session_state_bytes gauge",
+            ]
+            for session_id, (size, _) in sorted(self.session_state_bytes.items()):
+                lines.append(
+                    f'workout_session_state_bytes{{session="{session_id}"}} {size}'
+                )
+            return "\n".join(lines) + "\n"
+
+
+_local = threading.local()
+_totals = _Totals()
+_file_lock = threading.Lock()
+
+
+def section(name):
+    """Return a context manager that times a section of the current rerun."""
+    if not enabled:
+        return _NO_SECTION
+    return _Section(name)
+
+
+def timed(name):
+    """Decorator that times every call of a function as a section."""
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with _Section(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def count(name, value=1):
+    """Add to a counter of the current rerun."""
+    if not enabled:
+        return
+    rerun = getattr(_local, "rerun", None)
+    if rerun is not None:
+        rerun.counters[name] = rerun.counters.get(name, 0) + value
+
+
+def start_rerun(screen, session_state):
+    """Start recording a rerun of the whole app, showing the given screen."""
+    if not enabled:
+        return
+    # A rerun that stopped early, like one that called st.rerun(), is recorded up to that point.
+    finish_rerun()
+    _local.rerun = _Rerun(screen, session_state, None)
+
+
+def finish_rerun():
+    """Finish recording the current rerun and export it."""
+    if not enabled:
+        return
+    rerun = getattr(_local, "rerun", None)
+    if rerun is None:
+        return
+    _local.rerun = None
+    elapsed = time.perf_counter() - rerun.start
+    rerun.counters["reruns"] = rerun.counters.get("reruns", 0) + 1
+    session_id = rerun.session_state.setdefault("metrics_session_id", uuid.uuid4().hex)
+    session_state_bytes = sum(session_memory(rerun.session_state).values())
+    _totals.add_rerun(rerun, elapsed, session_id, session_state_bytes)
+    if MODE == "jsonl":
+        _write_line(
+            {
+                "time": time.time(),
+                "session": session_id,
+                "screen": rerun.screen,
+                "fragment": rerun.fragment,
+                "seconds": elapsed,
+                "sections": rerun.sections,
+                "counters": rerun.counters,
+                "session_state_bytes": session_state_bytes,
+            }
+        )
+
+
+def fragment(screen, session_state):
+    """Decorator for fragments, so a rerun of just the fragment is recorded as a rerun of its
+    screen. When the fragment runs as part of a rerun of the whole app, it is timed as a section
+    of that rerun instead."""
+
+    def decorator(function):
+        if not enabled:
+            return function
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if getattr(_local, "rerun", None) is not None:
+                try:
+                    with _Section(function.__name__):
+                        return function(*args, **kwargs)
+                except BaseException:
+                    # Streamlit stops the whole run with an exception, e.g. on st.rerun().
+                    finish_rerun()
+                    raise
+            _local.rerun = _Rerun(screen, session_state, function.__name__)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                finish_rerun()
+
+        return wrapper
+
+    return decorator
+
+
+def approximate_size(value, seen=None):
+    """Return the approximate number of bytes held by a value and everything it refers to.
+
+    Objects that define __sizeof__ report their own size, which is how objects that refer to
+    memory shared between sessions leave it out.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, dict):
+        size += sum(
+            approximate_size(k, seen) + approximate_size(v, seen)
+            for k, v in value.items()
+        )
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(approximate_size(item, seen) for item in value)
+    elif hasattr(value, "__dict__") and type(value).__sizeof__ is object.__sizeof__:
+        size += approximate_size(vars(value), seen)
+    return size
+
+
+def session_memory(session_state):
+    """Return the approximate number of bytes held by each value in a session's state, largest
+    first. Memory shared with other sessions, like the exercise banks, isn't counted."""
+    seen = set()
+    sizes = {key: approximate_size(value, seen) for key, value in session_state.items()}
+    return dict(sorted(sizes.items(), key=lambda item: item[1], reverse=True))
+
+
+def _write_line(record):
+    """Append a record to the metrics file, rotating the file when it gets too big."""
+    line = json.dumps(record) + "\n"
+    with _file_lock:
+        directory = os.path.dirname(FILE_PATH)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        try:
+            full = os.path.getsize(FILE_PATH) + len(line) > MAX_BYTES
+        except FileNotFoundError:
+            full = False
+        if full:
+            for backup in range(BACKUPS - 1, 0, -1):
+                if os.path.exists(f"{FILE_PATH}.{backup}"):
+                    os.replace(f"{FILE_PATH}.{backup}", f"{FILE_PATH}.{backup + 1}")
+            os.replace(FILE_PATH, f"{FILE_PATH}.1")
+        with open(FILE_PATH, "a") as f:
+            f.write(line)
+
+
+class _MetricsHandler(http.server.BaseHTTPRequestHandler):
+    """Serves the totals at /metrics."""
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+        body = _totals.prometheus_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if MODE == "prometheus":
+    # Streamlit imports this module once per process, so there is only ever one server.
+    _server = http.server.ThreadingHTTPServer(("127.0.0.1", PORT), _MetricsHandler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
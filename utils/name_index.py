@@ -0,0 +1,309 @@
+"""Prefix and fuzzy search over the exercise names in a bank, for completing manual entries."""
+
+import bisect
+import copy
+import math
+import re
+import threading
+import weakref
+
+import numpy as np
+
+from utils.exercise_bank import reload_hooks
+
+# Fuzzy matches need at least this share of trigrams in common with the query (Dice
+# coefficient) to be suggested, and this much to stand in for a manual entry.
+MIN_SUGGEST_SCORE = 0.3
+MIN_RESOLVE_SCORE = 0.7
+# A fuzzy match only stands in for a manual entry if it scores this much more than the next best
+# name, so an entry close to several names, like "push", is left to the user to pick from.
+MIN_RESOLVE_GAP = 0.15
+# Fuzzy matching counts the names containing each of the query's trigrams, rarest first, up to
+# this many ids. If that leaves trigrams out, the best limit * SHORTLIST_FACTOR (at least
+# MIN_SHORTLIST) of the names found are scored exactly.
+MAX_POSTINGS = 100000
+SHORTLIST_FACTOR = 4
+MIN_SHORTLIST = 20
+# Names added to or removed from a bank after its index was built are updated in place of
+# building the index again, until this share of the indexed names has changed.
+REBUILD_SHARE = 0.1
+
+# Bank -> NameIndex of the bank's exercise names.
+_name_indexes = weakref.WeakKeyDictionary()
+_name_indexes_lock = threading.Lock()
+
+
+def normalize(name):
+    """Return a name in lowercase with anything but letters and digits turned into single
+    spaces, so "Step-Up" and "step up" match."""
+    return " ".join(re.split(r"[\W_]+", name.lower())).strip()
+
+
+def trigrams(normalized):
+    """Return the distinct three-character substrings of a normalized name, padded so the start
+    and end of the name count too."""
+    padded = f"  {normalized} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+class NameIndex:
+    """Index of exercise names, by normalized name, by the start of the name and of each of its
+    words, and by trigram for fuzzy matches."""
+
+    def __init__(self, names, retired=()):
+        self.names = names
+        self.normalized = normalized = [normalize(name) for name in names]
+        # Ids of the exercises to index, leaving out retired ones.
+        retired = set(retired)
+        live = [i for i in range(len(names)) if i not in retired]
+        # Normalized name -> id, for exact matches.
+        self.exact = {}
+        for exercise_id in live:
+            self.exact.setdefault(normalized[exercise_id], exercise_id)
+        # Sorted (normalized name, id) and (word, id), for prefix matches by bisection.
+        self.sorted_names = sorted((normalized[i], i) for i in live)
+        self.sorted_words = sorted(
+            {
+                (word, exercise_id)
+                for exercise_id in live
+                for word in normalized[exercise_id].split(" ")[1:]
+            }
+        )
+
+        # Trigram -> ids of the names containing it, all kept in one array.
+        postings = {}
+        self.trigram_counts = np.zeros(len(names), dtype=np.int32)
+        for exercise_id in live:
+            grams = trigrams(normalized[exercise_id])
+            self.trigram_counts[exercise_id] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(exercise_id)
+        self.postings = {}
+        ids = []
+        for gram, gram_ids in postings.items():
+            self.postings[gram] = (len(ids), len(ids) + len(gram_ids))
+            ids += gram_ids
+        self.posting_ids = np.array(ids, dtype=np.int32)
+        # The trigram counts of the names in posting_ids. Names removed since have a count of 0
+        # in trigram_counts, and names added since have their trigrams in added_postings.
+        self.indexed_counts = self.trigram_counts
+        self.added_postings = {}
+        self.changes = 0
+
+    def updated(self, names, added, removed):
+        """Return an index of a newer snapshot of the names, with the ids of the exercises added
+        and removed since. Only those names are indexed, and the new index shares everything
+        else with this one, which is left as it is. Once too many names have changed, the index
+        is built again."""
+        changes = self.changes + len(added) + len(removed)
+        if changes > REBUILD_SHARE * len(self.sorted_names):
+            live = {exercise_id for _, exercise_id in self.sorted_names}
+            live = live.difference(removed).union(added)
+            return NameIndex(names, set(range(len(names))) - live)
+        index = copy.copy(self)
+        index.changes = changes
+        index.names = names
+        index.normalized = self.normalized + [
+            normalize(name) for name in names[len(self.normalized) :]
+        ]
+        index.exact = dict(self.exact)
+        index.sorted_names = list(self.sorted_names)
+        index.sorted_words = list(self.sorted_words)
+        index.trigram_counts = np.zeros(len(names), dtype=np.int32)
+        index.trigram_counts[: len(self.trigram_counts)] = self.trigram_counts
+        index.added_postings = dict(self.added_postings)
+        for exercise_id in removed:
+            index._remove(exercise_id)
+        for exercise_id in added:
+            index._add(exercise_id)
+        return index
+
+    def _remove(self, exercise_id):
+        normalized = self.normalized[exercise_id]
+        for sorted_list, key in self._sorted_keys(exercise_id):
+            position = bisect.bisect_left(sorted_list, key)
+            if position < len(sorted_list) and sorted_list[position] == key:
+                del sorted_list[position]
+        if self.exact.get(normalized) == exercise_id:
+            # Another exercise with the same normalized name, the one with the lowest id, takes
+            # its place.
+            del self.exact[normalized]
+            position = bisect.bisect_left(self.sorted_names, (normalized,))
+            if (
+                position < len(self.sorted_names)
+                and self.sorted_names[position][0] == normalized
+            ):
+                self.exact[normalized] = self.sorted_names[position][1]
+        self.trigram_counts[exercise_id] = 0
+        for gram in trigrams(normalized):
+            gram_ids = self.added_postings.get(gram)
+            if gram_ids and exercise_id in gram_ids:
+                self.added_postings[gram] = [i for i in gram_ids if i != exercise_id]
+
+    def _add(self, exercise_id):
+        normalized = self.normalized[exercise_id]
+        for sorted_list, key in self._sorted_keys(exercise_id):
+            bisect.insort(sorted_list, key)
+        if self.exact.get(normalized, exercise_id) >= exercise_id:
+            self.exact[normalized] = exercise_id
+        grams = trigrams(normalized)
+        self.trigram_counts[exercise_id] = len(grams)
+        if exercise_id < len(self.indexed_counts) and self.indexed_counts[exercise_id]:
+            # A name removed and added again is still in posting_ids.
+            return
+        for gram in grams:
+            self.added_postings[gram] = self.added_postings.get(gram, []) + [
+                exercise_id
+            ]
+
+    def _sorted_keys(self, exercise_id):
+        """Return the (sorted list, key) pairs an exercise is in the sorted lists under."""
+        words = self.normalized[exercise_id].split(" ")
+        return [(self.sorted_names, (self.normalized[exercise_id], exercise_id))] + [
+            (self.sorted_words, (word, exercise_id)) for word in sorted(set(words[1:]))
+        ]
+
+    def posting(self, gram):
+        """Return the ids of the names containing a trigram, which may include removed ones."""
+        ids = self.posting_ids[slice(*self.postings.get(gram, (0, 0)))]
+        added = self.added_postings.get(gram)
+        if added:
+            ids = np.concatenate([ids, np.array(added, dtype=np.int32)])
+        return ids
+
+    def complete(self, query, limit=10):
+        """Return up to limit names matching a query: an exact match, then names starting with
+        it, then names with a word starting with it, then the closest fuzzy matches."""
+        query = normalize(query)
+        if not query:
+            return []
+        matches = []
+        seen = set()
+
+        def add(exercise_ids):
+            for exercise_id in exercise_ids:
+                if len(matches) == limit:
+                    return
+                if exercise_id not in seen:
+                    seen.add(exercise_id)
+                    matches.append(exercise_id)
+
+        if query in self.exact:
+            add([self.exact[query]])
+        for sorted_list in (self.sorted_names, self.sorted_words):
+            start = bisect.bisect_left(sorted_list, (query,))
+            add(
+                exercise_id
+                for prefix, exercise_id in sorted_list[start : start + limit]
+                if prefix.startswith(query)
+            )
+        if len(matches) < limit:
+            add(
+                exercise_id
+                for exercise_id, _ in self.fuzzy(query, limit)
+                if exercise_id not in seen
+            )
+        return [self.names[exercise_id] for exercise_id in matches]
+
+    def resolve(self, query):
+        """Return the name a manual entry most likely means, or None if nothing is close enough
+        or several names are about as close: a match ignoring case and punctuation, or else a
+        close fuzzy match that is clearly closer than any other."""
+        query = normalize(query)
+        if not query:
+            return None
+        if query in self.exact:
+            return self.names[self.exact[query]]
+        matches = self.fuzzy(query, 2)
+        if not matches or matches[0][1] < MIN_RESOLVE_SCORE:
+            return None
+        if len(matches) > 1 and matches[0][1] - matches[1][1] < MIN_RESOLVE_GAP:
+            return None
+        return self.names[matches[0][0]]
+
+    def fuzzy(self, query, limit, min_score=MIN_SUGGEST_SCORE):
+        """Return up to limit (id, score) pairs of the names sharing the most trigrams with a
+        normalized query, best first, scoring at least min_score."""
+        grams = trigrams(query)
+        postings = sorted(
+            (ids for ids in map(self.posting, grams) if len(ids)),
+            key=len,
+        )
+        if not postings:
+            return []
+
+        # Count the names containing each of the rarest trigrams, up to MAX_POSTINGS ids, and
+        # assume for now that every name also has the more common ones.
+        used = 0
+        total = 0
+        for ids in postings:
+            if used and total + len(ids) > MAX_POSTINGS:
+                break
+            used += 1
+            total += len(ids)
+        assumed = len(postings) - used
+        common = np.bincount(
+            np.concatenate(postings[:used]), minlength=len(self.trigram_counts)
+        )
+        # A name needs to share at least this many trigrams to score min_score, and can't have
+        # too many or too few of its own.
+        needed = len(grams) * min_score / (2 - min_score)
+        candidates = np.flatnonzero(common >= max(1, math.ceil(needed - assumed)))
+        counts = self.trigram_counts[candidates]
+        keep = (counts >= needed) & (counts <= len(grams) * (2 - min_score) / min_score)
+        candidates, counts = candidates[keep], counts[keep]
+        scores = 2 * (common[candidates] + assumed) / (len(grams) + counts)
+        shortlist = max(limit * SHORTLIST_FACTOR, MIN_SHORTLIST)
+        if len(candidates) > shortlist:
+            best = np.argpartition(-scores, shortlist)[:shortlist]
+            candidates, scores = candidates[best], scores[best]
+
+        if assumed:
+            # Score the best of those exactly.
+            scores = [
+                2
+                * len(grams & trigrams(self.normalized[exercise_id]))
+                / (len(grams) + int(self.trigram_counts[exercise_id]))
+                for exercise_id in candidates.tolist()
+            ]
+        matches = [
+            (exercise_id, float(score))
+            for exercise_id, score in zip(candidates.tolist(), scores)
+            if score >= min_score
+        ]
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return matches[:limit]
+
+
+def name_index(bank):
+    """Return the name index of a bank, building it the first time it is needed. Indexes are
+    shared by every selector for the bank."""
+    with _name_indexes_lock:
+        index = _name_indexes.get(bank)
+        if index is None:
+            index = _name_indexes[bank] = NameIndex(bank.names, bank.retired.values())
+        return index
+
+
+def _carry_name_index(old, new, diff):
+    """Reload hook giving a new snapshot of a bank the old snapshot's name index, updated with
+    the names added and removed before the snapshot is swapped in."""
+    with _name_indexes_lock:
+        index = _name_indexes.get(old)
+    if index is None:
+        return
+    if diff is None or new.lineage is not old.lineage:
+        # The exercise ids aren't the old snapshot's, so index the names from scratch.
+        index = NameIndex(new.names, new.retired.values())
+    elif diff.added or diff.removed:
+        index = index.updated(
+            new.names,
+            [new.ids[name] for name in diff.added],
+            [old.ids[name] for name in diff.removed],
+        )
+    # If only facets, links or weights changed, the names are the same.
+    with _name_indexes_lock:
+        _name_indexes.setdefault(new, index)
+
+
+reload_hooks.append(_carry_name_index)
@@ -0,0 +1,288 @@
+"""Storage backends for saved workouts and timer configs."""
+
+import argparse
+import bisect
+import heapq
+import json
+import os
+import sqlite3
+import threading
+import time
+
+WORKOUTS = "workouts"
+TIMERS = "timers"
+
+# Number of saved items shown per page of search results.
+PAGE_SIZE = 20
+# Nanoseconds a directory mtime can stay the same for after something in it changes. Some
+# filesystems only keep mtimes to the second or two, so a directory scanned this soon after its
+# mtime can change again without its mtime changing.
+MTIME_TICK_NS = 2_000_000_000
+
+
+def summarize(kind, data):
+    """Return (exercise count, duration) for a saved item. Workouts have an exercise count and
+    timer configs a duration, which is the seconds each exercise takes over all rounds.
+    """
+    if kind == WORKOUTS:
+        return len(data), None
+    try:
+        return None, data["rounds"] * (data["work_duration"] + data["rest_duration"])
+    except (KeyError, TypeError):
+        return None, None
+
+
+def search_entries(entries, names, query, offset, limit):
+    """Return a page of the entries whose names contain the query, names starting with the query
+    first, and the total number of matches. names are the entries' lowercase names, in order.
+    """
+    query = query.lower()
+    if not query:
+        return entries[offset : offset + limit], len(entries)
+    # Names starting with the query are next to each other, so find them by bisection.
+    start = bisect.bisect_left(names, query)
+    end = bisect.bisect_left(names, query + "\uffff", start)
+    matches = entries[start:end] + [
+        entry
+        for i, entry in enumerate(entries)
+        if (i < start or i >= end) and query in names[i]
+    ]
+    return matches[offset : offset + limit], len(matches)
+
+
+class JsonFileStorage:
+    """Stores each saved item as its own JSON file, with one directory per kind of item."""
+
+    def __init__(self, paths):
+        # Kind of item -> directory it is saved in.
+        self.paths = paths
+        # Kind of item -> (directory mtime, time of the scan, entries sorted by lowercase name,
+        # lowercase names), so listing only scans a directory after something in it was added,
+        # replaced or removed.
+        self._indexes = {}
+        self._indexes_lock = threading.Lock()
+
+    def save(self, kind, name, data):
+        """Save an item, replacing any existing item with the same name."""
+        directory = self.paths[kind]
+        os.makedirs(directory, exist_ok=True)
+        # Write to a temporary file first so a reader never sees a half-written file.
+        path = os.path.join(directory, name)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(data, f, indent=4)
+        os.replace(temp_path, path)
+
+    def load(self, kind, name):
+        """Return a saved item, or None if there is no item with that name."""
+        path = os.path.join(self.paths[kind], name)
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            return json.load(f)
+
+    def list(self, kind):
+        """Return the names of the saved items of a kind."""
+        return [entry["name"] for entry in self._index(kind)[0]]
+
+    def recent(self, kind, limit):
+        """Return the names of the most recently saved items of a kind, most recent first."""
+        entries = heapq.nlargest(
+            limit, self._index(kind)[0], key=lambda entry: entry["modified"]
+        )
+        return [entry["name"] for entry in entries]
+
+    def search(self, kind, query="", offset=0, limit=PAGE_SIZE):
+        """Return a page of the saved items of a kind whose names contain the query, and the
+        total number of matches."""
+        entries, names = self._index(kind)
+        return search_entries(entries, names, query, offset, limit)
+
+    def _index(self, kind):
+        """Return an entry for each saved item of a kind sorted by lowercase name, and the
+        lowercase names."""
+        directory = self.paths[kind]
+        try:
+            directory_mtime = os.stat(directory).st_mtime_ns
+        except FileNotFoundError:
+            return [], []
+        with self._indexes_lock:
+            cached = self._indexes.get(kind)
+            # A scan in the same mtime tick as the last change can have missed a later change in
+            # that tick, so the directory is scanned again until a scan is a tick after it.
+            if (
+                cached
+                and cached[0] == directory_mtime
+                and cached[1] - directory_mtime >= MTIME_TICK_NS
+            ):
+                return cached[2:]
+
+            # Only items that changed since the last scan have to be read again.
+            previous = {entry["name"]: entry for entry in cached[2]} if cached else {}
+            scanned = time.time_ns()
+            entries = []
+            with os.scandir(directory) as files:
+                for file in files:
+                    if file.name.endswith(".tmp") or not file.is_file():
+                        continue
+                    stat = file.stat()
+                    entry = previous.get(file.name)
+                    if not entry or (entry["size"], entry["modified"]) != (
+                        stat.st_size,
+                        stat.st_mtime,
+                    ):
+                        try:
+                            exercise_count, duration = summarize(
+                                kind, self.load(kind, file.name)
+                            )
+                        except ValueError:
+                            exercise_count, duration = None, None
+                        entry = {
+                            "name": file.name,
+                            "size": stat.st_size,
+                            "modified": stat.st_mtime,
+                            "exercise_count": exercise_count,
+                            "duration": duration,
+                        }
+                    entries.append(entry)
+            entries.sort(key=lambda entry: entry["name"].lower())
+            names = [entry["name"].lower() for entry in entries]
+            self._indexes[kind] = (directory_mtime, scanned, entries, names)
+            return entries, names
+
+
+class SqliteStorage:
+    """Stores saved items in a SQLite database, which sessions can read and write concurrently.
+
+    The database runs in WAL mode so readers don't block the writer, and every thread uses its
+    own connection.
+    """
+
+    def __init__(self, database_path):
+        self.database_path = database_path
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS saved_items ("
+                " kind TEXT NOT NULL,"
+                " name TEXT NOT NULL,"
+                " data TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " modified REAL NOT NULL,"
+                " exercise_count INTEGER,"
+                " duration INTEGER,"
+                " PRIMARY KEY (kind, name))"
+            )
+            # Databases created before items were summarized need the summary columns added.
+            columns = {
+                row[1] for row in connection.execute("PRAGMA table_info(saved_items)")
+            }
+            for column in ("exercise_count", "duration"):
+                if column not in columns:
+                    connection.execute(
+                        f"ALTER TABLE saved_items ADD COLUMN {column} INTEGER"
+                    )
+
+    def _connection(self):
+        """Return this thread's connection to the database."""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            directory = os.path.dirname(self.database_path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Statements are written with placeholders, so sqlite3's statement cache reuses the
+            # prepared statements.
+            connection = sqlite3.connect(self.database_path, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def save(self, kind, name, data):
+        """Save an item, replacing any existing item with the same name."""
+        self.save_many(kind, [(name, data)])
+
+    def save_many(self, kind, items):
+        """Save (name, data) pairs in a single transaction."""
+        rows = []
+        for name, data in items:
+            text = json.dumps(data, indent=4)
+            rows.append(
+                (kind, name, text, len(text), time.time(), *summarize(kind, data))
+            )
+        with self._connection() as connection:
+            connection.executemany(
+                "INSERT INTO saved_items"
+                " (kind, name, data, size, modified, exercise_count, duration)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (kind, name) DO UPDATE SET"
+                " data = excluded.data, size = excluded.size, modified = excluded.modified,"
+                " exercise_count = excluded.exercise_count, duration = excluded.duration",
+                rows,
+            )
+
+    def load(self, kind, name):
+        """Return a saved item, or None if there is no item with that name."""
+        row = (
+            self._connection()
+            .execute(
+                "SELECT data FROM saved_items WHERE kind = ? AND name = ?", (kind, name)
+            )
+            .fetchone()
+        )
+        return json.loads(row[0]) if row else None
+
+    def list(self, kind):
+        """Return the names of the saved items of a kind."""
+        rows = self._connection().execute(
+            "SELECT name FROM saved_items WHERE kind = ? ORDER BY name", (kind,)
+        )
+        return [name for (name,) in rows]
+
+    def recent(self, kind, limit):
+        """Return the names of the most recently saved items of a kind, most recent first."""
+        rows = self._connection().execute(
+            "SELECT name FROM saved_items WHERE kind = ? ORDER BY modified DESC LIMIT ?",
+            (kind, limit),
+        )
+        return [name for (name,) in rows]
+
+    def search(self, kind, query="", offset=0, limit=PAGE_SIZE):
+        """Return a page of the saved items of a kind whose names contain the query, and the
+        total number of matches."""
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        connection = self._connection()
+        (total,) = connection.execute(
+            "SELECT COUNT(*) FROM saved_items"
+            " WHERE kind = ? AND name LIKE ? ESCAPE '\\'",
+            (kind, f"%{pattern}%"),
+        ).fetchone()
+        rows = connection.execute(
+            "SELECT name, size, modified, exercise_count, duration FROM saved_items"
+            " WHERE kind = ? AND name LIKE ? ESCAPE '\\'"
+            " ORDER BY name NOT LIKE ? ESCAPE '\\', name COLLATE NOCASE"
+            " LIMIT ? OFFSET ?",
+            (kind, f"%{pattern}%", f"{pattern}%", limit, offset),
+        )
+        columns = ("name", "size", "modified", "exercise_count", "duration")
+        return [dict(zip(columns, row)) for row in rows], total
+
+    def import_from(self, storage):
+        """Copy every item from another storage backend, such as the existing JSON files."""
+        for kind in (WORKOUTS, TIMERS):
+            self.save_many(
+                kind, ((name, storage.load(kind, name)) for name in storage.list(kind))
+            )
+
+
+if __name__ == "__main__":
+    import utils.file_operations as file_ops
+
+    parser = argparse.ArgumentParser(
+        description="Import the saved workouts and timer configs into a SQLite database."
+    )
+    parser.add_argument(
+        "database_path", nargs="?", default=file_ops.SAVED_DATABASE_PATH
+    )
+    args = parser.parse_args()
+    SqliteStorage(args.database_path).import_from(file_ops.JSON_STORAGE)
@@ -0,0 +1,276 @@
+"""Workout timer engine driven by a monotonic clock."""
+
+import bisect
+import collections
+import math
+import time
+
+WORK = "WORK"
+REST = "REST"
+
+# A point in the workout. round is 1-based, phase_elapsed/phase_duration describe the current phase
+# and progress is the fraction of the whole workout that has passed.
+TimerState = collections.namedtuple(
+    "TimerState",
+    [
+        "round",
+        "exercise_index",
+        "phase",
+        "remaining",
+        "phase_elapsed",
+        "phase_duration",
+        "elapsed",
+        "progress",
+        "done",
+    ],
+)
+
+# A station of a circuit at one point in time: the exercise it is on, its TimerState, and the
+# whole seconds until it starts, or 0 once it has started.
+StationState = collections.namedtuple(
+    "StationState", ["exercise_index", "timer", "starts_in"]
+)
+
+# (round, exercise index, phase, start in seconds from the start of the workout, duration)
+Phase = collections.namedtuple(
+    "Phase", ["round", "exercise_index", "phase", "start", "duration"]
+)
+
+
+def compile_schedule(num_exercises, rounds, work_duration, rest_duration):
+    """Return the phases of a workout in order. Every exercise is followed by a rest."""
+    phases = []
+    start = 0
+    for round in range(1, rounds + 1):
+        for exercise_index in range(num_exercises):
+            for phase, duration in ((WORK, work_duration), (REST, rest_duration)):
+                # Phases without any time, like a rest of 0 seconds, are skipped entirely.
+                if duration > 0:
+                    phases.append(Phase(round, exercise_index, phase, start, duration))
+                    start += duration
+    return phases
+
+
+class WorkoutTimer:
+    """Tracks where a workout is from the time that has passed instead of counting ticks, so
+    late or irregular UI updates don't make the workout run long."""
+
+    def __init__(
+        self, num_exercises, rounds, work_duration, rest_duration, clock=time.monotonic
+    ):
+        self.num_exercises = num_exercises
+        self.rounds = rounds
+        self.work_duration = work_duration
+        self.rest_duration = rest_duration
+        self.phases = compile_schedule(
+            num_exercises, rounds, work_duration, rest_duration
+        )
+        self.starts = [phase.start for phase in self.phases]
+        self.total_duration = (
+            self.phases[-1].start + self.phases[-1].duration if self.phases else 0
+        )
+        self.clock = clock
+        # Seconds counted before the timer was last (re)started, and the clock reading at that
+        # point, or None while the timer isn't running.
+        self._elapsed = 0
+        self._running_since = None
+        # Clock reading when the timer was first started, or None if it hasn't been, and the
+        # number of times it has been paused.
+        self.started = None
+        self.pauses = 0
+
+    @classmethod
+    def from_config(cls, num_exercises, timer_config, clock=time.monotonic):
+        """Create a timer from a saved timer configuration."""
+        return cls(
+            num_exercises,
+            timer_config["rounds"],
+            timer_config["work_duration"],
+            timer_config["rest_duration"],
+            clock=clock,
+        )
+
+    @property
+    def running(self):
+        return self._running_since is not None
+
+    @property
+    def paused(self):
+        return not self.running
+
+    def start(self):
+        """Start or resume the timer."""
+        if not self.running:
+            self._running_since = self.clock()
+            if self.started is None:
+                self.started = self._running_since
+
+    def pause(self):
+        """Pause the timer."""
+        if self.running:
+            self._elapsed = self.elapsed()
+            self._running_since = None
+            self.pauses += 1
+
+    resume = start
+
+    def seek(self, seconds):
+        """Jump to a number of seconds from the start of the workout."""
+        self._elapsed = min(max(seconds, 0), self.total_duration)
+        if self.running:
+            self._running_since = self.clock()
+
+    def elapsed(self):
+        """Return the number of seconds of the workout that have passed."""
+        elapsed = self._elapsed
+        if self.running:
+            elapsed += self.clock() - self._running_since
+        return min(elapsed, self.total_duration)
+
+    def wall_time(self):
+        """Return the seconds since the timer was first started, including pauses."""
+        return 0 if self.started is None else self.clock() - self.started
+
+    def work_seconds(self):
+        """Return the seconds of work done on each exercise so far."""
+        elapsed = self.elapsed()
+        seconds = [0] * self.num_exercises
+        for phase in self.phases:
+            if phase.start >= elapsed:
+                break
+            if phase.phase == WORK:
+                seconds[phase.exercise_index] += min(
+                    elapsed - phase.start, phase.duration
+                )
+        return seconds
+
+    def state(self):
+        """Return the current round, exercise, phase and remaining time."""
+        return self.state_at(self.elapsed())
+
+    def state_at(self, elapsed):
+        """Return the round, exercise, phase and remaining time a number of seconds from the start
+        of the workout."""
+        if elapsed >= self.total_duration:
+            last = self.phases[-1] if self.phases else Phase(0, 0, WORK, 0, 0)
+            return TimerState(
+                last.round,
+                last.exercise_index,
+                last.phase,
+                0,
+                last.duration,
+                last.duration,
+                self.total_duration,
+                1.0,
+                True,
+            )
+
+        phase = self.phases[bisect.bisect_right(self.starts, elapsed) - 1]
+        phase_elapsed = elapsed - phase.start
+        return TimerState(
+            phase.round,
+            phase.exercise_index,
+            phase.phase,
+            math.ceil(phase.duration - phase_elapsed),
+            phase_elapsed,
+            phase.duration,
+            elapsed,
+            elapsed / self.total_duration,
+            False,
+        )
+
+
+class CircuitTimer:
+    """Timers for the stations of a circuit, all read from one clock, so they stay in step and
+    can be paused together.
+
+    Every station runs the same workout, starting its offset in seconds after the circuit does.
+    Station s starts on exercise s and moves rotation exercises along after each one, so with
+    the default of 1 the stations work through the exercises in turn, and with 0 every station
+    keeps its exercise for people to move between.
+    """
+
+    def __init__(
+        self,
+        num_stations,
+        num_exercises,
+        rounds,
+        work_duration,
+        rest_duration,
+        offsets=None,
+        rotation=1,
+        clock=time.monotonic,
+    ):
+        if num_stations < 1 or num_exercises < 1:
+            raise ValueError("A circuit needs at least one station and one exercise.")
+        self.offsets = list(offsets) if offsets is not None else [0] * num_stations
+        if len(self.offsets) != num_stations:
+            raise ValueError("Give one offset per station.")
+        if any(offset < 0 for offset in self.offsets):
+            raise ValueError("Station offsets can't be negative.")
+        self.num_exercises = num_exercises
+        self.rotation = rotation
+        # The workout every station runs, each read at its own point in it.
+        self.workout = WorkoutTimer(num_exercises, rounds, work_duration, rest_duration)
+        # The circuit's clock: a single phase lasting until the station that starts last is done.
+        self.timer = WorkoutTimer(
+            1, 1, self.workout.total_duration + max(self.offsets, default=0), 0, clock
+        )
+        self.total_duration = self.timer.total_duration
+        # Whole seconds shown by a station tick over when the circuit's elapsed time has one of
+        # these fractional parts.
+        self._fractions = sorted({offset % 1 for offset in self.offsets})
+
+    @property
+    def running(self):
+        return self.timer.running
+
+    @property
+    def paused(self):
+        return self.timer.paused
+
+    @property
+    def done(self):
+        return self.timer.elapsed() >= self.total_duration
+
+    def start(self):
+        """Start or resume every station."""
+        self.timer.start()
+
+    def pause(self):
+        """Pause every station."""
+        self.timer.pause()
+
+    resume = start
+
+    def elapsed(self):
+        """Return the number of seconds since the circuit started."""
+        return self.timer.elapsed()
+
+    def states(self):
+        """Return the StationState of every station, from one reading of the clock."""
+        elapsed = self.timer.elapsed()
+        # Stations with the same offset are at the same point of the workout.
+        at_offset = {}
+        states = []
+        for station, offset in enumerate(self.offsets):
+            state = at_offset.get(offset)
+            if state is None:
+                state = at_offset[offset] = self.workout.state_at(
+                    max(elapsed - offset, 0)
+                )
+            states.append(
+                StationState(
+                    (station + state.exercise_index * self.rotation)
+                    % self.num_exercises,
+                    state,
+                    max(math.ceil(offset - elapsed), 0),
+                )
+            )
+        return states
+
+    def next_change(self):
+        """Return the seconds until the whole seconds shown by any station next change, for
+        phases that last whole seconds."""
+        elapsed = self.timer.elapsed()
+        return min((fraction - elapsed) % 1 or 1 for fraction in self._fractions)
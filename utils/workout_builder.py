@@ -0,0 +1,99 @@
+"""Fills the exercise slots of a workout, for the app and for headless generation."""
+
+from utils.exercise_selector import ExerciseIdSet
+from utils.workout_cache import cache_key, workout_cache
+
+EXERCISE_BANK = "exercise_bank.json"
+
+
+def workout_filters(equipment=True, **facets):
+    """Return the filters for the exercises a workout can use. Without equipment, only exercises
+    that need none can be used. Other facets, like difficulty="beginner", limit the exercises to
+    those with that value; an empty value allows any."""
+    filters = {facet: value for facet, value in facets.items() if value}
+    if not equipment:
+        filters["equipment"] = False
+    return filters
+
+
+def slot_entries(slots):
+    """Return the (manual entry, type, body part) of each slot given as a dict, like
+    {"type": "strength", "body_part": "legs"} or {"exercise": "Burpee"}."""
+    return [
+        (slot.get("exercise", ""), slot.get("type", ""), slot.get("body_part", ""))
+        for slot in slots
+    ]
+
+
+def generate_workout(selector, exercise_entries, seed=None, cache=workout_cache):
+    """Fill every slot of a workout. exercise_entries are (manual entry, type, body part) tuples.
+
+    Returns an exercise for each slot, or None for a slot that couldn't be filled. With a seed, the
+    same bank, slots and seed always make the same workout, ignoring any exercises the selector
+    has already used or recently saved, and the workout is cached unless cache is None.
+    """
+    selector.refresh()
+    if seed is None:
+        return _fill_slots(selector, exercise_entries)
+
+    def generate():
+        # The selections only depend on the seed, so start from no used exercises and ignore
+        # which exercises were used recently.
+        excluded, recency = selector.excluded, selector.recency
+        selector.excluded, selector.recency = ExerciseIdSet(), {}
+        selector.seed(seed)
+        try:
+            return _fill_slots(selector, exercise_entries)
+        finally:
+            selector.excluded, selector.recency = excluded, recency
+            selector.seed(None)
+
+    if cache is None:
+        exercises = generate()
+    else:
+        key = cache_key(selector.bank.version, selector.filters, exercise_entries, seed)
+        exercises = cache.get_or_generate(key, generate)
+    # Later workouts from this selector still avoid the exercises used here.
+    for exercise in exercises:
+        if exercise is not None:
+            selector.remove_exercise(exercise["name"])
+    return exercises
+
+
+def _fill_slots(selector, exercise_entries):
+    # Manual entries that name an exercise in the bank, even misspelled, use that exercise so it
+    # gets its link. Keep them all out of the random selection.
+    resolved = {}
+    for i, (manual_entry, _, _) in enumerate(exercise_entries):
+        if manual_entry:
+            exercise = selector.resolve_exercise(manual_entry)
+            if exercise is not None:
+                resolved[i] = (exercise["name"], exercise["link"])
+                manual_entry = exercise["name"]
+            selector.remove_exercise(manual_entry)
+
+    # Fill every random slot at once so no slot misses out because of the order of the draws.
+    random_slots = [
+        i
+        for i, (manual_entry, exercise_type, body_part) in enumerate(exercise_entries)
+        if not manual_entry and (exercise_type or body_part)
+    ]
+    selections = selector.select_many([exercise_entries[i][1:] for i in random_slots])
+    selected = dict(zip(random_slots, selections))
+    selected.update(resolved)
+
+    exercises = []
+    for i, (manual_entry, exercise_type, body_part) in enumerate(exercise_entries):
+        exercise_name, link = selected.get(i, (manual_entry, None))
+        if exercise_name:
+            exercises.append(
+                {
+                    "name": exercise_name,
+                    "link": link,
+                    "type": exercise_type,
+                    "body_part": body_part,
+                }
+            )
+        else:
+            exercises.append(None)
+    return exercises
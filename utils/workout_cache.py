@@ -0,0 +1,153 @@
+"""Cache of generated workouts, shared between sessions and processes.
+
+Seeded workouts only depend on the bank, the filters on its exercises, the slots and the seed,
+so they are cached under a key made from those. Recently used workouts are kept in memory, and
+every workout is also written to a directory on disk so other processes, and later runs, can use
+it too.
+"""
+
+import argparse
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+
+WORKOUT_CACHE_PATH = "saved_data/workout_cache/"
+# Changes whenever the same seed would start making different selections, so workouts cached by
+# an older version aren't used.
+GENERATOR_VERSION = 7
+
+MAX_ENTRIES = 1024
+TTL = 7 * 24 * 3600
+MAX_DISK_ENTRIES = 100000
+# The disk cache is pruned after this many workouts are written to it.
+PRUNE_EVERY = 1000
+
+
+def cache_key(bank_version, filters, exercise_entries, seed):
+    """Return the cache key of a workout generated from a bank, filters, slots and seed."""
+    key = json.dumps(
+        [
+            GENERATOR_VERSION,
+            bank_version,
+            [list(bank_filter) for bank_filter in filters],
+            [list(entry) for entry in exercise_entries],
+            seed,
+        ]
+    )
+    return hashlib.sha256(key.encode()).hexdigest()[:32]
+
+
+class WorkoutCache:
+    """An LRU cache of workouts with a time to live, backed by a directory of JSON files.
+
+    Workouts are kept as JSON text, so every get returns a fresh copy that the caller can change.
+    """
+
+    def __init__(
+        self,
+        directory,
+        max_entries=MAX_ENTRIES,
+        ttl=TTL,
+        max_disk_entries=MAX_DISK_ENTRIES,
+    ):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_disk_entries = max_disk_entries
+        # Key -> (time it was cached, JSON text), least recently used first.
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, key):
+        """Return a cached workout, or None if it isn't cached or has expired."""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                return json.loads(entry[1])
+
+        path = self._path(key)
+        try:
+            cached = os.stat(path).st_mtime
+            with open(path, "r") as f:
+                text = f.read()
+        except FileNotFoundError:
+            return None
+        if now - cached >= self.ttl:
+            return None
+        self._remember(key, cached, text)
+        return json.loads(text)
+
+    def put(self, key, workout):
+        """Cache a workout."""
+        text = json.dumps(workout)
+        self._remember(key, time.time(), text)
+
+        # Write to a temporary file first so other processes never read a half-written workout.
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(text)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % PRUNE_EVERY == 0
+        if prune:
+            self.prune()
+
+    def get_or_generate(self, key, generate):
+        """Return a cached workout, generating and caching it if it isn't cached."""
+        workout = self.get(key)
+        if workout is None:
+            workout = generate()
+            self.put(key, workout)
+        return workout
+
+    def prune(self):
+        """Delete expired workouts from disk, then the oldest ones beyond max_disk_entries."""
+        now = time.time()
+        try:
+            with os.scandir(self.directory) as files:
+                entries = [
+                    (file.stat().st_mtime, file.path)
+                    for file in files
+                    if file.name.endswith(".json")
+                ]
+        except FileNotFoundError:
+            return
+        entries.sort(reverse=True)
+        for i, (modified, path) in enumerate(entries):
+            if i >= self.max_disk_entries or now - modified >= self.ttl:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def _remember(self, key, cached, text):
+        with self._lock:
+            self._entries[key] = (cached, text)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+
+# The cache shared by every session in this process.
+workout_cache = WorkoutCache(WORKOUT_CACHE_PATH)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Delete expired and excess workouts from the workout cache."
+    )
+    parser.add_argument("directory", nargs="?", default=WORKOUT_CACHE_PATH)
+    WorkoutCache(parser.parse_args().directory).prune()
@@ -1,21 +1,125 @@
 """Workout timer GUI."""
 
 from tkinter import ttk
+import io
+import itertools
+import math
+import queue
+import threading
 import tkinter as tk
 import webbrowser
 
+from PIL import Image, ImageTk
+
+from utils import image_assets
+from utils.timer_engine import WORK, CircuitTimer, WorkoutTimer
+
+# How often the GUI is redrawn. The timer itself follows the clock, so this only affects how
+# smoothly the display updates.
+TICK_MS = 250
+# Circuit mode redraws just after the seconds shown change, this many milliseconds late at most,
+# so it doesn't wake up between changes.
+CIRCUIT_TICK_MARGIN_MS = 10
+# Station panels per row in circuit mode.
+CIRCUIT_COLUMNS = 4
+
+# Image loading priorities. Lower numbers are loaded first.
+LOAD_NOW = 0
+LOAD_LATER = 1
+
+
+class PhotoImageCache:
+    """Exercise images for the GUI. Images are read, resized and decoded on a worker thread,
+    and only turned into PhotoImages, which Tk needs to do itself, on the GUI thread."""
+
+    def __init__(self):
+        self.images = {}
+        self._requested = {}
+        self._requests = queue.PriorityQueue()
+        self._decoded = queue.Queue()
+        # Keeps requests with the same priority in the order they were made.
+        self._order = itertools.count()
+        threading.Thread(target=self._decode, daemon=True).start()
+
+    def request(self, link, priority=LOAD_LATER):
+        """Queue an exercise image to be loaded, unless it's already loaded or on its way."""
+        if not image_assets.is_image(link) or link in self.images:
+            return
+        if self._requested.get(link, LOAD_LATER + 1) > priority:
+            self._requested[link] = priority
+            self._requests.put((priority, next(self._order), link))
+
+    def get(self, link):
+        """Return the PhotoImage for an exercise image, or None if it isn't loaded yet."""
+        while True:
+            try:
+                decoded_link, image = self._decoded.get_nowait()
+            except queue.Empty:
+                break
+            self.images[decoded_link] = ImageTk.PhotoImage(image)
+        return self.images.get(link)
+
+    def _decode(self):
+        """Load the requested images, most urgent first."""
+        done = set()
+        while True:
+            _, _, link = self._requests.get()
+            if link in done:
+                continue
+            done.add(link)
+            try:
+                image = Image.open(io.BytesIO(image_assets.thumbnail_bytes(link)))
+                image.load()
+            except OSError:
+                continue
+            self._decoded.put((link, image))
+
+
+class WidgetUpdates:
+    """Widget options to set on the next redraw. Options that already have the value last set are
+    skipped, and the rest are applied together, one configure call per widget."""
+
+    def __init__(self):
+        # (widget, option) -> value last set.
+        self.shown = {}
+        # Widget -> options to set.
+        self.pending = {}
+
+    def show(self, widget, **options):
+        """Set options on a widget on the next apply(), unless they already have those values."""
+        for option, value in options.items():
+            if self.shown.get((widget, option), self) != value:
+                self.pending.setdefault(widget, {})[option] = value
+
+    def apply(self):
+        """Configure every widget with its pending options."""
+        for widget, options in self.pending.items():
+            widget.config(**options)
+            for option, value in options.items():
+                self.shown[(widget, option)] = value
+        self.pending.clear()
+
 
 class WorkoutTimerGUI:
     def __init__(self):
-        # Variables to track paused state.
-        self.paused = False
+        # The running workout timer and the pending GUI update, if any.
+        self.timer = None
+        self.images = PhotoImageCache()
         self.pause_button = None
-        self.pause_event = None
+        self.after_id = None
+
+    @property
+    def paused(self):
+        return self.timer is not None and self.timer.paused
 
     def run_timer_with_gui(
         self, root, exercises, exercise_imgs, work_duration, rest_duration, rounds
     ):
-        """Run the workout timer with a dedicated GUI window."""
+        """Run the workout timer with a dedicated GUI window.
+
+        exercise_imgs can map exercise names to PhotoImages to show instead of the exercise
+        images. Pass None to have the images loaded in the background as they are needed.
+        """
         # Clear the previous frame.
         for widget in root.winfo_children():
             widget.destroy()
@@ -50,150 +154,245 @@ class WorkoutTimerGUI:
         )
         overall_progress.pack(pady=10)
 
-        total_steps = len(exercises) * rounds * (work_duration + rest_duration)
-        step_count = 0
+        self.timer = WorkoutTimer(len(exercises), rounds, work_duration, rest_duration)
+
+        # Start loading the first two exercises' images right away and the rest after them.
+        for index, exercise in enumerate(exercises):
+            self.images.request(exercise["link"], LOAD_NOW if index < 2 else LOAD_LATER)
 
         def toggle_pause():
             """Pause/resume the timer."""
-            self.paused = not self.paused
-            if self.paused:
+            if self.timer.running:
+                self.timer.pause()
+                frame.after_cancel(self.after_id)
                 pause_button.config(text="▶️ Resume")
             else:
+                self.timer.resume()
                 pause_button.config(text="⏸️ Pause")
-                if self.pause_event:
-                    self.pause_event()
-                self.pause_event = None
+                update_timer()
 
         pause_button = tk.Button(frame, text="⏸️ Pause", command=toggle_pause)
         pause_button.pack(pady=5)
+        self.pause_button = pause_button
 
-        def update_timer(
-            remaining,
-            round,
-            phase,
-            exercise,
-            exercise_link,
-            elapsed,
-            total,
-            next_action,
-        ):
+        # Each update only touches what changed.
+        updates = WidgetUpdates()
+        show = updates.show
+
+        def update_timer():
             """Update the GUI timer labels and progress bars."""
-            if self.paused:
-                # Save the paused event
-                self.pause_event = lambda: update_timer(
-                    remaining,
-                    round,
-                    phase,
-                    exercise,
-                    exercise_link,
-                    elapsed,
-                    total,
-                    next_action,
-                )
+            state = self.timer.state()
+            if state.done:
+                # Workout complete
+                show(round_label, text="🎉 Workout Complete!")
+                show(current_exercise_label, text="Great job! 💪")
+                show(timer_label, text="")
+                show(exercise_link_label, image="", text="")
+                show(phase_label, text="")
+                show(individual_progress, value=100)
+                show(overall_progress, value=100)
+                updates.apply()
                 return
 
+            working = state.phase == WORK
+            exercise = exercises[state.exercise_index]["name"] if working else "Rest"
+            exercise_link = exercises[state.exercise_index]["link"] if working else None
+
+            # Make sure the next exercise's image is ready by the time it's needed.
+            next_exercise = exercises[(state.exercise_index + 1) % len(exercises)]
+            self.images.request(next_exercise["link"], LOAD_NOW)
+
             # Update labels
-            round_label.config(text=f"Round: {round}")
-            mins, secs = divmod(remaining, 60)
-            timer_label.config(text=f"{mins:02}:{secs:02}")
-            current_exercise_label.config(
-                text=(
-                    f"🚀 Exercise: {exercise}" if phase == "WORKING" else "😌 Rest Time"
-                )
+            show(round_label, text=f"Round: {state.round}")
+            mins, secs = divmod(state.remaining, 60)
+            show(timer_label, text=f"{mins:02}:{secs:02}")
+            show(
+                current_exercise_label,
+                text=(f"🚀 Exercise: {exercise}" if working else "😌 Rest Time"),
             )
-            if exercise_imgs.get(exercise):
-                exercise_link_label.config(image=exercise_imgs[exercise])
+            if exercise_imgs and exercise_imgs.get(exercise):
+                show(exercise_link_label, image=exercise_imgs[exercise])
+            elif image_assets.is_image(exercise_link):
+                self.images.request(exercise_link, LOAD_NOW)
+                show(
+                    exercise_link_label,
+                    image=self.images.get(exercise_link) or "",
+                    text="",
+                )
             elif exercise_link:
-                exercise_link_label.config(
+                if (
+                    updates.shown.get((exercise_link_label, "text"))
+                    != f"{exercise} example link"
+                ):
+                    # Bind the click event to the open_link function
+                    exercise_link_label.bind(
+                        "<Button-1>",
+                        lambda e, link=exercise_link: webbrowser.open(link),
+                    )
+                show(
+                    exercise_link_label,
+                    image="",
                     text=f"{exercise} example link",
                     fg="blue",
                     cursor="hand2",
                     font=("Arial", 12, "underline"),
                 )
-                # Bind the click event to the open_link function
-                exercise_link_label.bind(
-                    "<Button-1>", lambda e, link=exercise_link: webbrowser.open(link)
-                )
             else:
-                exercise_link_label.config(image="", text="")
-            phase_label.config(text=f"Phase: {phase}")
+                show(exercise_link_label, image="", text="")
+            show(phase_label, text=f"Phase: {'WORKING' if working else 'RESTING'}")
 
             # Update progress bars
-            individual_progress["value"] = (elapsed / total) * 100
-            overall_progress["value"] = (step_count / total_steps) * 100
-
-            # Schedule next action or end
-            if remaining > 0:
-                frame.after(
-                    1000,
-                    update_timer,
-                    remaining - 1,
-                    round,
-                    phase,
-                    exercise,
-                    exercise_link,
-                    elapsed + 1,
-                    total,
-                    next_action,
-                )
-            else:
-                next_action()
-
-        def start_work(round, exercise, exercise_link, next_phase):
-            """Start the work phase for an exercise."""
-            nonlocal step_count
-            step_count += work_duration
-            update_timer(
-                work_duration,
-                round,
-                "WORKING",
-                exercise,
-                exercise_link,
-                0,
-                work_duration,
-                next_phase,
+            show(
+                individual_progress,
+                value=round(state.phase_elapsed / state.phase_duration * 100),
             )
+            show(overall_progress, value=round(state.progress * 100, 1))
+            updates.apply()
 
-        def start_rest(round, next_exercise_action):
-            """Start the rest phase between exercises."""
-            nonlocal step_count
-            step_count += rest_duration
-            update_timer(
-                rest_duration,
-                round,
-                "RESTING",
-                "Rest",
-                None,
-                0,
-                rest_duration,
-                next_exercise_action,
+            # Schedule the next update.
+            self.after_id = frame.after(TICK_MS, update_timer)
+
+        # Start the timer
+        self.timer.start()
+        update_timer()
+
+    def run_circuit_with_gui(
+        self,
+        root,
+        exercises,
+        work_duration,
+        rest_duration,
+        rounds,
+        num_stations,
+        offsets=None,
+        rotation=1,
+    ):
+        """Run a circuit of stations in one window, each with its own timer. See CircuitTimer
+        for how offsets and rotation work.
+
+        Every station is redrawn from one tick, scheduled for just after the seconds shown next
+        change rather than at a fixed interval, so a late tick doesn't put the next one late too,
+        and widgets are only configured when what they show has changed. Stations show exercise
+        names without images, to keep the panels small.
+        """
+        for widget in root.winfo_children():
+            widget.destroy()
+
+        frame = tk.Frame(root)
+        frame.pack(padx=10, pady=10)
+
+        self.timer = CircuitTimer(
+            num_stations,
+            len(exercises),
+            rounds,
+            work_duration,
+            rest_duration,
+            offsets,
+            rotation,
+        )
+
+        # (exercise label, timer label, phase label, progress bar) of each station.
+        panels = []
+        for station in range(num_stations):
+            panel = tk.Frame(frame, borderwidth=1, relief="solid", padx=8, pady=8)
+            panel.grid(
+                row=station // CIRCUIT_COLUMNS,
+                column=station % CIRCUIT_COLUMNS,
+                padx=5,
+                pady=5,
+                sticky="nsew",
             )
+            tk.Label(panel, text=f"Station {station + 1}", font=("Arial", 12)).pack()
+            exercise_label = tk.Label(panel, text="", font=("Arial", 14), width=20)
+            exercise_label.pack()
+            timer_label = tk.Label(panel, text="", font=("Arial", 20, "bold"))
+            timer_label.pack()
+            phase_label = tk.Label(panel, text="", font=("Arial", 12))
+            phase_label.pack()
+            progress = ttk.Progressbar(
+                panel, orient="horizontal", length=150, mode="determinate"
+            )
+            progress.pack(pady=5)
+            panels.append((exercise_label, timer_label, phase_label, progress))
 
-        def next_exercise(round_index, exercise_index):
-            """Move to the next exercise or round."""
-            if exercise_index < len(exercises):
-                # Next exercise in the same round
-                start_work(
-                    round_index,
-                    exercises[exercise_index]["name"],
-                    exercises[exercise_index]["link"],
-                    lambda: start_rest(
-                        round_index,
-                        lambda: next_exercise(round_index, exercise_index + 1),
-                    ),
-                )
-            elif round_index < rounds:
-                # Start the next round
-                next_exercise(round_index + 1, 0)
+        controls = tk.Frame(frame)
+        controls.grid(
+            row=num_stations // CIRCUIT_COLUMNS + 1,
+            column=0,
+            columnspan=CIRCUIT_COLUMNS,
+        )
+        circuit_label = tk.Label(controls, text="", font=("Arial", 14))
+        circuit_label.pack(pady=5)
+
+        updates = WidgetUpdates()
+        show = updates.show
+
+        def toggle_pause():
+            """Pause/resume every station."""
+            if self.timer.running:
+                self.timer.pause()
+                frame.after_cancel(self.after_id)
+                pause_button.config(text="▶️ Resume")
             else:
-                # Workout complete
-                round_label.config(text="🎉 Workout Complete!")
-                current_exercise_label.config(text="Great job! 💪")
-                timer_label.config(text="")
-                exercise_link_label.config(image="", text="")
-                phase_label.config(text="")
-                individual_progress["value"] = 100
-                overall_progress["value"] = 100
+                self.timer.resume()
+                pause_button.config(text="⏸️ Pause")
+                tick()
 
-        # Start the timer
-        next_exercise(1, 0)
+        pause_button = tk.Button(controls, text="⏸️ Pause", command=toggle_pause)
+        pause_button.pack(pady=5)
+        self.pause_button = pause_button
+
+        def tick():
+            """Redraw every station that changed and schedule the next tick."""
+            for station, (
+                exercise_label,
+                timer_label,
+                phase_label,
+                progress,
+            ) in zip(self.timer.states(), panels):
+                state = station.timer
+                exercise = exercises[station.exercise_index]["name"]
+                if station.starts_in:
+                    mins, secs = divmod(station.starts_in, 60)
+                    show(exercise_label, text=exercise)
+                    show(phase_label, text=f"Starts in {mins:02}:{secs:02}")
+                    show(timer_label, text="--:--")
+                    show(progress, value=0)
+                elif state.done:
+                    show(exercise_label, text="Done! 💪")
+                    show(phase_label, text="")
+                    show(timer_label, text="00:00")
+                    show(progress, value=100)
+                else:
+                    working = state.phase == WORK
+                    mins, secs = divmod(state.remaining, 60)
+                    show(
+                        exercise_label,
+                        text=exercise if working else "😌 Rest",
+                    )
+                    show(
+                        phase_label,
+                        text=f"Round {state.round}: {'WORK' if working else 'REST'}",
+                    )
+                    show(timer_label, text=f"{mins:02}:{secs:02}")
+                    show(
+                        progress,
+                        value=round(state.phase_elapsed / state.phase_duration * 100),
+                    )
+
+            if self.timer.done:
+                show(circuit_label, text="🎉 Circuit Complete!")
+                updates.apply()
+                return
+            remaining = math.ceil(self.timer.total_duration - self.timer.elapsed())
+            mins, secs = divmod(remaining, 60)
+            show(circuit_label, text=f"Circuit: {mins:02}:{secs:02} left")
+            updates.apply()
+
+            self.after_id = frame.after(
+                math.ceil(self.timer.next_change() * 1000) + CIRCUIT_TICK_MARGIN_MS,
+                tick,
+            )
+
+        self.timer.start()
+        tick()
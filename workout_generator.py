@@ -1,65 +1,111 @@
-import os
 import streamlit as st
-from streamlit_autorefresh import st_autorefresh
+import utils.countdown as countdown
 import utils.file_operations as file_ops
-from utils.exercise_selector import ExerciseSelector
-
-# Initialize session state.
-# Workout creation variables.
-if "exercises" not in st.session_state:
-    st.session_state.exercises = []
-if "timer_config" not in st.session_state:
-    st.session_state.timer_config = {}
-if "selector" not in st.session_state:
-    st.session_state.selector = ExerciseSelector("exercises.json")
-if "num_exercises" not in st.session_state:
-    st.session_state.num_exercises = 0
-if "saved_exercises" not in st.session_state:
-    st.session_state.saved_exercises = {}
-
-# Keep track of different modes.
-if "loading_screen" not in st.session_state:
-    st.session_state.loading_screen = True
-if "new_workout_screen" not in st.session_state:
-    st.session_state.new_workout_screen = False
-if "create_exercise_screen" not in st.session_state:
-    st.session_state.create_exercise_screen = False
-if "preview_screen" not in st.session_state:
-    st.session_state.preview_screen = False
-if "save_workout" not in st.session_state:
-    st.session_state.save_workout = False
-if "save_timer" not in st.session_state:
-    st.session_state.save_timer = False
-if "run_timer" not in st.session_state:
-    st.session_state.run_timer = False
-
-# Timer states.
-if "paused" not in st.session_state:
-    st.session_state.paused = False
-if "round" not in st.session_state:
-    st.session_state.round = 1
-if "exercise_index" not in st.session_state:
-    st.session_state.exercise_index = 0
-if "phase" not in st.session_state:
-    st.session_state.phase = "WORK"
-if "time_remaining" not in st.session_state:
-    st.session_state.time_remaining = 0
-if "time_elapsed" not in st.session_state:
-    st.session_state.time_elapsed = 0
-if "step_count" not in st.session_state:
-    st.session_state.step_count = 0
-
-
+import utils.history as history
+import utils.image_assets as image_assets
+import utils.metrics as metrics
+from utils.exercise_selector import RECENT_WORKOUTS, ExerciseSelector
+from utils.timer_engine import REST, WORK, WorkoutTimer
+from utils.bitmap_index import filter_key
+from utils.workout_builder import EXERCISE_BANK, generate_workout, workout_filters
+
+# Exercise slots shown at once on the exercise configuration screen.
+SLOTS_PER_PAGE = 10
+# (facet, label) of the exercise bank facets a new workout can be limited to, besides equipment.
+FACET_FILTERS = [("difficulty", "Difficulty"), ("impact", "Impact")]
+
+# Screens in the order they are checked for the screen being shown.
+SCREENS = [
+    "loading_screen",
+    "new_workout_screen",
+    "create_exercise_screen",
+    "preview_screen",
+    "run_timer",
+]
+
+
+def current_screen():
+    """Return the name of the screen being shown."""
+    for screen in SCREENS:
+        if st.session_state.get(screen):
+            return screen
+    return SCREENS[0]
+
+
+@metrics.timed("selector_construction")
+def new_selector(filters):
+    """Return a selector for the exercises matching some filters that favours exercises the user
+    hasn't done recently."""
+    selector = ExerciseSelector(EXERCISE_BANK, filters)
+    selector.set_recent_workouts(file_ops.recent_workouts(RECENT_WORKOUTS))
+    return selector
+
+
+metrics.start_rerun(current_screen(), st.session_state)
+
+# Initialize session state. This only has to happen on the first run of each session.
+if "session_initialized" not in st.session_state:
+    with metrics.section("session_init"):
+        # Workout creation variables.
+        st.session_state.exercises = []
+        st.session_state.timer_config = {}
+        st.session_state.selector = new_selector({})
+        st.session_state.num_exercises = 0
+        st.session_state.saved_exercises = {}
+        st.session_state.selection_errors = []
+        # [manual entry, type, body part] of each exercise slot, and the page of slots shown.
+        st.session_state.slots = []
+        st.session_state.slot_page = 0
+
+        # Keep track of different modes.
+        st.session_state.loading_screen = True
+        st.session_state.new_workout_screen = False
+        st.session_state.create_exercise_screen = False
+        st.session_state.preview_screen = False
+        st.session_state.save_workout = False
+        st.session_state.save_timer = False
+        st.session_state.run_timer = False
+
+        # Timer state, and whether the session being timed is in the history log yet.
+        st.session_state.timer = None
+        st.session_state.history_recorded = False
+        st.session_state.browser_timer = True
+        st.session_state.countdown = None
+
+        st.session_state.session_initialized = True
+else:
+    # Pick up edits to the exercise bank made since the last rerun.
+    st.session_state.selector.refresh()
+
+
+@metrics.timed("image_rendering")
 def show_exercise_link(exercise):
     """Show the exercise link either as an image or a HTML link."""
-    if exercise["link"] and exercise["link"].endswith(("jpg", "png")):
+    if image_assets.is_image(exercise["link"]):
         _, col2, _ = st.columns(3)
         with col2:
-            st.image(exercise["link"], width=300)
+            # Thumbnails are already the display size and kept in memory, and the same bytes
+            # keep the same media URL, so the browser doesn't download them again.
+            st.image(
+                image_assets.thumbnail_bytes(exercise["link"]),
+                width=image_assets.THUMBNAIL_WIDTH,
+            )
     elif exercise["link"]:
         st.video(exercise["link"], muted=True)
 
 
+def edit_slots():
+    """Fill the exercise slots with the saved exercises, leaving the rest empty, and go to the
+    first page of slots."""
+    saved_names = list(st.session_state.saved_exercises)
+    st.session_state.slots = [
+        [saved_names[i] if i < len(saved_names) else "", "", ""]
+        for i in range(st.session_state.num_exercises)
+    ]
+    st.session_state.slot_page = 0
+    st.session_state.create_exercise_screen = True
+
+
 def create_workout(selected_workout, selected_timer):
     """Transition from loading workout screen to either inputting new workout params or loading the saved workout/timer config."""
     # Load selected workout/timer if applicable
@@ -68,7 +114,7 @@ def create_workout(selected_workout, selected_timer):
     if selected_workout:
         st.session_state.saved_exercises = file_ops.load_workouts(selected_workout)
         st.session_state.num_exercises = len(st.session_state.saved_exercises)
-        st.session_state.create_exercise_screen = True
+        edit_slots()
     else:
         st.session_state.new_workout_screen = True
 
@@ -78,47 +124,42 @@ def create_workout(selected_workout, selected_timer):
 def select_exercises():
     """Transition from inputting new workout params to selecting exercises."""
     st.session_state.new_workout_screen = False
-    st.session_state.create_exercise_screen = True
+    edit_slots()
 
 
-def preview_workout(exercise_entries, timer_config):
+@metrics.timed("preview_workout")
+def preview_workout(exercise_entries, timer_config, seed=None):
     """Select exercises based on user input and transition from inputting exercises to previewing the workout."""
     # Reset saved exercises.
     st.session_state.exercises = []
+    st.session_state.selection_errors = []
     st.session_state.timer_config = timer_config
 
-    for i, entry in enumerate(exercise_entries, 1):
-        manual_entry, exercise_type, body_part = entry
-        exercise_name = None
-        link = None
+    exercises = generate_workout(st.session_state.selector, exercise_entries, seed)
+    metrics.count(
+        "selector_draws",
+        sum(1 for manual, *slot in exercise_entries if not manual and any(slot)),
+    )
 
-        if manual_entry:
-            exercise_name = manual_entry
-        elif exercise_type or body_part:
-            exercise_name, link = st.session_state.selector.select_exercise(
-                exercise_type, body_part
+    for i, exercise in enumerate(exercises):
+        if exercise is None:
+            # If an exercise is empty or invalid, show an error on the preview screen.
+            _, exercise_type, body_part = exercise_entries[i]
+            metrics.count("failed_selections")
+            st.session_state.selection_errors.append(
+                f"Exercise {i + 1} could not be found for this combination of type ({exercise_type}) and body part ({body_part})."
             )
-
-        if exercise_name:
-            if exercise_name in st.session_state.saved_exercises:
-                st.session_state.exercises.append(
-                    st.session_state.saved_exercises[exercise_name]
-                )
-            else:
-                st.session_state.exercises.append(
-                    {
-                        "name": exercise_name,
-                        "link": link,
-                        "type": exercise_type,
-                        "body_part": body_part,
-                    }
-                )
-            st.session_state.selector.remove_exercise(exercise_name)
-        else:
-            # If an exercise is empty or invalid, show an error.
-            st.error(
-                f"Exercise {i} could not be found for this combination of type ({exercise_type}) and body part ({body_part})."
+        elif exercise_entries[i][0] in st.session_state.saved_exercises:
+            # Keep exercises of the workout being edited as they were saved.
+            st.session_state.exercises.append(
+                st.session_state.saved_exercises[exercise_entries[i][0]]
+            )
+        elif exercise["name"] in st.session_state.saved_exercises:
+            st.session_state.exercises.append(
+                st.session_state.saved_exercises[exercise["name"]]
             )
+        else:
+            st.session_state.exercises.append(exercise)
 
     st.session_state.create_exercise_screen = False
     st.session_state.preview_screen = True
@@ -132,47 +173,123 @@ def back_to_edit():
         st.session_state.saved_exercises[exercise["name"]] = exercise
 
     st.session_state.preview_screen = False
-    st.session_state.create_exercise_screen = True
+    edit_slots()
 
 
 def run_timer():
     """Transition from the workout preview screen to the workout timer."""
-    # Set up timer start conditions.
-    st.session_state.round = 1
-    st.session_state.exercise_index = 0
-    st.session_state.phase = "WORK"
-    st.session_state.time_remaining = st.session_state.timer_config["work_duration"]
-    st.session_state.time_elapsed = 0
+    # Set up the timer and start it.
+    st.session_state.timer = WorkoutTimer.from_config(
+        len(st.session_state.exercises), st.session_state.timer_config
+    )
+    st.session_state.timer.start()
+    if st.session_state.browser_timer:
+        st.session_state.countdown = countdown.countdown_args(
+            st.session_state.exercises, st.session_state.timer
+        )
 
+    st.session_state.history_recorded = False
     st.session_state.preview_screen = False
     st.session_state.run_timer = True
 
 
+def record_session():
+    """Add the session being timed to the history log, as completed or abandoned, unless it is
+    already there."""
+    if not st.session_state.history_recorded:
+        history.record(
+            st.session_state.exercises,
+            st.session_state.timer,
+            bank=st.session_state.selector.bank,
+        )
+        st.session_state.history_recorded = True
+
+
+def leave_timer():
+    """Transition from the workout timer back to the workout preview screen, recording the
+    session."""
+    record_session()
+    st.session_state.run_timer = False
+    st.session_state.preview_screen = True
+
+
 # Main Title
 st.title("🏋️ Workout Generator")
 
-# Start with loading screen.
-if st.session_state.loading_screen:
-    # Load existing workouts and timers
-    saved_workouts = [f for f in os.listdir(file_ops.SAVED_WORKOUTS_PATH)]
-    saved_timers = [f for f in os.listdir(file_ops.SAVED_TIMERS_PATH)]
 
-    selected_workout = st.selectbox("Load Workout:", [""] + saved_workouts)
-    selected_timer = st.selectbox("Load Timer Config:", [""] + saved_timers)
+def saved_item_picker(label, search, query, describe):
+    """Pick a saved item from a page of the items matching the search query."""
+    entries, total = search(query)
+    if total > file_ops.PAGE_SIZE:
+        pages = -(-total // file_ops.PAGE_SIZE)
+        page = st.number_input(f"{label} page", min_value=1, max_value=pages, value=1)
+        entries, _ = search(query, page - 1)
 
-    # Button to start creating a new workout
-    st.button(
-        "Create Workout",
-        on_click=lambda: create_workout(selected_workout, selected_timer),
+    descriptions = {entry["name"]: describe(entry) for entry in entries}
+    return st.selectbox(
+        label,
+        [""] + list(descriptions),
+        format_func=lambda name: descriptions.get(name, ""),
     )
 
 
+def describe_workout(entry):
+    """Describe a saved workout in the list of workouts to load."""
+    if entry["exercise_count"] is None:
+        return entry["name"]
+    return f"{entry['name']} ({entry['exercise_count']} exercises)"
+
+
+def describe_timer_config(entry):
+    """Describe a saved timer config in the list of timer configs to load."""
+    if entry["duration"] is None:
+        return entry["name"]
+    mins, secs = divmod(entry["duration"], 60)
+    return f"{entry['name']} ({mins:02}:{secs:02} per exercise)"
+
+
+@metrics.timed("loading_screen")
+def loading_screen():
+    """Choose a saved workout and timer config to load."""
+    # Load existing workouts and timers. Only the page of each being shown is read.
+    query = st.text_input("Search Saved Workouts and Timer Configs:")
+    with metrics.section("loading_listing"):
+        selected_workout = saved_item_picker(
+            "Load Workout:", file_ops.search_workouts, query, describe_workout
+        )
+        selected_timer = saved_item_picker(
+            "Load Timer Config:",
+            file_ops.search_timer_configs,
+            query,
+            describe_timer_config,
+        )
+
+    # Button to start creating a new workout
+    if st.button("Create Workout"):
+        create_workout(selected_workout, selected_timer)
+        st.rerun()
+
+
+# Start with loading screen.
+if st.session_state.loading_screen:
+    loading_screen()
+
+
 if st.session_state.new_workout_screen:
-    st.session_state.selector = ExerciseSelector(
-        "exercises.json"
-        if st.radio("Equipment?", ["No Equipment", "Equipment"]) == "Equipment"
-        else "no_equipment_exercises.json"
-    )
+    equipment = st.radio("Equipment?", ["No Equipment", "Equipment"]) == "Equipment"
+    facets = {}
+    for column, (facet, label) in zip(st.columns(len(FACET_FILTERS)), FACET_FILTERS):
+        with column:
+            facets[facet] = st.selectbox(
+                label,
+                [""] + list(st.session_state.selector.bank.facets.values(facet)),
+                format_func=lambda value: value or "Any",
+            )
+    filters = workout_filters(equipment, **facets)
+    # Selectors share the parsed bank and its indexes, so creating one only costs a stat of the
+    # bank file and reading the recent workouts.
+    if st.session_state.selector.filters != filter_key(filters):
+        st.session_state.selector = new_selector(filters)
     num_exercises = st.number_input(
         "Number of Exercises:", min_value=1, max_value=50, value=4
     )
@@ -180,70 +297,160 @@ if st.session_state.new_workout_screen:
 
     st.button("Enter", on_click=select_exercises)
 
-# Create Exercise Slots
-if st.session_state.create_exercise_screen:
-    # Exercise and Timer Configuration
-    st.header("Exercise and Timer Configuration")
-
-    # Exercise Configuration
-    st.subheader("Configure Exercises")
-    exercise_entries = []
-
-    for i in range(st.session_state.num_exercises):
-        saved_exercise = None
-        if i < len(st.session_state.saved_exercises):
-            saved_exercise = list(st.session_state.saved_exercises.keys())[i]
-        manual_entry = st.text_input(
-            f"Exercise {i + 1}",
-            value=(saved_exercise if saved_exercise else ""),
-            placeholder=(
-                "Enter custom exercise (optional)" if not saved_exercise else None
-            ),
+
+def show_manual_entry_match(manual_entry):
+    """Show which exercise in the bank a manual entry will use, or suggest some if none."""
+    selector = st.session_state.selector
+    if selector.find_exercise(manual_entry) is not None:
+        return
+    exercise = selector.resolve_exercise(manual_entry)
+    if exercise is not None:
+        st.caption(f"Will use **{exercise['name']}** from the exercise bank.")
+        return
+    suggestions = selector.suggest_exercises(manual_entry, limit=5)
+    if suggestions:
+        st.caption(f"Not in the exercise bank. Did you mean: {', '.join(suggestions)}?")
+    else:
+        st.caption("Not in the exercise bank, so it will have no link.")
+
+
+def option_index(options, value):
+    """Return the position of a value in a selectbox's options, or of the first option if the
+    value isn't one of them."""
+    return options.index(value) if value in options else 0
+
+
+def keep_slot_page(first, last, page):
+    """Keep the edits to slots first to last - 1 when the slot form is submitted, then go to a
+    page of slots."""
+    for i in range(first, last):
+        st.session_state.slots[i] = [
+            st.session_state[f"slot_{i}_exercise"],
+            st.session_state[f"slot_{i}_type"],
+            st.session_state[f"slot_{i}_body_part"],
+        ]
+    st.session_state.slot_page = page
+
+
+@metrics.timed("exercise_slot_editor")
+def exercise_slot_editor():
+    """Configure the exercise slots and the timer.
+
+    Everything is in one form, so editing widgets doesn't rerun anything until the form is
+    submitted, and only one page of slots is shown at a time.
+    """
+    slots = st.session_state.slots
+    selector = st.session_state.selector
+    type_options = [""] + selector.exercise_categories()
+    body_part_options = [""] + selector.exercise_body_parts()
+    pages = max(1, -(-len(slots) // SLOTS_PER_PAGE))
+    page = min(st.session_state.slot_page, pages - 1)
+    first = page * SLOTS_PER_PAGE
+    last = min(first + SLOTS_PER_PAGE, len(slots))
+
+    with st.form("exercise_slots"):
+        # Exercise and Timer Configuration
+        st.header("Exercise and Timer Configuration")
+
+        # Exercise Configuration
+        st.subheader("Configure Exercises")
+        if pages > 1:
+            st.caption(f"Exercises {first + 1}-{last} of {len(slots)}")
+
+        with metrics.section("slot_widgets"):
+            for i in range(first, last):
+                manual_entry, exercise_type, body_part = slots[i]
+                st.text_input(
+                    f"Exercise {i + 1}",
+                    value=manual_entry,
+                    placeholder="Enter custom exercise (optional)",
+                    key=f"slot_{i}_exercise",
+                )
+                if (
+                    manual_entry
+                    and manual_entry not in st.session_state.saved_exercises
+                ):
+                    show_manual_entry_match(manual_entry)
+
+                # Create two columns
+                col1, col2 = st.columns(2)
+                with col1:
+                    st.selectbox(
+                        f"Type of Exercise {i + 1}",
+                        options=type_options,
+                        index=option_index(type_options, exercise_type),
+                        key=f"slot_{i}_type",
+                    )
+
+                with col2:
+                    st.selectbox(
+                        f"Body Part for Exercise {i + 1}",
+                        options=body_part_options,
+                        index=option_index(body_part_options, body_part),
+                        key=f"slot_{i}_body_part",
+                    )
+
+        # Timer Configuration
+        st.subheader("Configure Timer")
+        timer_config = {}
+        timer_config["rounds"] = st.number_input(
+            "Number of Rounds:",
+            min_value=1,
+            value=(st.session_state.timer_config.get("rounds", 3)),
+        )
+        timer_config["work_duration"] = st.number_input(
+            "Work Duration (seconds):",
+            min_value=1,
+            value=st.session_state.timer_config.get("work_duration", 30),
+        )
+        timer_config["rest_duration"] = st.number_input(
+            "Rest Duration (seconds):",
+            min_value=0,
+            value=st.session_state.timer_config.get("rest_duration", 15),
+        )
+        seed = st.number_input(
+            "Seed (optional):",
+            min_value=0,
+            value=None,
+            step=1,
+            help="The same seed and exercise slots always make the same workout.",
         )
 
-        # Create two columns
-        col1, col2 = st.columns(2)
-        with col1:
-            exercise_type = st.selectbox(
-                f"Type of Exercise {i + 1}",
-                options=[""] + st.session_state.selector.exercise_categories(),
-            )
+        # Page and Preview Options
+        if pages > 1:
+            col1, col2 = st.columns(2)
+            with col1:
+                st.form_submit_button(
+                    "Previous Exercises",
+                    disabled=page == 0,
+                    on_click=keep_slot_page,
+                    args=(first, last, page - 1),
+                )
+            with col2:
+                st.form_submit_button(
+                    "Next Exercises",
+                    disabled=page == pages - 1,
+                    on_click=keep_slot_page,
+                    args=(first, last, page + 1),
+                )
+        preview = st.form_submit_button(
+            "Preview Workout", on_click=keep_slot_page, args=(first, last, page)
+        )
 
-        with col2:
-            body_part = st.selectbox(
-                f"Body Part for Exercise {i + 1}",
-                options=["", "legs", "upper_body", "abs", "cardio"],
-            )
-        exercise_entries.append((manual_entry, exercise_type, body_part))
-
-    # Timer Configuration
-    st.subheader("Configure Timer")
-    timer_config = {}
-    timer_config["rounds"] = st.number_input(
-        "Number of Rounds:",
-        min_value=1,
-        value=(st.session_state.timer_config.get("rounds", 3)),
-    )
-    timer_config["work_duration"] = st.number_input(
-        "Work Duration (seconds):",
-        min_value=1,
-        value=st.session_state.timer_config.get("work_duration", 30),
-    )
-    timer_config["rest_duration"] = st.number_input(
-        "Rest Duration (seconds):",
-        min_value=0,
-        value=st.session_state.timer_config.get("rest_duration", 15),
-    )
+    if preview:
+        preview_workout([tuple(slot) for slot in slots], timer_config, seed)
+        st.rerun()
 
-    # Save or Preview Options
-    st.button(
-        "Preview Workout",
-        on_click=lambda: preview_workout(exercise_entries, timer_config),
-    )
+
+# Create Exercise Slots
+if st.session_state.create_exercise_screen:
+    exercise_slot_editor()
 
 # Workout Preview
 if st.session_state.preview_screen:
     st.header("Workout Preview", divider=True)
+    for error in st.session_state.selection_errors:
+        st.error(error)
     for i, exercise in enumerate(st.session_state.exercises, 1):
         st.markdown(f"#### {i}. {exercise['name']}")
         show_exercise_link(exercise)
@@ -254,7 +461,13 @@ if st.session_state.preview_screen:
         f"#### Rounds: {timer_info['rounds']}, Work: {timer_info['work_duration']}s, "
         f"Rest: {timer_info['rest_duration']}s"
     )
+    st.session_state.browser_timer = st.toggle(
+        "Run timer in browser", value=st.session_state.browser_timer
+    )
     st.button("Start Timer", on_click=run_timer)
+    # Get the thumbnails ready while the workout is being reviewed.
+    for exercise in st.session_state.exercises:
+        image_assets.prefetch(exercise["link"])
 
     if st.button("Save Workout"):
         st.session_state.save_workout = True
@@ -284,83 +497,94 @@ if st.session_state.save_timer:
     st.button("Save", on_click=lambda: save_timer_config(filename))
 
 
-def update_timer():
+@metrics.timed("update_timer")
+def update_timer(state):
     """Update the GUI timer labels and progress bars."""
     # Find the current exercise.
-    exercise = st.session_state.exercises[st.session_state.exercise_index]
+    exercise = st.session_state.exercises[state.exercise_index]
     # Display current phase and exercise
-    st.subheader(f"Round: {st.session_state.round}", divider=True)
-    if st.session_state.phase == "WORK":
+    st.subheader(f"Round: {state.round}", divider=True)
+    if state.phase == WORK:
         st.markdown(
             f"<div style='text-align: center; font-size: 24px;'>🚀 Exercise: {exercise['name']}</div>",
             unsafe_allow_html=True,
         )
         show_exercise_link(exercise)
-    elif st.session_state.phase == "REST":
+    elif state.phase == REST:
         st.subheader("😌 Rest")
+        # Show what's next, which also gets its image to the browser before it's needed.
+        next_index = state.exercise_index + 1
+        if next_index == len(st.session_state.exercises):
+            next_index = (
+                0 if state.round < st.session_state.timer_config["rounds"] else None
+            )
+        if next_index is not None:
+            next_exercise = st.session_state.exercises[next_index]
+            st.markdown(
+                f"<div style='text-align: center;'>Up next: {next_exercise['name']}</div>",
+                unsafe_allow_html=True,
+            )
+            show_exercise_link(next_exercise)
 
     # Display time remaining.
-    mins, secs = divmod(st.session_state.time_remaining, 60)
+    mins, secs = divmod(state.remaining, 60)
     st.markdown(
         f"<div style='text-align: center; font-size: 24px;'>{mins:02}:{secs:02}</div>",
         unsafe_allow_html=True,
     )
 
     # Display progress bars.
-    st.progress(
-        st.session_state.step_count
-        / (
-            st.session_state.timer_config["rounds"] * st.session_state.num_exercises * 2
-        ),
-        text="Workout Progress",
-    )
+    st.progress(state.progress, text="Workout Progress")
+
+
+@metrics.fragment("run_timer", st.session_state)
+def browser_timer_view():
+    """Run the countdown in the browser, which only reports back on pause, resume or completion."""
+    timer = st.session_state.timer
+    event = countdown.countdown(st.session_state.countdown, key="countdown")
+    if event and event["seq"] > st.session_state.countdown["seq"]:
+        countdown.handle_event(timer, event)
+        st.session_state.countdown = countdown.countdown_args(
+            st.session_state.exercises, timer, event["seq"]
+        )
+        if timer.state().done:
+            st.rerun()
+
+
+@metrics.fragment("run_timer", st.session_state)
+def server_timer_view():
+    """Show the timer, redrawn every second while it is running."""
+    timer = st.session_state.timer
+    state = timer.state()
+    if state.done:
+        st.rerun()
+    update_timer(state)
+    # Timer controls. Pausing or resuming changes how often this view reruns, so rerun the app.
+    if timer.running:
+        if st.button("⏸️ Pause"):
+            timer.pause()
+            st.rerun()
+    elif st.button("▶️ Resume"):
+        timer.resume()
+        st.rerun()
 
 
 if st.session_state.run_timer:
-    if st.session_state.round <= st.session_state.timer_config["rounds"]:
-        update_timer()
-        if not st.session_state.paused:
-            st.session_state.time_remaining -= 1
-            st.session_state.time_elapsed += 1
-
-            if st.session_state.time_remaining < 0:
-                st.session_state.step_count += 1
-                # If we were in a rest phase, go to a work phase and increment the exercise index.
-                if st.session_state.phase == "REST":
-                    st.session_state.phase = "WORK"
-                    st.session_state.time_remaining = st.session_state.timer_config[
-                        "work_duration"
-                    ]
-                    # If we just finished the last exercise, go to the next round.
-                    if (
-                        st.session_state.exercise_index
-                        == st.session_state.num_exercises - 1
-                    ):
-                        st.session_state.round += 1
-                        st.session_state.exercise_index = 0
-                    else:
-                        st.session_state.exercise_index += 1
-                # If we were in a work phase, go to a rest phase.
-                elif st.session_state.phase == "WORK":
-                    st.session_state.phase = "REST"
-                    st.session_state.time_remaining = st.session_state.timer_config[
-                        "rest_duration"
-                    ]
-                # Reset time elapsed.
-                st.session_state.time_elapsed = 0
-            # Timer controls
-            st.button(
-                "⏸️ Pause",
-                on_click=lambda: setattr(st.session_state, "paused", True),
-            )
-            # Non-blocking countdown logic
-            st_autorefresh(interval=1000, limit=None)
-        else:
-            st.button(
-                "▶️ Resume",
-                on_click=lambda: setattr(st.session_state, "paused", False),
-            )
-    else:
+    # The timer works out where the workout is from the clock, so a late rerun doesn't delay it.
+    timer = st.session_state.timer
+    if timer.state().done:
         # Workout complete
+        record_session()
         st.progress(1.0, text="Workout Progress")
         st.success("🎉 Workout Complete!")
+        st.button("Back to Preview", on_click=leave_timer)
+    else:
+        # The timer views are fragments so they can rerun on their own, every second for the
+        # server timer and on countdown events for the browser one.
+        if st.session_state.browser_timer:
+            st.fragment(browser_timer_view)()
+        else:
+            st.fragment(server_timer_view, run_every=1 if timer.running else None)()
+        st.button("End Workout", on_click=leave_timer)
+
+metrics.finish_rerun()